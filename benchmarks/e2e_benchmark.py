@@ -0,0 +1,145 @@
+"""
+Benchmark rcdss end to end against a local DNS stand-in.
+
+    python benchmarks/e2e_benchmark.py --threads 1,4,16,64
+
+Synthetic signed zones are served by the stand-in from standin.py, and
+rcdss is run on their dump once for every number of threads, each time
+as a new process. Reported are domains scanned per second, per-domain
+latency quantiles taken from the scan duration histogram, and peak RSS.
+Further rcdss options can be given after --, e.g. -- --engine async.
+
+rcdss has to be importable, e.g. installed with pip install -e .
+"""
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+from standin import (
+    SCENARIOS, StandIn, build_zones, parse_scenarios, write_dump,
+)
+
+SCAN_HISTOGRAM = "rcdss_scan_duration_seconds"
+
+
+def parse_buckets(path, name=SCAN_HISTOGRAM):
+    """Return sorted (upper bound, cumulative count) of a histogram"""
+    prefix = f"{name}_bucket{{"
+    buckets = {}
+    with open(path) as fh:
+        for line in fh:
+            if not line.startswith(prefix):
+                continue
+            labels, value = line[len(prefix):].rsplit("} ", 1)
+            le = labels.rsplit('le="', 1)[1].rstrip('"')
+            bound = math.inf if le == "+Inf" else float(le)
+            # Series of different labels are summed up
+            buckets[bound] = buckets.get(bound, 0) + float(value)
+    return sorted(buckets.items())
+
+
+def quantile(buckets, q):
+    """
+    Return the quantile estimated from cumulative buckets, interpolated
+    linearly within a bucket like histogram_quantile() of Prometheus.
+    """
+    if not buckets or buckets[-1][1] == 0:
+        return math.nan
+    rank = q * buckets[-1][1]
+    lower, below = 0.0, 0
+    for bound, cumulative in buckets:
+        if cumulative >= rank:
+            if bound == math.inf:
+                return lower
+            if cumulative == below:
+                return bound
+            return lower + (bound - lower) * (rank - below) / (
+                cumulative - below
+            )
+        lower, below = bound, cumulative
+    return lower
+
+
+def run_rcdss(dump, port, threads, extra_args):
+    """Run rcdss, return wall time, peak RSS in KiB and the buckets"""
+    with tempfile.NamedTemporaryFile(suffix=".prom") as metrics:
+        args = [
+            sys.executable, "-m", "rcdss", "-i", dump, "-o", os.devnull,
+            "--ns", "127.0.0.1", "--ns-port", str(port),
+            "--threads", str(threads), "--metrics-file", metrics.name,
+            *extra_args,
+        ]
+        start = time.perf_counter()
+        proc = subprocess.Popen(args, stderr=subprocess.DEVNULL)
+        # wait4() gives resource usage of the process and its children
+        _, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+        # Like os.waitstatus_to_exitcode(), new in Python 3.9
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+        if proc.returncode:
+            raise click.ClickException(
+                f"rcdss exited with {proc.returncode}: {' '.join(args)}",
+            )
+        return elapsed, rusage.ru_maxrss, parse_buckets(metrics.name)
+
+
+def parse_threads(ctx, param, value):
+    try:
+        return [int(t) for t in value.split(",")]
+    except ValueError:
+        raise click.BadParameter("comma separated numbers expected")
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option("--domains", default=400, show_default=True,
+              help="Number of signed zones")
+@click.option("--scenarios", callback=parse_scenarios, show_default=True,
+              default=",".join(s for s in SCENARIOS if s != "timeout"),
+              help="Comma separated scenarios taken by the zones in turn;"
+              " each timeout holds a thread for the resolver lifetime")
+@click.option("--threads", "threads_list", default="1,4,16,64",
+              callback=parse_threads, show_default=True,
+              help="Comma separated numbers of threads to run rcdss with")
+@click.option("--latency", default=0.0, show_default=True,
+              help="Seconds the stand-in waits before every answer")
+@click.argument("extra_args", nargs=-1, type=click.UNPROCESSED)
+def main(domains, scenarios, threads_list, latency, extra_args):
+    click.echo(f"Signing {domains} zones ({', '.join(scenarios)})")
+    zones = build_zones(domains, scenarios)
+    standin = StandIn(zones, latency=latency)
+    standin.start()
+    tmp = tempfile.NamedTemporaryFile(
+        "w", encoding="latin1", suffix=".db", delete=False,
+    )
+    try:
+        with tmp:
+            write_dump(zones, tmp)
+        click.echo(
+            f"{'threads':>8} {'time':>9} {'domains/s':>10} {'p50':>10}"
+            f" {'p99':>10} {'peak RSS':>10}",
+        )
+        for threads in threads_list:
+            elapsed, maxrss, buckets = run_rcdss(
+                tmp.name, standin.port, threads, extra_args,
+            )
+            click.echo(
+                f"{threads:>8} {elapsed:>7.2f} s {domains / elapsed:>10.1f}"
+                f" {quantile(buckets, 0.5) * 1000:>7.1f} ms"
+                f" {quantile(buckets, 0.99) * 1000:>7.1f} ms"
+                f" {maxrss / 1024:>7.1f} MiB",
+            )
+    finally:
+        os.unlink(tmp.name)
+        standin.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Generate a synthetic ripe.db.domain dump for scale testing.
+
+    python benchmarks/generate_dump.py --scale 10 ripe.db.domain.gz
+
+Objects are written the way the RIPE database exports them: a comment
+header, continuation lines, attributes ignored by the parser and
+ds-rdata in a configurable share of objects. Output ending with .gz is
+compressed with Gzip. The same seed always gives the same dump.
+"""
+import contextlib
+import datetime
+import gzip
+import random
+import sys
+
+import click
+
+# Approximate number of domain objects in the real ripe.db.domain,
+# the unit of --scale
+REAL_DUMP_OBJECTS = 800000
+
+HEADER = (
+    "# The objects in this file contain synthetic data.\n"
+    "# They are generated for testing and do not describe any real domain.\n"
+    "\n"
+)
+
+# Range of last-modified values
+FIRST_MODIFIED = datetime.datetime(2002, 1, 1, tzinfo=datetime.timezone.utc)
+LAST_MODIFIED = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+# Algorithms and digest types of ds-rdata with their weights
+ALGORITHMS = ((8, 5), (13, 4), (10, 1))
+DIGESTS = ((2, 8), (1, 1), (4, 1))
+DIGEST_LENGTHS = {1: 20, 2: 32, 4: 48}
+
+
+def domain_name(rng, i):
+    if i % 4 == 3:
+        nibbles = ".".join(f"{rng.getrandbits(4):x}" for _ in range(8))
+        return f"{nibbles}.2.0.a.2.ip6.arpa"
+    return f"{i % 256}.{i // 256 % 256}.{i // 65536 % 256 + 1}.in-addr.arpa"
+
+
+def ds_rdata(rng):
+    algorithm = rng.choices(*zip(*ALGORITHMS))[0]
+    digest_type = rng.choices(*zip(*DIGESTS))[0]
+    length = DIGEST_LENGTHS[digest_type]
+    digest = f"{rng.getrandbits(length * 8):0{length * 2}X}"
+    return f"{rng.randrange(65536)} {algorithm} {digest_type} {digest}"
+
+
+def timestamp(rng):
+    span = (LAST_MODIFIED - FIRST_MODIFIED).total_seconds()
+    t = FIRST_MODIFIED + datetime.timedelta(seconds=rng.uniform(0, span))
+    return t.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def attribute(key, value):
+    return f"{key + ':':15} {value}\n"
+
+
+def continued(rng, key, value):
+    """
+    Return attribute with the value split into continuation lines.
+    The split is inside the last field, the digest of ds-rdata,
+    as whitespace around it does not survive joining the lines.
+    """
+    start = value.rindex(" ") + 1
+    split = rng.randrange(start + 1, len(value) - 1)
+    prefix = rng.choice(("+", " " * 16, "\t"))
+    return attribute(key, value[:split]) + f"{prefix}{value[split:]}\n"
+
+
+def write_object(fh, rng, i, ds_share):
+    created = timestamp(rng)
+    lines = []
+    if rng.random() < 0.1:
+        lines.append("% Information related to the reverse delegation\n")
+    lines += [
+        attribute("domain", domain_name(rng, i)),
+        attribute("descr", f"Synthetic reverse zone {i}"),
+        attribute("admin-c", "DUMY-RIPE"),
+        attribute("tech-c", "DUMY-RIPE"),
+        attribute("zone-c", "DUMY-RIPE"),
+    ]
+    for ns in range(rng.randint(2, 4)):
+        lines.append(attribute("nserver", f"ns{ns + 1}.example{i % 97}.net"))
+    if rng.random() < ds_share:
+        for _ in range(rng.choices((1, 2, 3), (6, 3, 1))[0]):
+            value = ds_rdata(rng)
+            if rng.random() < 0.2:
+                lines.append(continued(rng, "ds-rdata", value))
+            else:
+                lines.append(attribute("ds-rdata", value))
+    if rng.random() < 0.2:
+        lines.append(continued(
+            rng, "remarks", "Zone delegated on request of the holder",
+        ))
+    lines.extend((
+        attribute("mnt-by", f"EXAMPLE{i % 13}-MNT"),
+        attribute("notify", "noc@example.net"),
+        attribute("created", created),
+        attribute("last-modified", max(created, timestamp(rng))),
+        attribute("source", "RIPE"),
+        attribute("remarks", "****************************"),
+        "\n",
+    ))
+    fh.write("".join(lines))
+
+
+def write_dump(fh, objects, ds_share=0.05, seed=0):
+    """Write a synthetic dump of that many objects to a text file"""
+    rng = random.Random(seed)
+    fh.write(HEADER)
+    for i in range(objects):
+        write_object(fh, rng, i, ds_share)
+
+
+def open_output(path, compresslevel=6):
+    if path == "-":
+        return contextlib.nullcontext(sys.stdout)
+    if path.endswith(".gz"):
+        return gzip.open(
+            path, "wt", encoding="latin1", compresslevel=compresslevel,
+        )
+    return open(path, "w", encoding="latin1")
+
+
+@click.command()
+@click.argument("output", default="-", type=click.Path(allow_dash=True))
+@click.option("--objects", type=click.IntRange(min=0),
+              help="Number of objects to generate")
+@click.option("--scale", default=1.0, show_default=True,
+              help=f"Number of objects as a multiple of the size of the real"
+              f" dump, taken as {REAL_DUMP_OBJECTS} objects")
+@click.option("--ds-share", default=0.05, show_default=True,
+              type=click.FloatRange(0, 1),
+              help="Share of objects with ds-rdata")
+@click.option("--seed", default=0, show_default=True,
+              help="Seed of the random generator")
+@click.option("--compresslevel", default=6, show_default=True,
+              type=click.IntRange(1, 9),
+              help="Gzip compression level of output ending with .gz")
+def main(output, objects, scale, ds_share, seed, compresslevel):
+    if objects is None:
+        objects = int(REAL_DUMP_OBJECTS * scale)
+    with open_output(output, compresslevel) as fh:
+        write_dump(fh, objects, ds_share, seed)
+
+
+if __name__ == "__main__":
+    main()
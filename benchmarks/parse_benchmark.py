@@ -0,0 +1,89 @@
+"""
+Compare throughput of the RPSL parsers.
+
+    python benchmarks/parse_benchmark.py [DUMP]
+
+Without DUMP, a synthetic dump is generated in a temporary file,
+see generate_dump.py. Peak memory taken by the parsed objects is
+measured in an extra run of each parser.
+rcdss has to be importable, e.g. installed with pip install -e .
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+import click
+from generate_dump import open_output, write_dump
+
+from rcdss import rpsl
+
+
+def count_objects(path):
+    with rpsl.open_dump(path) as fh:
+        return sum(1 for _ in rpsl.parse_rpsl_objects(fh))
+
+
+def run_standard(path):
+    with rpsl.open_dump(path) as fh:
+        return [
+            o for o in rpsl.parse_rpsl_objects(fh) if "ds-rdata" in o
+        ]
+
+
+def run_fast(path):
+    with rpsl.open_dump(path, binary=True) as fh:
+        return list(rpsl.parse_ds_objects(fh))
+
+
+@click.command()
+@click.argument("dump", required=False, type=click.Path(exists=True))
+@click.option("--objects", default=200000, show_default=True,
+              help="Number of objects of the synthetic dump")
+@click.option("--ds-share", default=0.05, show_default=True,
+              help="Share of synthetic objects with ds-rdata")
+@click.option("--gzip", "compress", is_flag=True,
+              help="Compress the synthetic dump with Gzip")
+@click.option("--repeat", default=3, show_default=True,
+              help="Take the best of this many runs")
+def main(dump, objects, ds_share, compress, repeat):
+    tmp = None
+    if dump is None:
+        tmp = tempfile.NamedTemporaryFile(
+            suffix=".db.gz" if compress else ".db", delete=False,
+        )
+        tmp.close()
+        with open_output(tmp.name) as fh:
+            write_dump(fh, objects, ds_share)
+        dump = tmp.name
+    try:
+        total = count_objects(dump)
+        click.echo(f"{dump}: {total} objects")
+        results = {}
+        for name, parser in [("standard", run_standard), ("fast", run_fast)]:
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                parsed = parser(dump)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = parsed
+            del parsed
+            tracemalloc.start()
+            parser(dump)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            click.echo(
+                f"{name:<10} {best:8.3f} s {total / best:12.0f} objects/s "
+                f"peak {peak / 2**20:8.1f} MiB "
+                f"({len(results[name])} with ds-rdata)",
+            )
+        if results["standard"] != results["fast"]:
+            raise click.ClickException("Parsers returned different objects")
+    finally:
+        if tmp is not None:
+            os.unlink(tmp.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Local DNS stand-in serving synthetic DNSSEC signed zones.
+
+It plays the role of the validating resolver for the end-to-end
+benchmark, answering CDS and DNSKEY queries of reverse zones according
+to their scenario:
+
+    nocds     signed zone without CDS
+    noop      CDS matching the DS in the dump
+    update    CDS of a new KSK, signed by the current one
+    delete    CDS requesting removal of the DS (RFC 8078)
+    badsig    CDS signed by a key unknown to the DS
+    timeout   no answer at all
+    truncate  CDS too large for UDP, fetched again over TCP
+    servfail  SERVFAIL answer
+
+It can also run on its own, writing the dump for rcdss:
+
+    python benchmarks/standin.py --dump dump.db --port 5353
+    rcdss -i dump.db --ns 127.0.0.1 --ns-port 5353
+"""
+import socketserver
+import struct
+import threading
+import time
+
+import click
+import dns.dnssec
+import dns.flags
+import dns.message
+import dns.name
+import dns.rcode
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.rrset
+from cryptography.hazmat.primitives.asymmetric import ec
+
+SCENARIOS = (
+    "nocds", "noop", "update", "delete", "badsig", "timeout", "truncate",
+    "servfail",
+)
+
+ALGORITHM = dns.dnssec.Algorithm.ECDSAP256SHA256
+
+# Number of extra CDS records making the truncate scenario exceed UDP size
+TRUNCATE_RECORDS = 40
+
+
+def generate_key(flags=257):
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    dnskey = dns.dnssec.make_dnskey(
+        private_key.public_key(), ALGORITHM, flags=flags,
+    )
+    return private_key, dnskey
+
+
+def make_cds(name, dnskey):
+    ds = dns.dnssec.make_ds(name, dnskey, "SHA256")
+    return dns.rdata.from_text(
+        dns.rdataclass.IN, dns.rdatatype.CDS, ds.to_text(),
+    )
+
+
+def sign(rrset, keys):
+    now = int(time.time())
+    rrsigs = dns.rrset.RRset(
+        rrset.name, dns.rdataclass.IN, dns.rdatatype.RRSIG, rrset.rdtype,
+    )
+    for private_key, dnskey in keys:
+        rrsigs.add(dns.dnssec.sign(
+            rrset, private_key, rrset.name, dnskey,
+            inception=now - 3600, expiration=now + 14 * 86400,
+        ), ttl=3600)
+    return rrsigs
+
+
+class Zone:
+    """Signed zone with DNSKEY and CDS sets of a scenario"""
+
+    def __init__(self, name, scenario):
+        self.name = dns.name.from_text(name)
+        self.scenario = scenario
+        ksk = generate_key()
+        new_ksk = generate_key()
+        self.ds_rdata = [
+            dns.dnssec.make_ds(self.name, ksk[1], "SHA256").to_text(),
+        ]
+        keys = [ksk, new_ksk] if scenario == "update" else [ksk]
+        dnskeys = dns.rrset.RRset(
+            self.name, dns.rdataclass.IN, dns.rdatatype.DNSKEY,
+        )
+        for _, dnskey in keys:
+            dnskeys.add(dnskey, ttl=3600)
+        self.rrsets = {dns.rdatatype.DNSKEY: (dnskeys, sign(dnskeys, keys))}
+        if scenario == "nocds":
+            return
+
+        cds = dns.rrset.RRset(self.name, dns.rdataclass.IN, dns.rdatatype.CDS)
+        signers = [ksk]
+        if scenario == "update":
+            cds.add(make_cds(self.name, new_ksk[1]), ttl=3600)
+        elif scenario == "delete":
+            cds.add(dns.rdata.from_text(
+                dns.rdataclass.IN, dns.rdatatype.CDS, "0 0 0 00",
+            ), ttl=3600)
+        elif scenario == "badsig":
+            other = generate_key()
+            cds.add(make_cds(self.name, other[1]), ttl=3600)
+            signers = [other]
+        else:
+            cds.add(make_cds(self.name, ksk[1]), ttl=3600)
+        if scenario == "truncate":
+            for _ in range(TRUNCATE_RECORDS):
+                cds.add(make_cds(self.name, generate_key()[1]), ttl=3600)
+        self.rrsets[dns.rdatatype.CDS] = (cds, sign(cds, signers))
+
+
+def build_zones(count, scenarios=SCENARIOS, suffix="10.in-addr.arpa."):
+    """Return zones by name, with scenarios taken in turn"""
+    zones = {}
+    for i in range(count):
+        zone = Zone(
+            f"{i % 256}.{i // 256 % 256}.{suffix}",
+            scenarios[i % len(scenarios)],
+        )
+        zones[zone.name] = zone
+    return zones
+
+
+def write_dump(zones, fh):
+    """Write domain objects of the zones, each followed by one without DS"""
+    for zone in zones.values():
+        name = zone.name.to_text(omit_final_dot=True)
+        fh.write(f"domain:         {name}\n")
+        fh.write("nserver:        ns.example.net\n")
+        for ds in zone.ds_rdata:
+            fh.write(f"ds-rdata:       {ds}\n")
+        fh.write(
+            "last-modified:  2020-01-01T00:00:00Z\n"
+            "source:         RIPE\n"
+            "\n"
+            f"domain:         unsigned.{name}\n"
+            "source:         RIPE\n"
+            "\n",
+        )
+
+
+def answer(zones, wire, tcp):
+    """Return wire format answer to the query, or None for no answer"""
+    query = dns.message.from_wire(wire)
+    response = dns.message.make_response(query)
+    response.flags |= dns.flags.AA
+    question = query.question[0]
+    zone = zones.get(question.name)
+    if zone is None:
+        response.set_rcode(dns.rcode.NXDOMAIN)
+        return response.to_wire()
+    if zone.scenario == "timeout":
+        return None
+    if zone.scenario == "servfail":
+        response.set_rcode(dns.rcode.SERVFAIL)
+        return response.to_wire()
+    rrsets = zone.rrsets.get(question.rdtype)
+    if rrsets:
+        response.answer.append(rrsets[0])
+        if query.ednsflags & dns.flags.DO:
+            response.answer.append(rrsets[1])
+    payload = query.payload if query.edns >= 0 else 512
+    out = response.to_wire(max_size=65535)
+    if not tcp and len(out) > payload:
+        response.answer = []
+        response.flags |= dns.flags.TC
+        out = response.to_wire()
+    return out
+
+
+class StandIn:
+    """
+    UDP and TCP servers answering queries for the zones, each query
+    in its own thread after `latency` seconds.
+    """
+
+    def __init__(self, zones, host="127.0.0.1", port=0, latency=0.0):
+        self.zones = zones
+        self.latency = latency
+        self.tcp_connections = 0
+        standin = self
+
+        class UDPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                data, sock = self.request
+                out = standin.answer(data, False)
+                if out:
+                    sock.sendto(out, self.client_address)
+
+        class TCPHandler(socketserver.BaseRequestHandler):
+            def handle(self):
+                standin.tcp_connections += 1
+                while True:
+                    length = self._recv(2)
+                    if length is None:
+                        return
+                    data = self._recv(struct.unpack("!H", length)[0])
+                    if data is None:
+                        return
+                    out = standin.answer(data, True)
+                    if out:
+                        self.request.sendall(struct.pack("!H", len(out)) + out)
+
+            def _recv(self, count):
+                data = b""
+                while len(data) < count:
+                    chunk = self.request.recv(count - len(data))
+                    if not chunk:
+                        return None
+                    data += chunk
+                return data
+
+        self.udp = _UDPServer((host, port), UDPHandler)
+        self.host, self.port = self.udp.server_address[:2]
+        self.tcp = _TCPServer((host, self.port), TCPHandler)
+
+    def answer(self, wire, tcp):
+        if self.latency:
+            time.sleep(self.latency)
+        return answer(self.zones, wire, tcp)
+
+    def start(self):
+        for server in (self.udp, self.tcp):
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        for server in (self.udp, self.tcp):
+            server.shutdown()
+            server.server_close()
+
+
+class _UDPServer(socketserver.ThreadingMixIn, socketserver.UDPServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def parse_scenarios(ctx, param, value):
+    scenarios = tuple(s.strip() for s in value.split(",") if s.strip())
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown or not scenarios:
+        raise click.BadParameter(
+            f"choose from {', '.join(SCENARIOS)}", ctx, param,
+        )
+    return scenarios
+
+
+@click.command()
+@click.option("--domains", default=400, show_default=True,
+              help="Number of signed zones")
+@click.option("--scenarios", default=",".join(SCENARIOS), show_default=True,
+              callback=parse_scenarios,
+              help="Comma separated scenarios taken by the zones in turn")
+@click.option("--dump", type=click.File("w"), required=True,
+              help="Write domain objects of the zones to this file")
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=5353, show_default=True)
+@click.option("--latency", default=0.0, show_default=True,
+              help="Seconds to wait before every answer")
+def main(domains, scenarios, dump, host, port, latency):
+    zones = build_zones(domains, scenarios)
+    with dump:
+        write_dump(zones, dump)
+    standin = StandIn(zones, host, port, latency)
+    standin.start()
+    click.echo(f"Serving {len(zones)} zones on {host} port {standin.port}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+if __name__ == "__main__":
+    main()
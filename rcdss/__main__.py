@@ -1,68 +1,60 @@
 
-import sys
-import gzip
-import json
-import threading
-from queue import Queue, Empty
-try:
-    from queue import SimpleQueue
-except ImportError:  # Python 3.6 lacks SimpleQueue
-    SimpleQueue = Queue
-
 import click
-import dns.resolver
-import dns.inet
 
-from .dsscanner import do_cds_scan
-from .log import setup_logger, logger
-from .stats import report_counts, report_domains
+from . import metrics
+from . import pipeline
 from . import rpsl
+from .config import setup_scanning, finish_scanning
+from .daemon import run_daemon
+from .history import HOLD_BACK, History
+from .log import setup_logger, logger
+from .reader import read_dumps
+from .retry import RetryQueue
+from .selection import POLICIES
+from .shard import ShardedScanner
+from .stats import dump_domains, report_counts, setup_stats
 from . import __version__
 
 
-def setup_resolvers(nss):
-    default_resolver = dns.resolver.get_default_resolver()
-    nameservers = []
-    for ns in nss:
-        if dns.inet.is_address(ns):
-            nameservers.append(ns)
-        else:
-            for rdtype in ["AAAA", "A"]:
-                r = dns.resolver.resolve(ns, rdtype, raise_on_no_answer=False)
-                nameservers.extend(a.address for a in r)
-    default_resolver.nameservers = nameservers
-    logger.debug("Configured DNS resolvers: %s", ", ".join(nameservers))
-
-    # If more than one nameserver is specified, then we probably want
-    # to use them all, not just the first one.
-    if len(nss) > 1:
-        default_resolver.rotate = True
-
-
-def scanThread(inq, outq):
-    while True:
-        obj = inq.get()
-        o = do_cds_scan(obj)
-        if o:
-            outq.put(o)
-        inq.task_done()
-
-
 @click.command()
 @click.option(
     "--input", "-i", "input_", type=click.Path(exists=True, dir_okay=False, ),
+    multiple=True,
     help="Read latin1 encoded file containing domain objects, "
-         "optionally compressed with Gzip, instead of standard input",
+         "optionally compressed with Gzip, instead of standard input "
+         "(may be used multiple times)",
+)
+@click.option(
+    "--fast-parser/--no-fast-parser", default=False, show_default=True,
+    help="Skip objects without ds-rdata on the byte level, "
+    "before parsing them",
+)
+@click.option(
+    "--reader-processes/--no-reader-processes", default=False,
+    show_default=True, help="Decompress and parse each input file "
+    "in its own process, all of them at once. Without it, input files "
+    "are read one after another. Needs --input",
 )
 @click.option(
-    "--output", "-o", type=click.File("w", atomic=True, lazy=False),
-    default=sys.stdout, help="Output RPSL-like file "
+    "--output", "-o", type=click.Path(dir_okay=False, writable=True),
+    help="Output file, replaced only once the scan succeeds "
     "[default: stdout]",
 )
+@click.option(
+    "--format", "output_format", type=click.Choice(sorted(rpsl.WRITERS)),
+    default="rpsl", show_default=True, help="Format of the output: "
+    "RPSL-like objects, or one JSON record per line describing the DS "
+    "change of a domain, written as soon as it is found",
+)
 @click.option(
     "--logfile", "-l", type=click.Path(dir_okay=False, writable=True,),
     help="Log file, automatically rotated",
 )
+@click.option(
+    "--log-format", type=click.Choice(["text", "json"]), default="text",
+    show_default=True, help="Format of log records, json writes one "
+    "JSON object per line",
+)
 @click.option(
     "--verbose", "-v", count=True,
     help="Increase verbosity (use twice for debug info)",
@@ -71,61 +63,262 @@ def scanThread(inq, outq):
     "--threads", "-t", default=15, type=click.IntRange(1), show_default=True,
     help="Number of scanning threads", metavar="INT",
 )
+@click.option(
+    "--processes", "-p", default=1, type=click.IntRange(1),
+    show_default=True, metavar="INT",
+    help="Number of worker processes, each with its own scanning engine. "
+    "Domains are sharded by a hash of their name",
+)
+@click.option(
+    "--engine", type=click.Choice(["threads", "async"]), default="threads",
+    show_default=True, help="Scanning engine: a pool of threads "
+    "or an asyncio event loop",
+)
+@click.option(
+    "--concurrency", "-c", default=500, type=click.IntRange(1),
+    show_default=True, metavar="INT",
+    help="Number of domains in flight with the async engine",
+)
+@click.option(
+    "--validation-processes", default=0, type=click.IntRange(0),
+    show_default=True, metavar="INT",
+    help="Number of processes validating DNSSEC signatures, "
+    "while the scanning engine only sends queries. "
+    "0 validates in the scanning engine",
+)
+@click.option(
+    "--parallel-queries/--no-parallel-queries", default=False,
+    show_default=True, help="Query DNSKEY together with CDS, saving a round "
+    "trip for domains with CDS at the cost of extra queries",
+)
 @click.option(
     "--ns", multiple=True, help="Use this nameserver"
     " (may be used multiple times)", metavar="ADDR",
 )
+@click.option(
+    "--ns-port", default=53, type=click.IntRange(1, 65535), show_default=True,
+    metavar="PORT", help="Port of the nameservers given by --ns",
+)
+@click.option(
+    "--ns-selection", type=click.Choice(POLICIES), default="random",
+    show_default=True, help="Order in which queries try the nameservers "
+    "given by --ns: at random, fastest first by smoothed RTT, or at random "
+    "weighted by RTT and error rate. Nameservers failing most queries are "
+    "tried last for a while",
+)
+@click.option(
+    "--authoritative", is_flag=True, help="Query CDS and DNSKEY directly "
+    "from all nameservers given by the nserver attributes, in parallel, "
+    "instead of the resolver. The resolver only looks up addresses of "
+    "the nameservers. Differing answers are reported as DNS_INCONSISTENT",
+)
+@click.option(
+    "--cache-size", default=10000, type=click.IntRange(min=0),
+    show_default=True, metavar="INT", help="Number of DNS answers cached "
+    "by each process, shared by all its workers. 0 disables the cache",
+)
+@click.option(
+    "--edns-bufsize", default=1200, type=click.IntRange(512, 65535),
+    show_default=True, metavar="INT",
+    help="EDNS0 UDP payload size advertised in queries",
+)
+@click.option(
+    "--reuse-connections/--no-reuse-connections", default=False,
+    show_default=True, help="Reuse sockets and keep persistent, pipelined "
+    "TCP connections to the nameservers",
+)
+@click.option(
+    "--adaptive/--no-adaptive", default=False, show_default=True,
+    help="Adapt the number of queries in flight to each nameserver "
+    "to its latency, timeouts and SERVFAILs, up to --threads "
+    "or --concurrency",
+)
+@click.option(
+    "--max-qps", type=click.FloatRange(0, min_open=True), metavar="FLOAT",
+    help="Maximum number of queries per second sent to each nameserver",
+)
+@click.option(
+    "--retries", default=0, type=click.IntRange(0), show_default=True,
+    metavar="INT", help="Number of times domains with DNS timeouts or "
+    "lame delegations are scanned again, after all the other domains",
+)
+@click.option(
+    "--retry-backoff", default=10.0, type=click.FloatRange(0),
+    show_default=True, metavar="SECONDS",
+    help="Delay before the first retry, doubled for every next one",
+)
+@click.option(
+    "--state-db", type=click.Path(dir_okay=False, writable=True,),
+    help="SQLite database remembering validation results between runs, "
+    "so that unchanged domains are not validated again",
+)
 @click.option(
     "--dump-stats", type=click.File("w", atomic=True,),
     help="Dump domain stats to a JSON file",
 )
+@click.option(
+    "--compact-stats/--no-compact-stats", default=False, show_default=True,
+    help="Keep domain stats for --dump-stats in a compact encoding, "
+    "saving memory at the cost of some CPU time",
+)
+@click.option(
+    "--metrics-file", type=click.File("w", atomic=True,),
+    help="Write timing histograms and counters to a Prometheus textfile",
+)
+@click.option(
+    "--history", type=click.File("r"), help="Order the scan using stats "
+    "written by --dump-stats in a previous run: domains that had CDS are "
+    "scanned first, domains that timed out or were lame are scanned in "
+    "the slow lane (or last, with --processes). Domains with CDS overtake "
+    f"up to {HOLD_BACK} other objects, held in memory meanwhile, and the slow "
+    "ones are held until the end with --processes",
+)
+@click.option(
+    "--slow-workers", default=4, type=click.IntRange(1), show_default=True,
+    metavar="INT", help="Number of threads, or domains in flight with "
+    "the async engine, of the slow lane",
+)
+@click.option(
+    "--slow-lifetime", default=2.0, type=click.FloatRange(0, min_open=True),
+    show_default=True, metavar="SECONDS",
+    help="Time a query in the slow lane may take",
+)
+@click.option(
+    "--daemon", is_flag=True, help="Keep running, scanning every domain "
+    "again when the TTLs or signatures of its last answers expire. "
+    "The input files are reloaded when they change. Changes are written "
+    "to files in --output-dir instead of --output",
+)
+@click.option(
+    "--output-dir", type=click.Path(exists=True, file_okay=False,
+                                    writable=True),
+    help="Directory for output files of the daemon",
+)
+@click.option(
+    "--rotate-interval", default=3600, type=click.IntRange(1),
+    show_default=True, metavar="SECONDS",
+    help="Start a new output file of the daemon after this many seconds",
+)
 @click.version_option(__version__)
-def main(input_, output, logfile, verbose, threads, ns, dump_stats):
+def main(
+    input_, fast_parser, reader_processes, output, output_format, logfile,
+    log_format, verbose, processes, threads, engine, concurrency,
+    validation_processes, parallel_queries, ns, ns_port, ns_selection,
+    authoritative, cache_size, edns_bufsize, reuse_connections, adaptive,
+    max_qps, retries, retry_backoff, state_db, dump_stats, compact_stats,
+    metrics_file, history, slow_workers, slow_lifetime, daemon, output_dir,
+    rotate_interval,
+):
     """
     Scan for CDS record for given DOMAIN objects.
     """
-    setup_logger(logfile, verbose)
-
-    if input_ is None:
-        inf = sys.stdin
-    elif input_.lower().endswith(".gz"):
-        inf = gzip.open(input_, "rt", encoding="latin1")
-    else:
-        inf = open(input_, "rt", encoding="latin1")
-
-    if ns:
-        setup_resolvers(ns)
+    if processes > 1 and validation_processes:
+        raise click.UsageError(
+            "--validation-processes cannot be used with --processes",
+        )
+    if reader_processes and not input_:
+        raise click.UsageError(
+            "--reader-processes needs --input files, "
+            "standard input is read by the main process",
+        )
+    if daemon:
+        check_daemon_options(
+            input_, output, output_dir, processes, reader_processes, retries,
+            dump_stats, history,
+        )
+    setup_logger(logfile, verbose, log_format)
+    if not dump_stats:
+        # Only counts are reported
+        setup_stats("none")
+    elif compact_stats:
+        setup_stats("compact")
 
-    inq = Queue()
-    outq = SimpleQueue()
+    # Reader, shard and validation processes are forked while the thread
+    # of the logger runs, on purpose: they write records themselves,
+    # see log._log_directly()
+    if not daemon:
+        objects = read_dumps(input_, fast_parser, reader_processes)
 
-    for _ in range(threads):
-        threading.Thread(
-            target=scanThread,
-            args=(inq, outq,),
-            daemon=True,
-        ).start()
+    options = dict(
+        ns=ns,
+        ns_port=ns_port,
+        ns_selection=ns_selection,
+        authoritative=authoritative,
+        cache_size=cache_size,
+        edns_bufsize=edns_bufsize,
+        reuse_connections=reuse_connections,
+        state_db=state_db,
+        parallel_queries=parallel_queries,
+        adaptive=adaptive,
+        # Every worker process sends its share of the queries
+        max_qps=max_qps / processes if max_qps else None,
+    )
+    retry_queue = None
+    if retries:
+        retry_queue = RetryQueue(retries + 1, retry_backoff)
+    slow_lane = None
+    if history is not None:
+        with history:
+            previous = History.load(history)
+        if processes > 1:
+            objects = previous.order(objects)
+        else:
+            slow_lane = pipeline.SlowLane(slow_workers, slow_lifetime)
+            objects = previous.order(objects, slow_lane.put)
+    if processes > 1:
+        scanner = ShardedScanner(
+            processes, options, engine, threads, concurrency, retry_queue,
+        )
+        scanner.start()
+    else:
+        setup_scanning(
+            engine=engine, threads=threads, concurrency=concurrency,
+            validation_processes=validation_processes, **options,
+        )
 
-    for obj in filter(
-        lambda obj: "ds-rdata" in obj,
-        rpsl.parse_rpsl_objects(inf),
-    ):
-        inq.put(obj)
+    if daemon:
+        run_daemon(
+            input_, output_dir, fast_parser, engine, threads, concurrency,
+            rotate_interval, output_format,
+        )
+    else:
+        with pipeline.atomic_output(output) as fh, pipeline.Writer(
+            fh, output_format=output_format,
+        ) as outq:
+            if processes > 1:
+                scanner.scan_objects(objects, outq)
+            else:
+                pipeline.run_engine(
+                    objects, outq, engine, threads, concurrency, retry_queue,
+                    slow_lane,
+                )
+    finish_scanning()
 
-    inq.join()
-    try:
-        while True:
-            o = outq.get_nowait()
-            print(rpsl.write_rpsl_object(o), file=output)
-    except Empty:
-        pass
     logger.info("Finished. Here are some stats:\n%s", report_counts())
     if dump_stats:
-        json.dump(
-            {k.name: v for k, v in report_domains().items()},
-            dump_stats,
-            indent=4,
-        )
+        dump_domains(dump_stats)
+    if metrics_file:
+        metrics.write_prometheus(metrics_file)
+
+
+def check_daemon_options(
+    input_, output, output_dir, processes, reader_processes, retries,
+    dump_stats, history,
+):
+    if not input_:
+        raise click.UsageError("--daemon needs --input files to watch")
+    if output_dir is None:
+        raise click.UsageError("--daemon needs --output-dir")
+    for name, value in [
+        ("--output", output),
+        ("--processes", processes > 1),
+        ("--reader-processes", reader_processes),
+        ("--retries", retries),
+        ("--dump-stats", dump_stats),
+        ("--history", history),
+    ]:
+        if value:
+            raise click.UsageError(f"{name} cannot be used with --daemon")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+"""
+Asyncio based scanning engine.
+
+The checks are the same as in the threaded engine, only DNS queries
+are sent using dns.asyncresolver, so that thousands of domains can be
+in flight on a single thread.
+"""
+import asyncio
+import resource
+import time
+
+import dns
+import dns.asyncresolver
+import dns.resolver
+
+from .dsscanner import (
+    finish_validation, get_authoritative, get_domain_name,
+    get_validation_pool, make_resolver, prepare_validation, query_outcome,
+    record_query_result,
+)
+from .log import logger
+from .metrics import QUERY_DURATION, SCAN_DURATION
+from .ratelimit import admission_async
+from .stats import record, Event
+
+# Send DNSKEY queries alongside CDS queries, see setup_parallel_queries()
+_parallel_queries = False
+
+
+def setup_parallel_queries():
+    """Send the DNSKEY query at the same time as the CDS query"""
+    global _parallel_queries
+    _parallel_queries = True
+
+
+async def do_cds_scan(obj):
+    """
+    Asynchronous variant of dsscanner.do_cds_scan()
+    """
+    domain = get_domain_name(obj)
+    logger.info("Processing domain: %s", domain)
+    nservers = obj.get("nserver", [])
+
+    dnskey_task = None
+    if _parallel_queries:
+        dnskey_task = asyncio.ensure_future(
+            _query_dns(domain, "DNSKEY", nservers),
+        )
+    try:
+        cds = await query_dns(domain, "CDS", nservers)
+    except BaseException:
+        if dnskey_task is not None:
+            dnskey_task.cancel()
+        raise
+    if cds is None or cds.rrset is None:
+        if dnskey_task is not None:
+            dnskey_task.cancel()
+        if cds is None:
+            record(domain, Event.DNS_FAILURE)
+        else:
+            record(domain, Event.NO_CDS)
+        return None
+    if dnskey_task is not None:
+        dnskeyset = record_query_result(domain, *await dnskey_task)
+    else:
+        dnskeyset = await query_dns(domain, "DNSKEY", nservers)
+    if dnskeyset is None or dnskeyset.rrset is None:
+        record(domain, Event.DNS_FAILURE)
+        return None
+    return await evaluate_cds(obj, domain, cds, dnskeyset)
+
+
+async def evaluate_cds(obj, domain, cds, dnskeyset):
+    """
+    Asynchronous variant of dsscanner.evaluate_cds(),
+    awaiting the validation pool instead of blocking on it
+    """
+    pending = prepare_validation(obj, domain, cds, dnskeyset)
+    if pending is None:
+        return None
+    pool = get_validation_pool()
+    if pending.verdict is None and pool is not None:
+        return await asyncio.wrap_future(pool.submit(pending, block=False))
+    return finish_validation(pending)
+
+
+async def query_dns(domain, rdtype="CDS", nservers=()):
+    """Make a query to the local resolver. Return answer object."""
+    return record_query_result(
+        domain, *await _query_dns(domain, rdtype, nservers),
+    )
+
+
+async def _query_dns(domain, rdtype, nservers=()):
+    """
+    Asynchronous variant of dsscanner._query_dns()
+    """
+    start = time.perf_counter()
+    authoritative = get_authoritative()
+    if authoritative is not None:
+        answer, event = await authoritative.query_async(
+            domain, rdtype, nservers,
+        )
+    else:
+        answer, event = await _resolve(domain, rdtype)
+    QUERY_DURATION.observe(
+        time.perf_counter() - start, rdtype, query_outcome(answer, event),
+    )
+    return answer, event
+
+
+async def _resolve(domain, rdtype):
+    resolver = make_resolver(dns.asyncresolver.Resolver)
+    try:
+        async with admission_async(resolver):
+            answer = await resolver.resolve(
+                domain, rdtype, raise_on_no_answer=False,
+            )
+        return answer, None
+    except dns.resolver.NoNameservers:
+        # Is this a DNSSEC failure?
+        try:
+            resolver.flags |= dns.flags.CD
+            # Not to be served to validating queries, see dsscanner
+            resolver.cache = None
+            await resolver.resolve(domain, rdtype, raise_on_no_answer=False)
+            logger.warning("Bogus DNSSEC for domain: %s", domain)
+            return None, Event.DNS_BOGUS
+        except dns.exception.DNSException as e:
+            logger.warning("Non-DNSSEC related exception: %s", e)
+            return None, Event.DNS_LAME
+    except dns.resolver.Timeout:
+        logger.warning("DNS timeout for domain: %s", domain)
+        return None, Event.DNS_TIMEOUT
+    except dns.exception.DNSException as e:
+        logger.warning("DNS exception: %s", e)
+    return None, None
+
+
+def raise_nofile_limit(concurrency):
+    """
+    Every query in flight holds a socket. Raise the soft limit of open
+    files up to the hard limit if the concurrency needs it.
+    """
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = concurrency + 64
+    if soft == resource.RLIM_INFINITY or soft >= wanted:
+        return
+    if hard != resource.RLIM_INFINITY:
+        wanted = min(wanted, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+        logger.debug("Raised limit of open files to %d", wanted)
+    except (ValueError, OSError) as e:
+        logger.warning("Cannot raise limit of open files: %s", e)
+
+
+async def _scan_worker(queue, outq, scan):
+    while True:
+        obj = await queue.get()
+        start = time.perf_counter()
+        try:
+            o = await scan(obj)
+            if o:
+                outq.put(o)
+        except Exception:
+            logger.exception("Unexpected error while scanning")
+        finally:
+            SCAN_DURATION.observe(time.perf_counter() - start)
+            queue.task_done()
+
+
+async def _scan_objects(objects, concurrency, outq, scan, monitor):
+    queue = asyncio.Queue(maxsize=concurrency)
+    if monitor is not None:
+        monitor.watch("scanning", queue.qsize)
+    workers = [
+        asyncio.ensure_future(_scan_worker(queue, outq, scan))
+        for _ in range(concurrency)
+    ]
+    if hasattr(objects, "__aiter__"):
+        async for obj in objects:
+            await queue.put(obj)
+    else:
+        for obj in objects:
+            await queue.put(obj)
+    await queue.join()
+    for w in workers:
+        w.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+
+
+def scan_objects(objects, concurrency, outq, scan=do_cds_scan, monitor=None):
+    """
+    Scan all objects with up to `concurrency` domains in flight,
+    putting modified objects into `outq`.
+    """
+    raise_nofile_limit(concurrency * (2 if _parallel_queries else 1))
+    asyncio.run(_scan_objects(objects, concurrency, outq, scan, monitor))
+
+
+def scan_queue(inq, concurrency, outq, scan=do_cds_scan):
+    """
+    Scan objects taken from a queue.Queue until None, with up to
+    `concurrency` domains in flight. The queue is waited for in another
+    thread, so that the scans in flight go on meanwhile.
+    """
+    raise_nofile_limit(concurrency * (2 if _parallel_queries else 1))
+    asyncio.run(_scan_objects(_iter_queue(inq), concurrency, outq, scan, None))
+
+
+async def _iter_queue(inq):
+    loop = asyncio.get_running_loop()
+    while True:
+        obj = await loop.run_in_executor(None, inq.get)
+        if obj is None:
+            return
+        yield obj
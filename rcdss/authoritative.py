@@ -0,0 +1,309 @@
+"""
+Queries sent directly to the authoritative nameservers of the domains.
+
+Instead of asking the recursive resolver, CDS and DNSKEY queries go to
+all addresses of the nserver hosts of the domain object, in parallel.
+The CDS set has to be the same on all of them (RFC 7344 section 4.1),
+so differing answers are reported as a distinct failure. Servers
+failing to answer are tolerated as long as some of them answer.
+An authoritative NXDOMAIN fails the query without an event, like
+an NXDOMAIN from the resolver, so that the stats of both modes agree.
+
+Addresses of the nameserver hosts are looked up through the resolver
+and cached, as many domains share the same nameservers. Addresses
+given in the nserver attribute as glue are used without a lookup.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import dns.asyncquery
+import dns.asyncresolver
+import dns.exception
+import dns.flags
+import dns.inet
+import dns.message
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+
+from .log import logger
+from .metrics import CACHE_REQUESTS, EXCHANGE_DURATION
+from .ratelimit import exchange_outcome
+from .stats import Event
+
+# Seconds to wait for an answer of a single server, over UDP and TCP each
+QUERY_TIMEOUT = 3.0
+
+# Seconds to keep addresses of a nameserver host, at most and when
+# the lookup failed
+MAX_ADDRESS_TTL = 3600
+NEGATIVE_ADDRESS_TTL = 300
+
+
+def parse_nserver(value):
+    """
+    Return host name and glue addresses of an nserver attribute,
+    e.g. "ns1.example.net" or "ns1.2.0.192.in-addr.arpa 192.0.2.1".
+    """
+    host, *glue = value.split()
+    host = host.lower()
+    if not host.endswith("."):
+        host += "."
+    return host, [a for a in glue if dns.inet.is_address(a)]
+
+
+class NSAddressCache:
+    """
+    Addresses of nameserver hosts, shared by all threads and tasks.
+    A host is looked up only once at a time, concurrent lookups of
+    the same host wait for the first one.
+    """
+
+    def __init__(self, make_resolver):
+        # Called as make_resolver() or make_resolver(resolver_class)
+        # to get a new resolver for every lookup
+        self.make_resolver = make_resolver
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, host):
+        """Return addresses of the host"""
+        addresses, future = self._claim(host)
+        if addresses is not None:
+            return addresses
+        if future is not None:
+            return future.result()
+        try:
+            addresses, ttl = self._resolve(host, self.make_resolver())
+        except BaseException:
+            self._store(host, [], NEGATIVE_ADDRESS_TTL)
+            raise
+        return self._store(host, addresses, ttl)
+
+    async def lookup_async(self, host):
+        """Return addresses of the host, without blocking the event loop"""
+        addresses, future = self._claim(host)
+        if addresses is not None:
+            return addresses
+        if future is not None:
+            return await asyncio.wrap_future(future)
+        resolver = self.make_resolver(dns.asyncresolver.Resolver)
+        try:
+            addresses, ttl = await self._resolve_async(host, resolver)
+        except BaseException:
+            self._store(host, [], NEGATIVE_ADDRESS_TTL)
+            raise
+        return self._store(host, addresses, ttl)
+
+    def _claim(self, host):
+        """
+        Return cached addresses, or a Future of them if another lookup
+        is in progress. If both are None, the caller has to look the
+        host up and store the result.
+        """
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1], None
+            future = self._pending.get(host)
+            if future is not None:
+                self.hits += 1
+                return None, future
+            self.misses += 1
+            self._pending[host] = Future()
+            return None, None
+
+    def _store(self, host, addresses, ttl):
+        with self._lock:
+            self._entries[host] = (time.monotonic() + ttl, addresses)
+            future = self._pending.pop(host)
+        future.set_result(addresses)
+        return addresses
+
+    def _resolve(self, host, resolver):
+        answers = []
+        for rdtype in ["AAAA", "A"]:
+            try:
+                answers.append(
+                    resolver.resolve(host, rdtype, raise_on_no_answer=False),
+                )
+            except dns.exception.DNSException as e:
+                logger.debug("Cannot resolve nameserver %s: %s", host, e)
+        return _addresses(host, answers)
+
+    async def _resolve_async(self, host, resolver):
+        answers = []
+        for rdtype in ["AAAA", "A"]:
+            try:
+                answers.append(await resolver.resolve(
+                    host, rdtype, raise_on_no_answer=False,
+                ))
+            except dns.exception.DNSException as e:
+                logger.debug("Cannot resolve nameserver %s: %s", host, e)
+        return _addresses(host, answers)
+
+
+def _addresses(host, answers):
+    """Return addresses and their TTL from answers of a lookup"""
+    addresses = []
+    ttl = MAX_ADDRESS_TTL
+    for answer in answers:
+        if answer.rrset is not None:
+            addresses.extend(rd.address for rd in answer.rrset)
+            ttl = min(ttl, answer.rrset.ttl)
+    if not addresses:
+        logger.debug("Nameserver %s has no address", host)
+        ttl = NEGATIVE_ADDRESS_TTL
+    return addresses, ttl
+
+
+class AuthoritativeResolver:
+    """
+    Sends a query to all authoritative servers of a domain and checks
+    that they agree. Queries of the threaded engine are sent by a pool
+    of `workers` threads.
+    """
+
+    def __init__(self, workers, address_cache, payload=1200, port=53,
+                 timeout=QUERY_TIMEOUT):
+        self.address_cache = address_cache
+        self.payload = payload
+        self.port = port
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="authoritative",
+        )
+
+    def close(self):
+        self.executor.shutdown()
+        CACHE_REQUESTS.add(self.address_cache.hits, "nameserver", "hit")
+        CACHE_REQUESTS.add(self.address_cache.misses, "nameserver", "miss")
+
+    def query(self, domain, rdtype, nservers):
+        """
+        Query all servers given by values of nserver attributes.
+        Return answer object and an Event describing the failure, if any,
+        like dsscanner._query_dns().
+        """
+        addresses = []
+        for host, glue in map(parse_nserver, nservers):
+            addresses.extend(glue or self.address_cache.lookup(host))
+        query = self._make_query(domain, rdtype)
+        futures = [
+            self.executor.submit(self._exchange, query, address)
+            for address in dict.fromkeys(addresses)
+        ]
+        return self._combine(domain, rdtype, [f.result() for f in futures])
+
+    async def query_async(self, domain, rdtype, nservers):
+        """Asynchronous variant of query()"""
+        hosts = [parse_nserver(value) for value in nservers]
+        lookups = await asyncio.gather(*(
+            self.address_cache.lookup_async(host)
+            for host, glue in hosts if not glue
+        ))
+        addresses = [a for _, glue in hosts for a in glue]
+        for found in lookups:
+            addresses.extend(found)
+        query = self._make_query(domain, rdtype)
+        results = await asyncio.gather(*(
+            self._exchange_async(query, address)
+            for address in dict.fromkeys(addresses)
+        ))
+        return self._combine(domain, rdtype, results)
+
+    def _make_query(self, domain, rdtype):
+        query = dns.message.make_query(
+            domain, rdtype, use_edns=0, want_dnssec=True,
+            payload=self.payload,
+        )
+        query.flags &= ~dns.flags.RD
+        return query
+
+    def _exchange(self, query, address):
+        start = time.perf_counter()
+        try:
+            response, tcp = dns.query.udp_with_fallback(
+                query, address, timeout=self.timeout, port=self.port,
+            )
+        except (dns.exception.DNSException, OSError) as e:
+            return self._observe(start, address, None, e)
+        return self._observe(start, address, response, None, tcp)
+
+    async def _exchange_async(self, query, address):
+        start = time.perf_counter()
+        try:
+            response, tcp = await dns.asyncquery.udp_with_fallback(
+                query, address, timeout=self.timeout, port=self.port,
+            )
+        except (dns.exception.DNSException, OSError) as e:
+            return self._observe(start, address, None, e)
+        return self._observe(start, address, response, None, tcp)
+
+    def _observe(self, start, address, response, error, tcp=False):
+        EXCHANGE_DURATION.observe(
+            time.perf_counter() - start, "tcp" if tcp else "udp",
+            exchange_outcome(response, error),
+        )
+        return address, response, error
+
+    def _combine(self, domain, rdtype, results):
+        """Return the answer all servers agree on, see query()"""
+        name = dns.name.from_text(domain)
+        answers = []
+        nxdomain = []
+        timeouts = 0
+        for address, response, error in results:
+            if error is not None:
+                logger.debug("%s failed for %s: %r", address, domain, error)
+                timeouts += isinstance(error, dns.exception.Timeout)
+            elif not response.flags & dns.flags.AA or response.rcode() not in (
+                dns.rcode.NOERROR, dns.rcode.NXDOMAIN,
+            ):
+                logger.debug("%s is not authoritative for %s", address, domain)
+            elif response.rcode() == dns.rcode.NXDOMAIN:
+                nxdomain.append(address)
+            else:
+                answers.append(dns.resolver.Answer(
+                    name, dns.rdatatype.from_text(rdtype), dns.rdataclass.IN,
+                    response, address, self.port,
+                ))
+        if nxdomain and answers:
+            logger.warning(
+                "Nameservers of %s disagree on its existence: %s", domain,
+                ", ".join(nxdomain + [str(a.nameserver) for a in answers]),
+            )
+            return None, Event.DNS_INCONSISTENT
+        if nxdomain:
+            # No event, like an NXDOMAIN from the resolver
+            logger.warning(
+                "DNS exception: %s", dns.resolver.NXDOMAIN(qnames=[name]),
+            )
+            return None, None
+        if not answers:
+            if results and timeouts == len(results):
+                logger.warning("DNS timeout for domain: %s", domain)
+                return None, Event.DNS_TIMEOUT
+            logger.warning("No authoritative answer for domain: %s", domain)
+            return None, Event.DNS_LAME
+        rdatasets = {
+            frozenset(a.rrset) if a.rrset is not None else frozenset()
+            for a in answers
+        }
+        if len(rdatasets) > 1:
+            logger.warning(
+                "Nameservers of %s disagree on %s: %s", domain, rdtype,
+                ", ".join(str(a.nameserver) for a in answers),
+            )
+            return None, Event.DNS_INCONSISTENT
+        return answers[0], None
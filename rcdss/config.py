@@ -0,0 +1,100 @@
+"""
+Configuration of scanning.
+
+Everything is set up by a single call of setup_scanning() with plain
+arguments, so that worker processes can configure themselves the same
+way as the main process.
+"""
+import dns.flags
+import dns.inet
+import dns.resolver
+
+from . import asyncscanner
+from . import dsscanner
+from . import ratelimit
+from . import selection
+from . import transport
+from .log import logger
+from .state import setup_state_store, close_state_store
+
+# Number of threads sending queries to nameservers of a domain at once
+# in the authoritative mode, per scanning thread
+AUTHORITATIVE_FANOUT = 4
+
+
+def setup_scanning(
+    ns=(), ns_port=53, edns_bufsize=1200, reuse_connections=False,
+    state_db=None, engine="threads", threads=1, concurrency=1,
+    parallel_queries=False, validation_processes=0, adaptive=False,
+    max_qps=None, authoritative=False, cache_size=0, ns_selection="random",
+):
+    """Configure scanning in the current process"""
+    if validation_processes:
+        # Started first, as the processes may be forked
+        dsscanner.setup_validation_pool(validation_processes)
+    if cache_size:
+        dsscanner.setup_answer_cache(cache_size)
+    setup_resolvers(ns, edns_bufsize, reuse_connections, ns_port)
+    selection.setup_selection(ns_selection)
+    # Queries in flight are bounded by the engine anyway
+    max_inflight = concurrency if engine == "async" else threads
+    if parallel_queries:
+        max_inflight *= 2
+    ratelimit.throttle_nameservers(
+        dns.resolver.get_default_resolver(),
+        max_inflight if adaptive else None,
+        max_qps,
+    )
+    if state_db:
+        setup_state_store(state_db)
+    if authoritative:
+        # Threads of the threaded engine wait for queries sent to all
+        # nameservers of their domains, the async engine needs none
+        workers = 1 if engine == "async" else threads * AUTHORITATIVE_FANOUT
+        if parallel_queries:
+            workers *= 2
+        dsscanner.setup_authoritative(workers, edns_bufsize)
+    if parallel_queries:
+        if engine == "async":
+            asyncscanner.setup_parallel_queries()
+        else:
+            dsscanner.setup_parallel_queries(threads)
+
+
+def finish_scanning():
+    """Release resources set up by setup_scanning()"""
+    ratelimit.report_nameservers(dns.resolver.get_default_resolver())
+    selection.report_health(dns.resolver.get_default_resolver())
+    dsscanner.close_authoritative()
+    dsscanner.close_answer_cache()
+    dsscanner.close_validation_pool()
+    close_state_store()
+
+
+def setup_resolvers(nss, edns_bufsize=1200, reuse_connections=False,
+                    port=53):
+    default_resolver = dns.resolver.get_default_resolver()
+    default_resolver.use_edns(0, dns.flags.DO, edns_bufsize)
+    if nss:
+        setup_nameservers(default_resolver, nss)
+        default_resolver.port = port
+    if reuse_connections:
+        transport.pool_nameservers(default_resolver)
+
+
+def setup_nameservers(default_resolver, nss):
+    nameservers = []
+    for ns in nss:
+        if dns.inet.is_address(ns):
+            nameservers.append(ns)
+        else:
+            for rdtype in ["AAAA", "A"]:
+                r = dns.resolver.resolve(ns, rdtype, raise_on_no_answer=False)
+                nameservers.extend(a.address for a in r)
+    default_resolver.nameservers = nameservers
+    logger.debug("Configured DNS resolvers: %s", ", ".join(nameservers))
+
+    # If more than one nameserver is specified, then we probably want
+    # to use them all, not just the first one.
+    if len(nss) > 1:
+        default_resolver.rotate = True
@@ -0,0 +1,403 @@
+"""
+Long-running scanning of the domains of a dump kept in memory.
+
+Instead of rescanning every domain in every run, each domain is
+scanned again only once something could have changed: when the
+answers from its last scan expire from caches, or when a signature
+expires or becomes valid. Domains are kept in a priority queue ordered
+by the time of their next check. The dump is reloaded when its file
+changes, new and modified domains are scanned right away.
+
+Pending DS changes are written to output files as they are found,
+a new file is started every rotation interval. A change is written
+once, not again on every rescan finding it still pending.
+"""
+import datetime
+import heapq
+import os
+import signal
+import threading
+import time
+from queue import Empty, Queue
+
+from . import asyncscanner
+from . import dsscanner
+from . import pipeline
+from . import rpsl
+from .dsscanner import collect_answers, get_domain_name, get_rrsigset
+from .log import logger
+from .reader import ReaderError, read_dumps
+from .stats import release_shard
+
+# Bounds of the number of seconds between two checks of a domain
+MIN_INTERVAL = 300
+MAX_INTERVAL = 86400
+
+# Seconds before checking again a domain whose scan failed
+RETRY_INTERVAL = 900
+
+# Seconds between checks whether the dump files changed
+RELOAD_INTERVAL = 60
+
+# Maximum number of due domains scanned at once
+BATCH_SIZE = 1000
+
+# Suffixes of output files by the output format
+OUTPUT_SUFFIXES = {
+    "rpsl": ".txt",
+    "ndjson": ".ndjson",
+}
+
+
+def next_check(answers, now):
+    """
+    Return time of the next check of a domain, given answers collected
+    during its last scan. The check is due when any of the answers
+    expires, or when a signature in them expires or becomes valid.
+    """
+    if not answers or any(answer is None for answer in answers):
+        return now + RETRY_INTERVAL
+    times = []
+    for answer in answers:
+        times.append(answer.expiration)
+        try:
+            rrsigs = get_rrsigset(answer.response)
+        except KeyError:
+            continue
+        for rrsig in rrsigs:
+            times.append(rrsig.expiration)
+            if rrsig.inception > now:
+                times.append(rrsig.inception)
+    return min(max(min(times), now + MIN_INTERVAL), now + MAX_INTERVAL)
+
+
+class Scheduler:
+    """
+    Domains in memory, each with the time of its next check.
+    Superseded entries of the heap are skipped when popped.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._objects = {}
+        self._due = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._objects)
+
+    def update(self, objects, now):
+        """
+        Replace all the domains. New and modified ones are due now,
+        removed ones are dropped. Return names of modified domains.
+        """
+        objects = {get_domain_name(obj): obj for obj in objects}
+        modified = set()
+        with self._lock:
+            for domain, obj in objects.items():
+                old = self._objects.get(domain)
+                if old != obj:
+                    if old is not None:
+                        modified.add(domain)
+                    self._push(domain, now)
+            for domain in self._objects.keys() - objects.keys():
+                self._due.pop(domain, None)
+            self._objects = objects
+        return modified
+
+    def reschedule(self, domain, due):
+        """Set the next check of the domain, unless one is due sooner"""
+        with self._lock:
+            if domain in self._objects:
+                self._push(domain, due)
+
+    def pop_due(self, now, limit=BATCH_SIZE):
+        """
+        Return copies of up to `limit` objects due at `now`. They are not
+        scheduled again until rescheduled after their scan.
+        """
+        objects = []
+        with self._lock:
+            while self._heap and len(objects) < limit:
+                due, domain = self._heap[0]
+                if self._due.get(domain) != due:
+                    heapq.heappop(self._heap)
+                elif due <= now:
+                    heapq.heappop(self._heap)
+                    del self._due[domain]
+                    # Scans modify the objects they return
+                    objects.append(self._objects[domain].copy())
+                else:
+                    break
+        return objects
+
+    def next_due(self):
+        """Return time of the next check, None if nothing is scheduled"""
+        with self._lock:
+            while self._heap:
+                due, domain = self._heap[0]
+                if self._due.get(domain) == due:
+                    return due
+                heapq.heappop(self._heap)
+        return None
+
+    def _push(self, domain, due):
+        current = self._due.get(domain)
+        if current is not None and current <= due:
+            return
+        self._due[domain] = due
+        heapq.heappush(self._heap, (due, domain))
+
+
+class DumpWatcher:
+    """Dump files, parsed again whenever their modification time changes"""
+
+    def __init__(self, paths, fast=False):
+        self.paths = paths
+        self.fast = fast
+        self.mtimes = None
+
+    def poll(self):
+        """Return list of all objects if the dumps changed, None otherwise"""
+        try:
+            mtimes = [os.stat(path).st_mtime_ns for path in self.paths]
+        except OSError as e:
+            logger.warning("Cannot check dump: %s", e)
+            return None
+        if mtimes == self.mtimes:
+            return None
+        try:
+            objects = list(read_dumps(self.paths, self.fast))
+        except (OSError, ReaderError) as e:
+            # Try again on the next poll
+            logger.warning("Cannot reload dump: %s", e)
+            return None
+        self.mtimes = mtimes
+        logger.info("Loaded %s domains with ds-rdata", len(objects))
+        return objects
+
+
+class RotatingOutput:
+    """
+    File-like output starting a new file every `interval` seconds.
+    A file is written under a temporary name and renamed once complete,
+    no file is created for an interval without any output.
+    """
+
+    def __init__(
+        self, directory, interval=3600, prefix="rcdss", suffix=".txt",
+    ):
+        self.directory = directory
+        self.interval = interval
+        self.prefix = prefix
+        self.suffix = suffix
+        self.fh = None
+        self.path = None
+        self.opened = None
+        # Whether an object is written only partly, until flushed
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            if self.fh is None:
+                self._open()
+            self.fh.write(text)
+            self.dirty = True
+
+    def flush(self):
+        """Flush a complete object, rotating the file if it is old enough"""
+        with self._lock:
+            if self.fh is not None:
+                self.fh.flush()
+            self.dirty = False
+        self.rotate_if_due()
+
+    def rotate_if_due(self):
+        with self._lock:
+            if (
+                self.fh is not None and not self.dirty and
+                time.monotonic() - self.opened >= self.interval
+            ):
+                self._close()
+
+    def close(self):
+        with self._lock:
+            if self.fh is not None:
+                self._close()
+
+    def _open(self):
+        stamp = datetime.datetime.now(datetime.timezone.utc)
+        name = f"{self.prefix}-{stamp:%Y%m%dT%H%M%S%fZ}{self.suffix}"
+        self.path = os.path.join(self.directory, name)
+        self.fh = open(f"{self.path}.tmp", "w", encoding="latin1")
+        self.opened = time.monotonic()
+
+    def _close(self):
+        self.fh.close()
+        os.replace(f"{self.path}.tmp", self.path)
+        logger.info("Written %s", self.path)
+        self.fh = None
+
+
+class ChangeFilter:
+    """
+    Queue-like wrapper passing only modified objects that differ
+    from the last one passed for the same domain.
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.emitted = {}
+        self._lock = threading.Lock()
+
+    def put(self, obj):
+        domain = get_domain_name(obj)
+        text = rpsl.write_rpsl_object(obj)
+        with self._lock:
+            if self.emitted.get(domain) == text:
+                logger.debug("Change of %s already written", domain)
+                return
+            self.emitted[domain] = text
+        self.queue.put(obj)
+
+    def forget(self, domains):
+        """Pass the next change of the domains even if already passed"""
+        with self._lock:
+            for domain in domains:
+                self.emitted.pop(domain, None)
+
+
+def rescheduling(scheduler, scan):
+    """Return variant of the scan function scheduling the next check"""
+    def scan_and_reschedule(obj):
+        domain = get_domain_name(obj)
+        with collect_answers() as answers:
+            try:
+                return scan(obj)
+            finally:
+                scheduler.reschedule(domain, next_check(answers, time.time()))
+    return scan_and_reschedule
+
+
+def rescheduling_async(scheduler, scan):
+    """Asynchronous variant of rescheduling()"""
+    async def scan_and_reschedule(obj):
+        domain = get_domain_name(obj)
+        with collect_answers() as answers:
+            try:
+                return await scan(obj)
+            finally:
+                scheduler.reschedule(domain, next_check(answers, time.time()))
+    return scan_and_reschedule
+
+
+def start_scanners(inq, outq, scan, engine, threads, concurrency):
+    """
+    Start threads scanning objects taken from `inq` until pipeline.STOP,
+    one per scanning thread or a single one running the async engine.
+    Return the threads.
+    """
+    if engine == "async":
+        scanners = [threading.Thread(
+            target=_scan_queue, args=(inq, concurrency, outq, scan),
+            daemon=True,
+        )]
+    else:
+        scanners = [
+            threading.Thread(
+                target=pipeline.scan_thread, args=(inq, outq, scan),
+                daemon=True,
+            ) for _ in range(threads)
+        ]
+    for scanner in scanners:
+        scanner.start()
+    return scanners
+
+
+def _scan_queue(inq, concurrency, outq, scan):
+    try:
+        asyncscanner.scan_queue(inq, concurrency, outq, scan)
+    finally:
+        release_shard()
+
+
+def stop_scanners(inq, scanners):
+    """Drop objects not taken yet, wait for the scans in flight"""
+    while True:
+        try:
+            inq.get_nowait()
+        except Empty:
+            break
+    for _ in scanners:
+        inq.put(pipeline.STOP)
+    for scanner in scanners:
+        scanner.join()
+
+
+def run_daemon(
+    paths, output_dir, fast=False, engine="threads", threads=1,
+    concurrency=1, rotate_interval=3600, output_format="rpsl", stop=None,
+):
+    """
+    Scan domains of the dumps whenever they are due, until `stop`
+    is set, or SIGTERM or SIGINT is received. Due domains are fed to
+    scanners started once for the whole run.
+    """
+    if stop is None:
+        stop = threading.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stop.set())
+    scheduler = Scheduler()
+    watcher = DumpWatcher(paths, fast)
+    output = RotatingOutput(
+        output_dir, rotate_interval, suffix=OUTPUT_SUFFIXES[output_format],
+    )
+    if engine == "async":
+        scan = rescheduling_async(scheduler, asyncscanner.do_cds_scan)
+    else:
+        scan = rescheduling(scheduler, dsscanner.do_cds_scan)
+    try:
+        with pipeline.Writer(
+            output, output_format=output_format,
+        ) as writer_queue:
+            changes = ChangeFilter(writer_queue)
+            # Bounded, so that due domains are popped only as fast as
+            # they are scanned
+            inq = Queue(
+                maxsize=concurrency if engine == "async" else threads * 2,
+            )
+            scanners = start_scanners(
+                inq, changes, scan, engine, threads, concurrency,
+            )
+            try:
+                _schedule(scheduler, watcher, output, changes, inq, stop)
+            finally:
+                stop_scanners(inq, scanners)
+    finally:
+        output.close()
+    logger.info("Daemon stopped")
+
+
+def _schedule(scheduler, watcher, output, changes, inq, stop):
+    """Feed due domains to the scanners until `stop` is set"""
+    next_reload = 0
+    while not stop.is_set():
+        now = time.time()
+        if now >= next_reload:
+            objects = watcher.poll()
+            if objects is not None:
+                changes.forget(scheduler.update(objects, now))
+            next_reload = now + RELOAD_INTERVAL
+        output.rotate_if_due()
+        batch = scheduler.pop_due(now)
+        if batch:
+            logger.info("Scanning %s due domains", len(batch))
+            for obj in batch:
+                if stop.is_set():
+                    break
+                inq.put(obj)
+            continue
+        due = scheduler.next_due()
+        wake = next_reload if due is None else min(due, next_reload)
+        stop.wait(max(wake - time.time(), 0))
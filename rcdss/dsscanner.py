@@ -1,14 +1,136 @@
+import contextlib
+import contextvars
 import datetime
-import random
-from collections import defaultdict
+import functools
+import threading
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
 import dns
+import dns.message
 import dns.resolver
 import dns.dnssec
 
+from . import metrics
+from .authoritative import AuthoritativeResolver, NSAddressCache
 from .log import logger
+from .metrics import CACHE_REQUESTS, CHECK_DURATION, QUERY_DURATION
+from .ratelimit import admission
+from .selection import order_nameservers
+from .state import DomainState, get_state_store
 from .stats import record, Event
 
+# Format of the last-modified attribute
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Thread pool sending DNSKEY queries alongside CDS queries,
+# see setup_parallel_queries()
+_dnskey_executor = None
+
+# Pool of processes running validate_cds(), see setup_validation_pool()
+_validation_pool = None
+
+# Resolver querying nameservers of the domains directly,
+# see setup_authoritative()
+_authoritative = None
+
+# Cache of answers shared by resolvers of all queries,
+# see setup_answer_cache()
+_answer_cache = None
+
+# List collecting answers of queries, see collect_answers()
+_collected_answers = contextvars.ContextVar("collected_answers", default=None)
+
+# Seconds a query to the resolver may take, see query_lifetime()
+_lifetime = contextvars.ContextVar("lifetime", default=None)
+
+# Inputs of validate_cds() of a domain, see prepare_validation()
+PendingValidation = namedtuple(
+    "PendingValidation",
+    "obj domain cds dnskeyset ds_rdataset dsset cds_rdataset domain_state "
+    "verdict",
+)
+
+
+def setup_parallel_queries(workers):
+    """
+    Send the DNSKEY query at the same time as the CDS query, using
+    a pool of `workers` threads. This saves a round trip for domains
+    having CDS, at the cost of a wasted query for the others.
+    """
+    global _dnskey_executor
+    _dnskey_executor = ThreadPoolExecutor(
+        max_workers=workers,
+        thread_name_prefix="dnskey",
+    )
+
+
+def setup_validation_pool(processes):
+    """
+    Validate CDS sets in a pool of `processes` processes, so that
+    the scanning threads keep sending queries instead of checking
+    signatures. The processes are started right away, so this should
+    be called before starting any threads.
+    """
+    global _validation_pool
+    _validation_pool = ValidationPool(processes)
+
+
+def get_validation_pool():
+    return _validation_pool
+
+
+def close_validation_pool():
+    global _validation_pool
+    if _validation_pool is not None:
+        _validation_pool.close()
+        _validation_pool = None
+
+
+def setup_authoritative(workers, payload=1200):
+    """
+    Query the nameservers of every domain given by its nserver
+    attributes instead of the resolver, using a pool of `workers`
+    threads. The resolver is then used only to look up addresses
+    of the nameservers.
+    """
+    global _authoritative
+    _authoritative = AuthoritativeResolver(
+        workers, NSAddressCache(make_resolver), payload,
+    )
+
+
+def get_authoritative():
+    return _authoritative
+
+
+def close_authoritative():
+    global _authoritative
+    if _authoritative is not None:
+        _authoritative.close()
+        _authoritative = None
+
+
+def setup_answer_cache(size):
+    """
+    Cache up to `size` answers, shared by resolvers of all queries
+    in this process. Answers expire with their TTL, the least recently
+    used ones are evicted when the cache is full.
+    """
+    global _answer_cache
+    _answer_cache = dns.resolver.LRUCache(size)
+
+
+def close_answer_cache():
+    """Count lookups in the answer cache and drop it"""
+    global _answer_cache
+    if _answer_cache is not None:
+        statistics = _answer_cache.get_statistics_snapshot()
+        CACHE_REQUESTS.add(statistics.hits, "answer", "hit")
+        CACHE_REQUESTS.add(statistics.misses, "answer", "miss")
+        _answer_cache = None
+
 
 def do_cds_scan(obj):
     """
@@ -17,89 +139,324 @@ def do_cds_scan(obj):
     change is necessarry.
     Otherwise, return None
     """
-    domain = obj.get("domain").lower()
-    if not domain.endswith("."):
-        domain += "."
-    logger.info(f"Processing domain: {domain}")
+    domain = get_domain_name(obj)
+    logger.info("Processing domain: %s", domain)
+    nservers = obj.get("nserver", [])
 
-    cds = query_dns(domain)
+    dnskey_future = None
+    if _dnskey_executor is not None:
+        dnskey_future = _dnskey_executor.submit(
+            contextvars.copy_context().run,
+            _query_dns, domain, "DNSKEY", nservers,
+        )
+    cds = query_dns(domain, "CDS", nservers)
     if cds is None:
         record(domain, Event.DNS_FAILURE)
         return None
     if cds.rrset is None:
         record(domain, Event.NO_CDS)
         return None
-    dnskeyset = query_dns(domain, "DNSKEY")
+    if dnskey_future is not None:
+        dnskeyset = record_query_result(domain, *dnskey_future.result())
+    else:
+        dnskeyset = query_dns(domain, "DNSKEY", nservers)
     if dnskeyset is None or dnskeyset.rrset is None:
         record(domain, Event.DNS_FAILURE)
         return None
+    return evaluate_cds(obj, domain, cds, dnskeyset)
+
+
+def get_domain_name(obj):
+    """Return fully qualified lowercase domain name of the object"""
+    domain = obj.get("domain").lower()
+    if not domain.endswith("."):
+        domain += "."
+    return domain
+
+
+def evaluate_cds(obj, domain, cds, dnskeyset):
+    """
+    Decide what to do with a domain having a CDS set.
+    This is the part of the scan that does not need the network,
+    so it is shared by all scanning engines.
+
+    With a validation pool, return a Future of the result if the
+    CDS set has to be validated.
+    """
+    pending = prepare_validation(obj, domain, cds, dnskeyset)
+    if pending is None:
+        return None
+    if pending.verdict is None and _validation_pool is not None:
+        return _validation_pool.submit(pending)
+    return finish_validation(pending)
+
+
+def prepare_validation(obj, domain, cds, dnskeyset):
+    """
+    Return PendingValidation of a CDS set differing from the DS set,
+    with the verdict of the last run if the state store has one.
+    Return None if no change is requested.
+    """
     record(domain, Event.HAVE_CDS)
     ds_rdataset = {s.lower() for s in obj.get("ds-rdata", [])}
-    logger.debug(f" DS rdataset: {ds_rdataset}")
+    logger.debug(" DS rdataset: %s", ds_rdataset)
     cds_rdataset = {rd.to_text().lower() for rd in cds}
-    logger.debug(f"CDS rdataset: {cds_rdataset}")
-    if cds_rdataset == ds_rdataset:
+    logger.debug("CDS rdataset: %s", cds_rdataset)
+    dsset = parse_ds_rdataset(ds_rdataset)
+    if dsset is not None:
+        unchanged = (
+            {rd.to_digestable() for rd in dsset} ==
+            {rd.to_digestable() for rd in cds}
+        )
+    else:
+        # Let the validation deal with the unparseable ds-rdata
+        unchanged = cds_rdataset == ds_rdataset
+    if unchanged:
         record(domain, Event.CDS_NOOP)
-        logger.info(f"No change requested for {domain}")
+        logger.info("No change requested for %s", domain)
+        return None
+
+    store = get_state_store()
+    domain_state = None
+    verdict = None
+    if store is not None:
+        domain_state = get_domain_state(obj, ds_rdataset, cds, dnskeyset)
+        verdict = store.lookup(domain, domain_state)
+        if verdict is not None:
+            record(domain, Event.STATE_UNCHANGED)
+            logger.info("CDS of %s unchanged since the last run", domain)
+    return PendingValidation(
+        obj, domain, cds, dnskeyset, ds_rdataset, dsset, cds_rdataset,
+        domain_state, verdict,
+    )
+
+
+def parse_ds_rdataset(ds_rdataset):
+    """
+    Return set of DS records given as text, their canonical wire format
+    compares equal to CDS records regardless of formatting.
+    Return None if any of them cannot be parsed.
+    """
+    try:
+        return {
+            dns.rdata.from_text(dns.rdataclass.IN, dns.rdatatype.DS, rdata)
+            for rdata in ds_rdataset
+        }
+    except (dns.exception.DNSException, ValueError) as e:
+        logger.debug("Cannot parse ds-rdata: %s", e)
+        return None
+
+
+def finish_validation(pending, verdict=None):
+    """
+    Record the verdict of a pending validation, validating the CDS set
+    first unless the verdict is known. Return modified database object
+    if change is necessary. Otherwise, return None
+    """
+    obj = pending.obj
+    domain = pending.domain
+    if pending.verdict is not None:
+        verdict = pending.verdict
     else:
-        if not check_inception_date(obj, cds):
-            record(domain, Event.OLD_SIG)
-            logger.warning(f"CDS signature inception too old for {domain}")
-            return None
-        if not check_signed_by_KSK(cds, ds_rdataset, dnskeyset):
-            record(domain, Event.NOT_SIGNED_BY_KSK)
-            logger.warning(
-                f"CDS of {domain} not properly "
-                f"signed by current KSK",
+        if verdict is None:
+            verdict = validate_cds(
+                obj, pending.cds, pending.ds_rdataset, pending.dnskeyset,
+                pending.dsset,
             )
-            return None
+        if pending.domain_state is not None:
+            get_state_store().store(domain, pending.domain_state, verdict)
+    record(domain, verdict)
+
+    if verdict == Event.OLD_SIG:
+        logger.warning("CDS signature inception too old for %s", domain)
+    elif verdict == Event.NOT_SIGNED_BY_KSK:
+        logger.warning(
+            "CDS of %s not properly signed by current KSK", domain,
+        )
+    elif verdict == Event.CDS_CONTINUITY_ERR:
+        logger.warning(
+            "DNSKEY of %s not properly signed by CDS records", domain,
+        )
+    elif verdict == Event.CDS_DELETE:
         obj["old-ds-rdata"] = obj.pop("ds-rdata")
-        if is_delete_cds(cds):
-            record(domain, Event.CDS_DELETE)
-            obj["reason"] = "DNSSEC delegation deleted by CDS record"
-            logger.info(f"DS deletion requested for {domain}")
-        elif not check_CDS_continuity(cds, dnskeyset):
-            record(domain, Event.CDS_CONTINUITY_ERR)
-            logger.warning(
-                f"DNSKEY of {domain} not properly "
-                f"signed by CDS records",
-            )
-            return None
-        else:
-            record(domain, Event.CDS_UPDATE_PENDING)
-            logger.info(f"DS should be updated for {domain}")
-            obj["ds-rdata"] = list(cds_rdataset)
-            obj["reason"] = "Updated by CDS record"
+        obj["reason"] = "DNSSEC delegation deleted by CDS record"
+        obj["cds-inception"] = format_inception(pending.cds)
+        logger.info("DS deletion requested for %s", domain)
+        return obj
+    elif verdict == Event.CDS_UPDATE_PENDING:
+        obj["old-ds-rdata"] = obj.pop("ds-rdata")
+        obj["ds-rdata"] = list(pending.cds_rdataset)
+        obj["reason"] = "Updated by CDS record"
+        obj["cds-inception"] = format_inception(pending.cds)
+        logger.info("DS should be updated for %s", domain)
         return obj
+    return None
 
 
-def query_dns(domain, rdtype="CDS"):
-    """Make a query to the local resolver. Return answer object."""
+def validate_cds(obj, cds, ds_rdataset, dnskeyset, dsset=None):
+    """
+    Run all the RFC 7344 checks of a CDS set that differs from
+    the current DS set. Return the resulting Event.
+    `dsset` is the DS set already parsed from `ds_rdataset`, if any.
+    """
+    if not _timed_check("inception_date", check_inception_date, obj, cds):
+        return Event.OLD_SIG
+    index = _timed_check("dnskey_index", DNSKEYIndex, dnskeyset)
+    if not _timed_check(
+        "signed_by_ksk", check_signed_by_KSK,
+        cds, ds_rdataset, dnskeyset, index, dsset,
+    ):
+        return Event.NOT_SIGNED_BY_KSK
+    if _timed_check("delete", is_delete_cds, cds):
+        return Event.CDS_DELETE
+    if not _timed_check(
+        "continuity", check_CDS_continuity, cds, dnskeyset, index,
+    ):
+        return Event.CDS_CONTINUITY_ERR
+    return Event.CDS_UPDATE_PENDING
+
+
+def _timed_check(name, check, *args):
+    with metrics.timed(CHECK_DURATION, name):
+        return check(*args)
+
+
+def get_domain_state(obj, ds_rdataset, cds, dnskeyset):
+    """Return DomainState describing inputs of validate_cds()"""
+    cds_rrsigs = cds.response.get_rrset(
+        cds.response.answer, cds.name, dns.rdataclass.IN,
+        dns.rdatatype.RRSIG, dns.rdatatype.CDS,
+    )
+    dnskey_rrsigs = dnskeyset.response.get_rrset(
+        dnskeyset.response.answer, dnskeyset.name, dns.rdataclass.IN,
+        dns.rdatatype.RRSIG, dns.rdatatype.DNSKEY,
+    )
+    return DomainState.from_rrsets(
+        ds_rdataset, obj.get("last-modified"),
+        cds.rrset, dnskeyset.rrset, cds_rrsigs, dnskey_rrsigs,
+    )
+
+
+def make_resolver(resolver_class=dns.resolver.Resolver):
+    """
+    Create a new resolver instance for a single query, using
+    nameservers of the default resolver.
+    """
     default_resolver = dns.resolver.get_default_resolver()
     # We use separate resolver instance per query
-    resolver = dns.resolver.Resolver(configure=False)
-    resolver.nameservers = default_resolver.nameservers
-    if default_resolver.rotate:
-        random.shuffle(resolver.nameservers)
+    resolver = resolver_class(configure=False)
+    resolver.nameservers = order_nameservers(
+        default_resolver.nameservers, default_resolver.rotate,
+    )
     resolver.flags = dns.flags.RD
-    resolver.use_edns(0, dns.flags.DO, 1200)
+    resolver.use_edns(0, dns.flags.DO, default_resolver.payload)
+    resolver.cache = _answer_cache
+    lifetime = _lifetime.get()
+    if lifetime is not None:
+        resolver.lifetime = lifetime
+        resolver.timeout = min(resolver.timeout, lifetime)
+    return resolver
+
+
+@contextlib.contextmanager
+def query_lifetime(seconds):
+    """
+    Limit the time queries to the resolver made within the block,
+    in the current thread or asyncio task, may take.
+    """
+    token = _lifetime.set(seconds)
     try:
-        return resolver.resolve(domain, rdtype, raise_on_no_answer=False)
+        yield
+    finally:
+        _lifetime.reset(token)
+
+
+def query_dns(domain, rdtype="CDS", nservers=()):
+    """Make a query to the local resolver. Return answer object."""
+    return record_query_result(domain, *_query_dns(domain, rdtype, nservers))
+
+
+def record_query_result(domain, answer, event):
+    """Record the failure event of a query, if any. Return answer object."""
+    if event is not None:
+        record(domain, event)
+    collected = _collected_answers.get()
+    if collected is not None:
+        collected.append(answer)
+    return answer
+
+
+@contextlib.contextmanager
+def collect_answers():
+    """
+    Collect answers of queries made within the block, in the current
+    thread or asyncio task, into a list. Failed queries add None.
+    """
+    answers = []
+    token = _collected_answers.set(answers)
+    try:
+        yield answers
+    finally:
+        _collected_answers.reset(token)
+
+
+def _query_dns(domain, rdtype, nservers=()):
+    """
+    Make a query to the local resolver, or to the nameservers given
+    by values of nserver attributes in the authoritative mode.
+    Return answer object and an Event describing the failure, if any.
+    The event is not recorded, so that the caller can drop the
+    result of a query that turned out to be unnecessary.
+    """
+    start = time.perf_counter()
+    if _authoritative is not None:
+        answer, event = _authoritative.query(domain, rdtype, nservers)
+    else:
+        answer, event = _resolve(domain, rdtype)
+    QUERY_DURATION.observe(
+        time.perf_counter() - start, rdtype, query_outcome(answer, event),
+    )
+    return answer, event
+
+
+def query_outcome(answer, event):
+    """Return label describing result of _query_dns() in metrics"""
+    if event is not None:
+        return event.name[len("DNS_"):].lower()
+    if answer is None:
+        return "error"
+    if answer.rrset is None:
+        return "nodata"
+    return "ok"
+
+
+def _resolve(domain, rdtype):
+    resolver = make_resolver()
+    try:
+        with admission(resolver):
+            answer = resolver.resolve(
+                domain, rdtype, raise_on_no_answer=False,
+            )
+        return answer, None
     except dns.resolver.NoNameservers:
         # Is this a DNSSEC failure?
         try:
             resolver.flags |= dns.flags.CD
+            # The cache does not tell answers with CD apart,
+            # so this one must not be served to validating queries
+            resolver.cache = None
             resolver.resolve(domain, rdtype, raise_on_no_answer=False)
-            logger.warning(f"Bogus DNSSEC for domain: {domain}")
-            record(domain, Event.DNS_BOGUS)
+            logger.warning("Bogus DNSSEC for domain: %s", domain)
+            return None, Event.DNS_BOGUS
         except dns.exception.DNSException as e:
-            logger.warning(f"Non-DNSSEC related exception: {e}")
-            record(domain, Event.DNS_LAME)
+            logger.warning("Non-DNSSEC related exception: %s", e)
+            return None, Event.DNS_LAME
     except dns.resolver.Timeout:
-        logger.warning(f"DNS timeout for domain: {domain}")
-        record(domain, Event.DNS_TIMEOUT)
+        logger.warning("DNS timeout for domain: %s", domain)
+        return None, Event.DNS_TIMEOUT
     except dns.exception.DNSException as e:
-        logger.warning(f"DNS exception: {e}")
+        logger.warning("DNS exception: %s", e)
+    return None, None
 
 
 def get_rrsigset(response):
@@ -138,62 +495,202 @@ def check_inception_date(obj, cds):
     a new state anywhere.
     """
     lm = obj.get("last-modified")
-    lm = datetime.datetime.strptime(lm, "%Y-%m-%dT%H:%M:%SZ")
+    lm = datetime.datetime.strptime(lm, TIME_FORMAT)
     lm = lm.replace(tzinfo=datetime.timezone.utc)
+    inception = get_inception(cds)
+    logger.debug("Inception: %s, last modified: %s", inception, lm)
+    return inception > lm
+
+
+def get_inception(cds):
+    """Return the oldest signature inception of the CDS answer"""
     rrsigs = get_rrsigset(cds.response)
     # There can be more signatures. We will look for the oldest.
-    inception = min([
+    return min([
         datetime.datetime.fromtimestamp(
             sig.inception,
             datetime.timezone.utc,
         ) for sig in rrsigs
     ])
-    logger.debug(f"Inception: {inception}, last modified: {lm}")
-    return inception > lm
 
 
-def filter_dnskey_set(dnskeyset, dsset):
+def format_inception(cds):
+    """Return inception of the CDS signatures formatted as last-modified"""
+    return get_inception(cds).strftime(TIME_FORMAT)
+
+
+class ValidationPool:
+    """
+    Pool of processes running validate_cds() on answers passed
+    in wire format.
+
+    At most `queue_size` validations per process wait in the pool,
+    further blocking submissions wait for a free slot.
+    """
+
+    def __init__(self, processes, queue_size=4):
+        self.executor = ProcessPoolExecutor(max_workers=processes)
+        self.slots = threading.BoundedSemaphore(processes * queue_size)
+        self.pending = 0
+        self.done = threading.Condition()
+        # Start the processes now
+        self.executor.submit(int).result()
+
+    def depth(self):
+        """Return number of validations submitted and not finished"""
+        return self.pending
+
+    def submit(self, pending, block=True):
+        """
+        Validate the CDS set in the pool.
+        Return Future of the result of finish_validation().
+        """
+        if block:
+            self.slots.acquire()
+        with self.done:
+            self.pending += 1
+        result = Future()
+        try:
+            future = self.executor.submit(
+                _validate_wire,
+                pending.obj.get("last-modified"),
+                pending.ds_rdataset,
+                pending.cds.response.to_wire(),
+                pending.dnskeyset.response.to_wire(),
+                pending.dsset,
+            )
+        except BaseException:
+            self._release(block)
+            raise
+        future.add_done_callback(
+            functools.partial(self._finish, pending, result, block),
+        )
+        return result
+
+    def join(self):
+        """Wait until all submitted validations are finished"""
+        with self.done:
+            self.done.wait_for(lambda: self.pending == 0)
+
+    def close(self):
+        self.executor.shutdown()
+
+    def _finish(self, pending, result, block, future):
+        try:
+            verdict, snapshot = future.result()
+            metrics.merge(snapshot)
+            o = finish_validation(pending, verdict)
+        except Exception as e:
+            result.set_exception(e)
+        else:
+            result.set_result(o)
+        finally:
+            self._release(block)
+
+    def _release(self, block):
+        if block:
+            self.slots.release()
+        with self.done:
+            self.pending -= 1
+            self.done.notify_all()
+
+
+def _validate_wire(
+    last_modified, ds_rdataset, cds_wire, dnskey_wire, dsset=None,
+):
+    """
+    Run validate_cds() on answers in wire format.
+    Return the verdict and metrics collected in this process since
+    the last call.
+    """
+    verdict = validate_cds(
+        {"last-modified": last_modified},
+        _answer_from_wire(cds_wire),
+        ds_rdataset,
+        _answer_from_wire(dnskey_wire),
+        dsset,
+    )
+    return verdict, metrics.snapshot(reset=True)
+
+
+def _answer_from_wire(wire):
+    response = dns.message.from_wire(wire)
+    question = response.question[0]
+    return dns.resolver.Answer(
+        question.name, question.rdtype, question.rdclass, response,
+    )
+
+
+class DNSKEYIndex:
+    """
+    DNSKEY set indexed by key tag, with memoized DS digests.
+
+    It is built once per domain and shared by all the checks,
+    so that key tags and digests are not computed again for every
+    DS record and every signature algorithm.
+    """
+
+    def __init__(self, dnskeyset):
+        self.name = dnskeyset.name
+        self.by_key_tag = defaultdict(list)
+        for dnskey in dnskeyset:
+            self.by_key_tag[dns.dnssec.key_id(dnskey)].append(dnskey)
+        self._digests = {}
+
+    def make_ds(self, dnskey, digest_type):
+        """Return DS of the key, or None if the digest is not supported"""
+        key = (id(dnskey), digest_type)
+        try:
+            return self._digests[key]
+        except KeyError:
+            pass
+        try:
+            ds = dns.dnssec.make_ds(
+                self.name,
+                dnskey,
+                digest_type,
+                policy=dns.dnssec.allow_all_policy,
+            )
+        except dns.dnssec.UnsupportedAlgorithm:
+            ds = None
+        except dns.dnssec.DeniedByPolicy:
+            ds = None
+        self._digests[key] = ds
+        return ds
+
+
+def filter_dnskey_set(dnskeyset, dsset, index=None):
     """
     Return a set of DNSKEYs with only keys
     matching fingerprints in the dsset.
     We allow any supported DS record type,
     even those deprecated by RFC 8624
     """
+    if index is None:
+        index = DNSKEYIndex(dnskeyset)
     s = set()
-    for dnskey in dnskeyset:
-        key_id = dns.dnssec.key_id(dnskey)
-        for ds in dsset:
-            if ds.key_tag != key_id:
-                continue
-            try:
-                if ds == dns.dnssec.make_ds(
-                    dnskeyset.name,
-                    dnskey,
-                    ds.digest_type,
-                    policy=dns.dnssec.allow_all_policy,
-                ):
-                    s.add(dnskey)
-            except dns.dnssec.UnsupportedAlgorithm:
-                pass
-            except dns.dnssec.DeniedByPolicy:
-                pass
+    for ds in dsset:
+        for dnskey in index.by_key_tag.get(ds.key_tag, ()):
+            if ds == index.make_ds(dnskey, ds.digest_type):
+                s.add(dnskey)
     return s
 
 
-def check_signed_by_KSK(cds, ds_rdataset, dnskeyset):
+def check_signed_by_KSK(cds, ds_rdataset, dnskeyset, index=None, dsset=None):
     """
     Check if the CDS is actually signed by a key contained in the
     current DS RRSET as per RFC 7344 section 4.1
 
     We use RFC 8624 policy to ignore deprecated algorithms.
     """
-    dsset = {
-        dns.rdata.from_text(
-            dns.rdataclass.IN, dns.rdatatype.DS,
-            rdata,
-        ) for rdata in ds_rdataset
-    }
-    keyset = filter_dnskey_set(dnskeyset, dsset)
+    if dsset is None:
+        dsset = {
+            dns.rdata.from_text(
+                dns.rdataclass.IN, dns.rdatatype.DS,
+                rdata,
+            ) for rdata in ds_rdataset
+        }
+    keyset = filter_dnskey_set(dnskeyset, dsset, index)
     try:
         dns.dnssec.validate(
             cds.rrset,
@@ -208,7 +705,7 @@ def check_signed_by_KSK(cds, ds_rdataset, dnskeyset):
         return False
 
 
-def check_CDS_continuity(cds, dnskeyset):
+def check_CDS_continuity(cds, dnskeyset, index=None):
     """
     Check if the CDS, when applied, will not break the current delegation
     as per RFC 7344 section 4.1
@@ -233,7 +730,7 @@ def check_CDS_continuity(cds, dnskeyset):
                 "Validating CDS continuity for algorithm %s.",
                 dns.dnssec.algorithm_to_text(alg),
             )
-            keyset = filter_dnskey_set(dnskeyset, dsset)
+            keyset = filter_dnskey_set(dnskeyset, dsset, index)
             dns.dnssec.validate(
                 dnskeyset.rrset,
                 get_rrsigset(dnskeyset.response),
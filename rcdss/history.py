@@ -0,0 +1,73 @@
+"""
+Ordering of the scan by results of a previous run.
+
+Domains that had CDS in the previous run are scanned first, so that
+the results worth having come early: they overtake up to HOLD_BACK
+objects of other domains, which are held in memory meanwhile.
+Domains whose queries timed out or found no working nameserver are set
+aside for the slow lane, where they do not hold the workers scanning
+the others.
+"""
+import json
+from collections import deque
+
+from .dsscanner import get_domain_name
+from .log import logger
+from .stats import Event
+
+# Events of domains scanned first
+FIRST_EVENTS = (Event.HAVE_CDS, )
+
+# Events of domains scanned in the slow lane
+SLOW_EVENTS = (Event.DNS_TIMEOUT, Event.DNS_LAME)
+
+# Number of objects of other domains held back for domains with CDS
+HOLD_BACK = 100000
+
+
+class History:
+    """Domains to be scanned first and domains expected to be slow"""
+
+    def __init__(self, first=(), slow=()):
+        self.first = set(first)
+        self.slow = set(slow)
+
+    @classmethod
+    def load(cls, fh):
+        """Read JSON written by --dump-stats"""
+        events = json.load(fh)
+
+        def domains(names):
+            return {d for name in names for d in events.get(name.name, ())}
+
+        history = cls(domains(FIRST_EVENTS), domains(SLOW_EVENTS))
+        logger.info(
+            "History of %d domains with CDS and %d slow domains",
+            len(history.first), len(history.slow),
+        )
+        return history
+
+    def order(self, objects, slow=None, hold_back=HOLD_BACK):
+        """
+        Yield objects with domains that had CDS first, as they come.
+        Up to `hold_back` of the others are held back for them.
+        Objects of slow domains are passed to the `slow` callable,
+        or yielded at the very end without one.
+        """
+        rest = deque()
+        slow_objects = []
+        for obj in objects:
+            domain = get_domain_name(obj)
+            if domain in self.slow:
+                if slow is not None:
+                    slow(obj)
+                else:
+                    slow_objects.append(obj)
+            elif domain in self.first:
+                yield obj
+            else:
+                rest.append(obj)
+                if len(rest) > hold_back:
+                    yield rest.popleft()
+        yield from rest
+        yield from slow_objects
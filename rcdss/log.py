@@ -1,11 +1,61 @@
+"""
+Logging of rcdss.
+
+Records are passed through a queue to a background thread writing them,
+so that scanning threads neither wait for the output nor contend
+for the lock of the handler. Arguments of records below the level
+are never formatted.
+"""
+import atexit
+import copy
+import datetime
+import json
 import logging
 import logging.handlers
-
+import os
+import queue
 
 logger = logging.getLogger(__name__)
 
+# Thread writing records queued by the logger, see setup_logger()
+_listener = None
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
+
+
+class JSONFormatter(logging.Formatter):
+    """Format each record as a JSON object on a single line"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc,
+            ).isoformat(),
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler leaving all the formatting to the listener thread,
+    except for merging the arguments, which may change later.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
 
-def setup_logger(logfile, verbose):
+
+def setup_logger(logfile, verbose, log_format="text"):
+    global _listener
     if verbose > 1:
         logger.setLevel(logging.DEBUG)
     elif verbose == 1:
@@ -18,6 +68,40 @@ def setup_logger(logfile, verbose):
         )
     else:
         handler = logging.StreamHandler()
-    log_format = logging.Formatter('%(asctime)s %(levelname)s: %(message)s')
-    handler.setFormatter(log_format)
-    logger.addHandler(handler)
+    if log_format == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+    logger.addHandler(QueueHandler(records))
+    atexit.register(close_logger)
+
+
+def close_logger():
+    """Write all queued records and log directly from now on"""
+    if _listener is None:
+        return
+    _listener.stop()
+    _log_directly()
+
+
+def _log_directly():
+    """Replace the queue handler by handlers of the listener"""
+    global _listener
+    if _listener is None:
+        return
+    for handler in list(logger.handlers):
+        if isinstance(handler, QueueHandler):
+            logger.removeHandler(handler)
+    for handler in _listener.handlers:
+        logger.addHandler(handler)
+    _listener = None
+
+
+# Forked processes have no listener thread, they write the records
+# themselves as before. The logging module reinitializes locks of the
+# handlers in the child, so a fork while the listener thread writes
+# a record cannot leave them locked.
+os.register_at_fork(after_in_child=_log_directly)
@@ -0,0 +1,268 @@
+"""
+Timing metrics of the scanning stages.
+
+Durations are collected in histograms with fixed buckets, so that they
+can be merged from worker processes and exported as a Prometheus
+textfile. Counters of other things worth watching are kept alongside.
+"""
+import bisect
+import contextlib
+import math
+import threading
+import time
+
+# Upper bounds of buckets for network operations, in seconds
+NETWORK_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0,
+)
+
+# Upper bounds of buckets for operations done on the CPU, in seconds
+CPU_BUCKETS = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001,
+    0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1,
+)
+
+# All metrics by name
+_METRICS = {}
+
+
+class Histogram:
+    """
+    Histogram of durations with a series for every combination
+    of values of the labels.
+    """
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=NETWORK_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Labels -> [counts of observations in buckets, total]
+        self._series = {}
+        self._lock = threading.Lock()
+        _METRICS[name] = self
+
+    def observe(self, value, *labels):
+        """Add an observation to the series given by values of labels"""
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0,
+                ]
+            series[0][i] += 1
+            series[1] += value
+
+    def snapshot(self, reset=False):
+        """Return copy of all series, optionally clearing them"""
+        with self._lock:
+            series = {
+                labels: (list(counts), total)
+                for labels, (counts, total) in self._series.items()
+            }
+            if reset:
+                self._series.clear()
+        return series
+
+    def merge(self, series):
+        """Add series returned by snapshot() in another process"""
+        with self._lock:
+            for labels, (counts, total) in series.items():
+                own = self._series.setdefault(
+                    labels, [[0] * (len(self.buckets) + 1), 0.0],
+                )
+                own[0] = [a + b for a, b in zip(own[0], counts)]
+                own[1] += total
+
+    def quantile(self, counts, q):
+        """Return upper bound of the bucket containing the quantile"""
+        rank = q * sum(counts)
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def report(self):
+        """Yield summary of every series"""
+        for labels, (counts, total) in sorted(self.snapshot().items()):
+            count = sum(counts)
+            name = " ".join((self.name[len("rcdss_"):],) + labels)
+            yield (
+                f"{name:<40} {count:>8} avg {total / count * 1000:9.3f} ms"
+                f" p50 <={_format_ms(self.quantile(counts, 0.5))}"
+                f" p99 <={_format_ms(self.quantile(counts, 0.99))}"
+            )
+
+    def write_prometheus(self, fh):
+        """Write the histogram in the Prometheus text format"""
+        _write_header(fh, self, "histogram")
+        for labels, (counts, total) in sorted(self.snapshot().items()):
+            pairs = _pairs(self.labelnames, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                bucket_labels = _labels(pairs + [f'le="{le}"'])
+                fh.write(f"{self.name}_bucket{bucket_labels} {cumulative}\n")
+            fh.write(f"{self.name}_sum{_labels(pairs)} {total!r}\n")
+            fh.write(f"{self.name}_count{_labels(pairs)} {cumulative}\n")
+
+
+class Counter:
+    """Counter with a series for every combination of values of the labels"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._series = {}
+        self._lock = threading.Lock()
+        _METRICS[name] = self
+
+    def add(self, value, *labels):
+        """Add value to the series given by values of labels"""
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + value
+
+    def snapshot(self, reset=False):
+        """Return copy of all series, optionally clearing them"""
+        with self._lock:
+            series = dict(self._series)
+            if reset:
+                self._series.clear()
+        return series
+
+    def merge(self, series):
+        """Add series returned by snapshot() in another process"""
+        for labels, value in series.items():
+            self.add(value, *labels)
+
+    def report(self):
+        """Yield value of every series"""
+        for labels, value in sorted(self.snapshot().items()):
+            name = " ".join((self.name[len("rcdss_"):],) + labels)
+            yield f"{name:<40} {value:>8}"
+
+    def write_prometheus(self, fh):
+        """Write the counter in the Prometheus text format"""
+        _write_header(fh, self, "counter")
+        for labels, value in sorted(self.snapshot().items()):
+            pairs = _pairs(self.labelnames, labels)
+            fh.write(f"{self.name}{_labels(pairs)} {value}\n")
+
+
+QUERY_DURATION = Histogram(
+    "rcdss_query_duration_seconds",
+    "Duration of DNS lookups, including retries and TCP fallback",
+    ("rdtype", "outcome"),
+)
+EXCHANGE_DURATION = Histogram(
+    "rcdss_exchange_duration_seconds",
+    "Duration of single exchanges with a nameserver",
+    ("transport", "outcome"),
+)
+CHECK_DURATION = Histogram(
+    "rcdss_check_duration_seconds",
+    "Duration of CDS validation checks",
+    ("check",), CPU_BUCKETS,
+)
+SCAN_DURATION = Histogram(
+    "rcdss_scan_duration_seconds",
+    "Duration of scans of single domains",
+)
+PARSE_DURATION = Histogram(
+    "rcdss_parse_duration_seconds",
+    "Time spent by the parser per object with ds-rdata",
+    ("parser",), CPU_BUCKETS,
+)
+WRITE_DURATION = Histogram(
+    "rcdss_write_duration_seconds",
+    "Duration of writing modified objects",
+    (), CPU_BUCKETS,
+)
+CACHE_REQUESTS = Counter(
+    "rcdss_cache_requests_total",
+    "Lookups in caches of DNS answers and nameserver addresses",
+    ("cache", "result"),
+)
+
+
+@contextlib.contextmanager
+def timed(histogram, *labels):
+    """Observe duration of the block"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *labels)
+
+
+def timed_iter(iterable, histogram, *labels):
+    """Yield from iterable, observing time taken by every item"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        histogram.observe(time.perf_counter() - start, *labels)
+        yield item
+
+
+def snapshot(reset=False):
+    """Return all series of all histograms, to be passed to merge()"""
+    return {
+        name: m.snapshot(reset) for name, m in _METRICS.items()
+    }
+
+
+def merge(snapshot):
+    """Add snapshot of metrics from another process"""
+    for name, series in snapshot.items():
+        _METRICS[name].merge(series)
+
+
+def report():
+    """Return summary of all non-empty series, one per line"""
+    output = []
+    for m in _METRICS.values():
+        output.extend(m.report())
+    return "\n".join(output)
+
+
+def _format_ms(bound):
+    if bound == math.inf:
+        return "      inf"
+    return f"{bound * 1000:9.3f} ms"
+
+
+def write_prometheus(fh):
+    """Write all metrics in the Prometheus text format"""
+    for m in _METRICS.values():
+        m.write_prometheus(fh)
+
+
+def _write_header(fh, metric, kind):
+    fh.write(f"# HELP {metric.name} {metric.documentation}\n")
+    fh.write(f"# TYPE {metric.name} {kind}\n")
+
+
+def _pairs(labelnames, labels):
+    return [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, labels)]
+
+
+def _labels(pairs):
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value):
+    return (
+        str(value).replace("\\", r"\\").replace('"', r'\"')
+        .replace("\n", r"\n")
+    )
@@ -0,0 +1,332 @@
+"""
+Streaming reader -> scanner -> writer pipeline.
+
+Queues between the stages are bounded, so a slow stage holds back
+the previous one instead of letting objects pile up in memory.
+"""
+import contextlib
+import functools
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from queue import Queue
+
+from . import asyncscanner
+from . import rpsl
+from .dsscanner import do_cds_scan, get_validation_pool, query_lifetime
+from .log import logger
+from .metrics import SCAN_DURATION, WRITE_DURATION, timed
+from .stats import release_shard
+
+# Sentinel telling a pipeline stage to finish
+STOP = None
+
+# Seconds between samples of queue depths, see DepthMonitor
+SAMPLE_INTERVAL = 1
+
+# Number of samples between reports of queue depths
+REPORT_SAMPLES = 10
+
+
+def scan_thread(inq, outq, scan):
+    try:
+        _scan_thread(inq, outq, scan)
+    finally:
+        release_shard()
+
+
+def _scan_thread(inq, outq, scan):
+    while True:
+        obj = inq.get()
+        if obj is STOP:
+            break
+        start = time.perf_counter()
+        try:
+            o = scan(obj)
+            if isinstance(o, Future):
+                # Validation continues in another stage
+                o.add_done_callback(
+                    functools.partial(_put_result, outq, obj),
+                )
+            elif o:
+                outq.put(o)
+        except Exception:
+            logger.exception(
+                "Unexpected error while scanning %s", obj.get("domain"),
+            )
+        finally:
+            SCAN_DURATION.observe(time.perf_counter() - start)
+
+
+def _put_result(outq, obj, future):
+    try:
+        o = future.result()
+        if o:
+            outq.put(o)
+    except Exception:
+        logger.exception(
+            "Unexpected error while validating %s", obj.get("domain"),
+        )
+
+
+def run_engine(
+    objects, outq, engine="threads", threads=1, concurrency=1, retries=None,
+    slow_lane=None,
+):
+    """
+    Scan all objects using the selected engine.
+    With a validation pool, the engine is the first of two stages,
+    and depths of the queues of both stages are reported.
+    With a SlowLane, objects passed to it while reading `objects` are
+    scanned alongside the others.
+    With a RetryQueue, failed domains are scanned again at the end.
+    """
+    pool = get_validation_pool()
+    monitor = None
+    if pool is not None:
+        monitor = DepthMonitor()
+        monitor.watch("validation", pool.depth)
+        monitor.start()
+    try:
+        if slow_lane is not None:
+            if monitor is not None:
+                monitor.watch("slow lane", slow_lane.queue.qsize)
+            slow_lane.start(outq, engine, retries)
+        try:
+            _run_engine(
+                objects, outq, engine, threads, concurrency, retries,
+                monitor,
+            )
+        finally:
+            if slow_lane is not None:
+                slow_lane.join()
+        if retries is not None:
+            for deferred in retries.rounds():
+                _run_engine(
+                    iter(deferred), outq, engine, threads, concurrency,
+                    retries, monitor,
+                )
+        if pool is not None:
+            pool.join()
+    finally:
+        if monitor is not None:
+            monitor.stop()
+
+
+def _run_engine(objects, outq, engine, threads, concurrency, retries,
+                monitor):
+    if engine == "async":
+        scan = asyncscanner.do_cds_scan
+        if retries is not None:
+            scan = retries.wrap_async(scan)
+        asyncscanner.scan_objects(
+            objects, concurrency, outq, scan, monitor=monitor,
+        )
+    else:
+        scan = do_cds_scan
+        if retries is not None:
+            scan = retries.wrap(scan)
+        scan_objects(objects, threads, outq, scan, monitor=monitor)
+
+
+class SlowLane:
+    """
+    Scanning engine of its own for domains expected to be slow, with
+    `workers` threads or domains in flight and a shorter lifetime
+    of queries, so that they do not hold the main engine.
+    """
+
+    def __init__(self, workers, lifetime):
+        self.workers = workers
+        self.lifetime = lifetime
+        self.queue = Queue()
+        self.count = 0
+        self.thread = None
+
+    def put(self, obj):
+        self.count += 1
+        self.queue.put(obj)
+
+    def start(self, outq, engine="threads", retries=None):
+        self.thread = threading.Thread(
+            target=self._run, args=(outq, engine, retries), daemon=True,
+        )
+        self.thread.start()
+
+    def join(self):
+        """Wait until all objects put so far are scanned"""
+        self.queue.put(STOP)
+        self.thread.join()
+        logger.info("Slow lane scanned %s domains", self.count)
+
+    def _run(self, outq, engine, retries):
+        objects = iter(self.queue.get, STOP)
+        lifetime = self.lifetime
+        if engine == "async":
+            async def scan(obj):
+                with query_lifetime(lifetime):
+                    return await asyncscanner.do_cds_scan(obj)
+
+            if retries is not None:
+                scan = retries.wrap_async(scan)
+            asyncscanner.scan_objects(objects, self.workers, outq, scan)
+        else:
+            def scan(obj):
+                with query_lifetime(lifetime):
+                    return do_cds_scan(obj)
+
+            if retries is not None:
+                scan = retries.wrap(scan)
+            scan_objects(objects, self.workers, outq, scan)
+
+
+def scan_objects(objects, threads, outq, scan=None, monitor=None):
+    """
+    Scan all objects using a pool of threads,
+    putting modified objects into `outq`.
+    """
+    if scan is None:
+        scan = do_cds_scan
+    inq = Queue(maxsize=threads * 2)
+    if monitor is not None:
+        monitor.watch("scanning", inq.qsize)
+    workers = [
+        threading.Thread(
+            target=scan_thread,
+            args=(inq, outq, scan,),
+            daemon=True,
+        ) for _ in range(threads)
+    ]
+    for w in workers:
+        w.start()
+    for obj in objects:
+        inq.put(obj)
+    for _ in workers:
+        inq.put(STOP)
+    for w in workers:
+        w.join()
+
+
+class DepthMonitor:
+    """
+    Background thread sampling depths of the queues in front of
+    pipeline stages, so that the stage holding back the others
+    can be spotted. Depths are logged periodically, together with
+    the peaks at the end.
+    """
+
+    def __init__(self):
+        self.depths = {}
+        self.peaks = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def watch(self, name, depth):
+        """Sample the depth of a queue, returned by `depth` callable"""
+        self.depths[name] = depth
+        self.peaks.setdefault(name, 0)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        logger.info("Peak queue depths: %s", self._format(self.peaks))
+
+    def _run(self):
+        samples = 0
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            current = {}
+            for name, depth in list(self.depths.items()):
+                current[name] = depth()
+                self.peaks[name] = max(self.peaks[name], current[name])
+            samples += 1
+            if samples % REPORT_SAMPLES == 0:
+                logger.info("Queue depths: %s", self._format(current))
+
+    @staticmethod
+    def _format(depths):
+        return ", ".join(f"{name} {d}" for name, d in depths.items())
+
+
+@contextlib.contextmanager
+def atomic_output(path):
+    """
+    Open output file written under a temporary name. It replaces `path`
+    only if the block finishes without an exception, so that a failed
+    run does not leave partial output. Use standard output if `path`
+    is None or "-". Devices and pipes, such as /dev/null, are written
+    directly, they must not be replaced.
+    """
+    if path is None or path == "-":
+        yield sys.stdout
+        return
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        st = None
+    if st is not None and not stat.S_ISREG(st.st_mode):
+        with open(path, "w") as fh:
+            yield fh
+        return
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=f".{name}.", dir=directory)
+    try:
+        if st is not None:
+            # Keep permissions of the file being replaced
+            mode = stat.S_IMODE(st.st_mode)
+        else:
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(tmp, mode)
+        with open(fd, "w") as fh:
+            yield fh
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+class Writer:
+    """
+    Background thread writing modified objects to the output
+    as soon as they are ready, in one of formats of rpsl.WRITERS.
+    """
+
+    def __init__(self, output, maxsize=1000, output_format="rpsl"):
+        self.output = output
+        self.render = rpsl.WRITERS[output_format]
+        self.queue = Queue(maxsize=maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self.queue
+
+    def __exit__(self, *exc_info):
+        self.queue.put(STOP)
+        self.thread.join()
+        if self.error is not None and exc_info[0] is None:
+            raise self.error
+
+    def _run(self):
+        while True:
+            o = self.queue.get()
+            if o is STOP:
+                break
+            if self.error is not None:
+                # Keep draining the queue so that scanners do not block
+                continue
+            try:
+                with timed(WRITE_DURATION):
+                    print(self.render(o), file=self.output, flush=True)
+            except Exception as e:
+                logger.error("Cannot write output: %s", e)
+                self.error = e
@@ -0,0 +1,463 @@
+"""
+Adaptive concurrency and rate limiting of queries, per resolver.
+Durations of all exchanges with the resolvers are measured here too.
+
+The number of queries in flight to each resolver is controlled by
+AIMD (additive increase, multiplicative decrease): it grows while the
+resolver answers in time and is halved when most of the recent queries
+time out or get SERVFAIL. Some domains always fail, so single failures
+are not taken as a sign of an overloaded resolver. Optionally, queries
+are also spaced to a ceiling of queries per second by a token bucket.
+
+Waiting for a slot and a token is not an exchange with the resolver,
+so it must not use up the lifetime of queries of healthy domains when
+the limit goes down. The first exchange of a query takes them before
+the query starts, see admission(). Any other exchange waits at most
+its timeout, and then fails as timed out without counting as a failure
+of the resolver.
+"""
+import asyncio
+import contextlib
+import contextvars
+import threading
+import time
+from collections import deque
+
+import dns.exception
+import dns.inet
+import dns.message
+import dns.nameserver
+import dns.rcode
+
+from .log import logger
+from .metrics import EXCHANGE_DURATION
+from .selection import FAILED_OUTCOMES, ResolverHealth
+
+# Number of queries in flight to a resolver at the start
+INITIAL_LIMIT = 8
+
+# Factor the limit is multiplied by on timeouts and SERVFAILs
+BACKOFF = 0.5
+
+# Minimum number of seconds between two decreases of the limit,
+# so that a burst of timeouts of queries sent together counts once
+DECREASE_INTERVAL = 1.0
+
+# The limit is decreased when the recent share of failed queries
+# is above this
+ERROR_RATE_THRESHOLD = 0.5
+
+# The limit does not grow while the recent latency is more than
+# this many times the long-term one
+LATENCY_TOLERANCE = 2.0
+
+# Weights of a new sample in exponentially weighted moving averages
+# of recent and long-term values
+EWMA_WEIGHT = 0.1
+BASELINE_WEIGHT = 0.01
+
+# Nameserver whose slot and token were taken for the next exchange
+# of the current thread or asyncio task, in a list so that the exchange
+# can mark them used, see admission()
+_admitted = contextvars.ContextVar("admitted", default=None)
+
+
+class AIMDLimiter:
+    """
+    Limit of queries in flight, adapted to latency and failures
+    reported by release().
+
+    The limit doubles every round trip until the first failure (slow
+    start), then it grows by one per round trip.
+    """
+
+    def __init__(self, maximum, minimum=1, initial=INITIAL_LIMIT):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.inflight = 0
+        self.queries = 0
+        self.timeouts = 0
+        self.servfails = 0
+        self.rtt = None
+        self.base_rtt = None
+        self.error_rate = 0.0
+        self._slow_start = True
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = deque()
+
+    def try_acquire(self):
+        """Take a slot if one is free, return whether it was taken"""
+        with self._cond:
+            if self.inflight < int(self.limit):
+                self.inflight += 1
+                return True
+            return False
+
+    def acquire(self, timeout=None):
+        """
+        Wait for a free slot and take it.
+        Return whether it was taken within `timeout` seconds.
+        """
+        with self._cond:
+            if not self._cond.wait_for(
+                lambda: self.inflight < int(self.limit), timeout,
+            ):
+                return False
+            self.inflight += 1
+            return True
+
+    async def acquire_async(self, timeout=None):
+        """Wait for a free slot without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            with self._cond:
+                if self.inflight < int(self.limit):
+                    self.inflight += 1
+                    return True
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            if deadline is None:
+                await waiter
+                continue
+            try:
+                await asyncio.wait_for(waiter, deadline - loop.time())
+            except asyncio.TimeoutError:
+                return False
+
+    def cancel(self):
+        """Free a slot not used for a query"""
+        with self._cond:
+            self.inflight -= 1
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+            self._async_waiters.clear()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def release(self, rtt=None, timeout=False, servfail=False):
+        """
+        Free a slot, adapting the limit to the outcome of the query.
+        `rtt` is None if the query did not get an answer.
+        """
+        with self._cond:
+            self.inflight -= 1
+            self.queries += 1
+            failed = timeout or servfail
+            self.timeouts += timeout
+            self.servfails += servfail
+            self.error_rate += EWMA_WEIGHT * (failed - self.error_rate)
+            if failed and self.error_rate > ERROR_RATE_THRESHOLD:
+                self._decrease()
+            elif rtt is not None:
+                self._increase(rtt)
+            self._cond.notify_all()
+            waiters = list(self._async_waiters)
+            self._async_waiters.clear()
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def _increase(self, rtt):
+        if self.rtt is None:
+            self.rtt = self.base_rtt = rtt
+        else:
+            self.rtt += EWMA_WEIGHT * (rtt - self.rtt)
+            self.base_rtt += BASELINE_WEIGHT * (rtt - self.base_rtt)
+        if self.rtt > self.base_rtt * LATENCY_TOLERANCE:
+            # Queries are queueing up somewhere, hold the limit
+            return
+        if self._slow_start:
+            self.limit += 1
+        else:
+            self.limit += 1 / self.limit
+        self.limit = min(self.limit, self.maximum)
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < DECREASE_INTERVAL:
+            return
+        self._last_decrease = now
+        self._slow_start = False
+        self.limit = max(self.minimum, self.limit * BACKOFF)
+
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class TokenBucket:
+    """Ceiling of `rate` queries per second, allowing bursts of `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate / 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, timeout=None):
+        """
+        Take a token, return number of seconds to wait before using it.
+        Return None without taking it if the wait exceeds `timeout`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate,
+            )
+            self.updated = now
+            wait = max(0, (1 - self.tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                return None
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return wait
+
+    def cancel(self):
+        """Return a token not used for a query"""
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class ThrottledNameserver(dns.nameserver.Nameserver):
+    """
+    Nameserver wrapper limiting and measuring queries sent through
+    the wrapped one. Any of `limiter`, `bucket` and `health` may be None.
+    """
+
+    def __init__(self, nameserver, limiter=None, bucket=None, health=None):
+        super().__init__()
+        self.nameserver = nameserver
+        self.limiter = limiter
+        self.bucket = bucket
+        self.health = health
+
+    def __str__(self):
+        return str(self.nameserver)
+
+    def kind(self):
+        return self.nameserver.kind()
+
+    def is_always_max_size(self):
+        return self.nameserver.is_always_max_size()
+
+    def answer_nameserver(self):
+        return self.nameserver.answer_nameserver()
+
+    def answer_port(self):
+        return self.nameserver.answer_port()
+
+    def admit(self):
+        """Wait for a slot and a token, without a time limit"""
+        if self.limiter is not None:
+            self.limiter.acquire()
+        if self.bucket is not None:
+            time.sleep(self.bucket.reserve())
+
+    async def admit_async(self):
+        if self.limiter is not None:
+            await self.limiter.acquire_async()
+        if self.bucket is not None:
+            await asyncio.sleep(self.bucket.reserve())
+
+    def cancel(self):
+        """Return a slot and a token not used for a query"""
+        if self.limiter is not None:
+            self.limiter.cancel()
+        if self.bucket is not None:
+            self.bucket.cancel()
+
+    def _is_admitted(self):
+        """Return whether admission() took a slot for this exchange"""
+        admitted = _admitted.get()
+        if admitted is None or admitted[0] is not self:
+            return False
+        admitted[0] = None
+        return True
+
+    def _wait(self, timeout):
+        """
+        Wait at most `timeout` seconds for a slot and a token,
+        the exchange times out without them.
+        """
+        if self.limiter is not None and not self.limiter.acquire(timeout):
+            raise dns.exception.Timeout(timeout=timeout)
+        delay = 0
+        if self.bucket is not None:
+            delay = self.bucket.reserve(timeout)
+            if delay is None:
+                if self.limiter is not None:
+                    self.limiter.cancel()
+                raise dns.exception.Timeout(timeout=timeout)
+        return delay
+
+    def query(
+        self, request, timeout, source, source_port, max_size,
+        one_rr_per_rrset=False, ignore_trailing=False,
+    ):
+        if not self._is_admitted():
+            time.sleep(self._wait(timeout))
+        start = time.monotonic()
+        try:
+            response = self.nameserver.query(
+                request, timeout, source, source_port, max_size,
+                one_rr_per_rrset, ignore_trailing,
+            )
+        except BaseException as e:
+            self._release(start, max_size, error=e)
+            raise
+        self._release(start, max_size, response=response)
+        return response
+
+    async def async_query(
+        self, request, timeout, source, source_port, max_size, backend,
+        one_rr_per_rrset=False, ignore_trailing=False,
+    ):
+        if not self._is_admitted():
+            await backend.sleep(await self._wait_async(timeout))
+        start = time.monotonic()
+        try:
+            response = await self.nameserver.async_query(
+                request, timeout, source, source_port, max_size, backend,
+                one_rr_per_rrset, ignore_trailing,
+            )
+        except BaseException as e:
+            self._release(start, max_size, error=e)
+            raise
+        self._release(start, max_size, response=response)
+        return response
+
+    async def _wait_async(self, timeout):
+        if self.limiter is not None and not (
+            await self.limiter.acquire_async(timeout)
+        ):
+            raise dns.exception.Timeout(timeout=timeout)
+        delay = 0
+        if self.bucket is not None:
+            delay = self.bucket.reserve(timeout)
+            if delay is None:
+                if self.limiter is not None:
+                    self.limiter.cancel()
+                raise dns.exception.Timeout(timeout=timeout)
+        return delay
+
+    def _release(self, start, max_size, response=None, error=None):
+        rtt = time.monotonic() - start
+        outcome = exchange_outcome(response, error)
+        EXCHANGE_DURATION.observe(rtt, "tcp" if max_size else "udp", outcome)
+        if self.health is not None:
+            self.health.observe(
+                rtt if error is None else None, outcome in FAILED_OUTCOMES,
+            )
+        if self.limiter is None:
+            return
+        if error is not None:
+            self.limiter.release(
+                timeout=isinstance(error, dns.exception.Timeout),
+            )
+        else:
+            self.limiter.release(
+                rtt=rtt,
+                servfail=response.rcode() == dns.rcode.SERVFAIL,
+            )
+
+
+def _first_throttled(resolver):
+    nameservers = resolver.nameservers
+    if nameservers and isinstance(nameservers[0], ThrottledNameserver):
+        return nameservers[0]
+    return None
+
+
+@contextlib.contextmanager
+def admission(resolver):
+    """
+    Take a slot and a token of the first nameserver of the resolver
+    for the first exchange of a query made within the block, before
+    the lifetime of the query starts. They are returned if unused.
+    """
+    ns = _first_throttled(resolver)
+    if ns is None:
+        yield
+        return
+    ns.admit()
+    admitted = [ns]
+    token = _admitted.set(admitted)
+    try:
+        yield
+    finally:
+        _admitted.reset(token)
+        if admitted[0] is not None:
+            ns.cancel()
+
+
+@contextlib.asynccontextmanager
+async def admission_async(resolver):
+    """Asynchronous variant of admission()"""
+    ns = _first_throttled(resolver)
+    if ns is None:
+        yield
+        return
+    await ns.admit_async()
+    admitted = [ns]
+    token = _admitted.set(admitted)
+    try:
+        yield
+    finally:
+        _admitted.reset(token)
+        if admitted[0] is not None:
+            ns.cancel()
+
+
+def exchange_outcome(response, error):
+    if isinstance(error, dns.exception.Timeout):
+        return "timeout"
+    if isinstance(error, dns.message.Truncated):
+        return "truncated"
+    if error is not None:
+        return "error"
+    return dns.rcode.to_text(response.rcode()).lower()
+
+
+def throttle_nameservers(resolver, max_inflight=None, max_qps=None):
+    """
+    Wrap resolver's nameservers in ThrottledNameserver.
+    Without limits, exchanges with them are only measured and their
+    health is tracked for the selection of nameservers.
+    With `max_inflight`, the number of queries in flight to each of them
+    is adaptive up to the maximum. With `max_qps`, queries to each of
+    them are limited to that many per second.
+    """
+    nameservers = []
+    alternatives = len(resolver.nameservers) > 1
+    for ns in resolver.nameservers:
+        if isinstance(ns, str) and dns.inet.is_address(ns):
+            port = resolver.nameserver_ports.get(ns, resolver.port)
+            ns = dns.nameserver.Do53Nameserver(ns, port)
+        if isinstance(ns, dns.nameserver.Nameserver):
+            ns = ThrottledNameserver(
+                ns,
+                AIMDLimiter(max_inflight) if max_inflight else None,
+                TokenBucket(max_qps) if max_qps else None,
+                ResolverHealth(str(ns), alternatives),
+            )
+        nameservers.append(ns)
+    resolver.nameservers = nameservers
+
+
+def report_nameservers(resolver):
+    """Log what the adaptive limiters found out about the nameservers"""
+    for ns in resolver.nameservers:
+        limiter = getattr(ns, "limiter", None)
+        if limiter is None:
+            continue
+        rtt = f"{limiter.rtt * 1000:.1f} ms" if limiter.rtt else "unknown"
+        logger.info(
+            "Resolver %s: %d queries, %d timeouts, %d SERVFAIL, "
+            "average RTT %s, in-flight limit %d", ns, limiter.queries,
+            limiter.timeouts, limiter.servfails, rtt, limiter.limit,
+        )
@@ -0,0 +1,145 @@
+"""
+Reading of database dumps.
+
+Decompression and parsing can run in separate processes, one for each
+dump file, so that they do not compete with the scanners for the GIL.
+"""
+import io
+import itertools
+import multiprocessing
+import shutil
+import subprocess
+
+from . import metrics
+from . import rpsl
+from .log import logger
+from .metrics import PARSE_DURATION, timed_iter
+
+# External Gzip decompressor used when available
+DECOMPRESSOR = "pigz"
+
+# Number of objects sent from reader processes at once
+BATCH_SIZE = 256
+
+# Maximum number of batches waiting for the scanners
+QUEUE_SIZE = 64
+
+
+class ReaderError(Exception):
+    pass
+
+
+def parse_dump(path, fast=False):
+    """
+    Yield objects having ds-rdata from a dump file,
+    or from the standard input if path is None.
+    """
+    proc = None
+    if path is not None and path.lower().endswith(".gz"):
+        decompressor = shutil.which(DECOMPRESSOR)
+        if decompressor is not None:
+            proc = subprocess.Popen(
+                [decompressor, "-dc", path], stdout=subprocess.PIPE,
+            )
+    if proc is None:
+        fh = rpsl.open_dump(path, binary=fast)
+    elif fast:
+        fh = proc.stdout
+    else:
+        fh = io.TextIOWrapper(proc.stdout, encoding="latin1")
+
+    try:
+        if fast:
+            objects = rpsl.parse_ds_objects(fh)
+        else:
+            objects = (
+                obj for obj in rpsl.parse_rpsl_objects(fh)
+                if "ds-rdata" in obj
+            )
+        yield from timed_iter(
+            objects, PARSE_DURATION, "fast" if fast else "standard",
+        )
+        # Parser may stop early on an error in the dump
+        if proc is not None and fh.read(1):
+            proc.kill()
+    except GeneratorExit:
+        if proc is not None:
+            proc.kill()
+        raise
+    finally:
+        if path is not None:
+            fh.close()
+        if proc is not None:
+            proc.wait()
+    if proc is not None and proc.returncode > 0:
+        raise ReaderError(
+            f"{DECOMPRESSOR} failed to decompress {path} "
+            f"with exit code {proc.returncode}",
+        )
+
+
+def read_dumps(paths, fast=False, processes=False):
+    """
+    Return iterator of objects having ds-rdata from all the dumps.
+    Read the standard input if there are no paths.
+
+    With `processes`, each dump is read by its own process and the
+    objects are returned in the order they arrive.
+    """
+    if not paths:
+        return parse_dump(None, fast)
+    if not processes:
+        return itertools.chain.from_iterable(
+            parse_dump(path, fast) for path in paths
+        )
+    ctx = multiprocessing.get_context()
+    queue = ctx.Queue(maxsize=QUEUE_SIZE)
+    readers = [
+        ctx.Process(
+            target=_reader_process,
+            args=(path, fast, queue),
+            name=f"reader-{i}",
+            daemon=True,
+        ) for i, path in enumerate(paths)
+    ]
+    for r in readers:
+        r.start()
+    return _receive_objects(queue, readers)
+
+
+def _reader_process(path, fast, queue):
+    # Drop metrics inherited from the parent, they are reported there
+    metrics.snapshot(reset=True)
+    try:
+        objects = parse_dump(path, fast)
+        while True:
+            batch = list(itertools.islice(objects, BATCH_SIZE))
+            if not batch:
+                break
+            queue.put(batch)
+    except Exception as e:
+        logger.exception("Failed to read %s", path)
+        queue.put(ReaderError(f"Failed to read {path}: {e}"))
+    finally:
+        queue.put(metrics.snapshot())
+        queue.put(None)
+
+
+def _receive_objects(queue, readers):
+    remaining = len(readers)
+    try:
+        while remaining:
+            batch = queue.get()
+            if batch is None:
+                remaining -= 1
+            elif isinstance(batch, ReaderError):
+                raise batch
+            elif isinstance(batch, dict):
+                metrics.merge(batch)
+            else:
+                yield from batch
+    finally:
+        for r in readers:
+            if r.is_alive():
+                r.terminate()
+            r.join()
@@ -0,0 +1,107 @@
+"""
+Deferred retries of domains failing with transient DNS errors.
+
+A domain whose queries time out or find no working nameserver is not
+retried right away, which would hold a scanning worker. It is set
+aside and scanned again after all the other domains, once a delay
+growing exponentially with the number of attempts has passed. Events
+of deferred attempts are dropped, only the last attempt is recorded.
+"""
+import threading
+import time
+
+from .dsscanner import get_domain_name
+from .log import logger
+from .stats import Event, capture, record_all
+
+# Events worth retrying the scan of a domain
+TRANSIENT_EVENTS = frozenset({Event.DNS_TIMEOUT, Event.DNS_LAME})
+
+
+class RetryQueue:
+    """
+    Domains waiting for another attempt. A domain is scanned at most
+    `attempts` times, the n-th retry waits `backoff` * 2^(n-1) seconds.
+    """
+
+    def __init__(self, attempts=3, backoff=10.0):
+        self.attempts = attempts
+        self.backoff = backoff
+        self._failures = {}
+        self._deferred = []
+        self._lock = threading.Lock()
+
+    def defer(self, obj, events):
+        """
+        Set the object aside if the scan failed transiently and it can be
+        retried. Return True if it was. Otherwise, the attempt is final,
+        and a recovery event is added to `events` for a retry that did
+        not fail transiently.
+        """
+        domain = get_domain_name(obj)
+        transient = any(event in TRANSIENT_EVENTS for _, event in events)
+        with self._lock:
+            failures = self._failures.pop(domain, 0)
+            if transient and failures + 1 < self.attempts:
+                self._failures[domain] = failures + 1
+                due = time.monotonic() + self.backoff * 2 ** failures
+                self._deferred.append((due, obj))
+                logger.debug("Scan of %s deferred", domain)
+                return True
+        if failures and not transient:
+            logger.info("Scan of %s recovered on retry", domain)
+            events.append((domain, Event.RETRY_RECOVERED))
+        return False
+
+    def rounds(self):
+        """
+        Yield lists of the deferred objects, once their delay has passed.
+        Objects deferred while scanning a round are yielded in the next
+        one, so the caller has to finish a round before asking for the
+        next one.
+        """
+        while True:
+            with self._lock:
+                deferred, self._deferred = self._deferred, []
+            if not deferred:
+                return
+            delay = max(due for due, _ in deferred) - time.monotonic()
+            logger.info(
+                "Retrying %d domains in %.0f seconds",
+                len(deferred), max(delay, 0),
+            )
+            if delay > 0:
+                time.sleep(delay)
+            yield [obj for _, obj in deferred]
+
+    def wrap(self, scan):
+        """Return variant of the scan function deferring failed scans"""
+        def scan_or_defer(obj):
+            events = []
+            try:
+                with capture() as events:
+                    o = scan(obj)
+            except BaseException:
+                record_all(events)
+                raise
+            if self.defer(obj, events):
+                return None
+            record_all(events)
+            return o
+        return scan_or_defer
+
+    def wrap_async(self, scan):
+        """Asynchronous variant of wrap()"""
+        async def scan_or_defer(obj):
+            events = []
+            try:
+                with capture() as events:
+                    o = await scan(obj)
+            except BaseException:
+                record_all(events)
+                raise
+            if self.defer(obj, events):
+                return None
+            record_all(events)
+            return o
+        return scan_or_defer
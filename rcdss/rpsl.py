@@ -1,9 +1,17 @@
+import gzip
+import io
+import json
+import mmap
+import os
+import stat
+import sys
+from collections.abc import MutableMapping
 
 from .log import logger
 
 # Keys that should NOT be parsed into lists
 SINGLE_VALUE_KEYS = {
-    "domain", "created", "last-modified", "reason",
+    "domain", "created", "last-modified", "reason", "cds-inception",
 }
 
 IGNORED_KEYS = {
@@ -22,6 +30,26 @@ KEY_ORDER = [
     "reason",
 ]
 
+# Keys stored in slots of DomainObject
+SLOTS = {
+    "domain": "domain",
+    "nserver": "nserver",
+    "old-ds-rdata": "old_ds_rdata",
+    "ds-rdata": "ds_rdata",
+    "last-modified": "last_modified",
+    "reason": "reason",
+    "cds-inception": "cds_inception",
+}
+
+# Keys passed to machine-readable output only
+INTERNAL_KEYS = {"cds-inception"}
+
+# Keys in the span rendered before the slots, others go after them
+HEAD_KEYS = {"descr"}
+
+# Size of chunks read by parse_ds_objects() from non-seekable files
+CHUNK_SIZE = 1 << 20
+
 
 def parse_rpsl_objects(fh):
     """Yield parsed objects"""
@@ -36,7 +64,7 @@ def parse_rpsl_objects(fh):
                 logger.error(line.strip())
                 return
         elif line.startswith(('+', '\t', ' ')):
-            buffer[-1] += line[1:].lstrip()
+            buffer[-1] = buffer[-1].rstrip('\n') + line[1:].lstrip()
         else:
             buffer.append(line)
     # at the end of the file, yield the last object if there's one
@@ -44,29 +72,236 @@ def parse_rpsl_objects(fh):
         yield parse_rpsl_object(buffer)
 
 
+def open_dump(path, binary=False):
+    """
+    Open a latin1 encoded dump, optionally compressed with Gzip.
+    Read standard input if path is None.
+    """
+    if path is None:
+        return sys.stdin.buffer if binary else sys.stdin
+    mode = "rb" if binary else "rt"
+    encoding = None if binary else "latin1"
+    if path.lower().endswith(".gz"):
+        return gzip.open(path, mode, encoding=encoding)
+    return open(path, mode, encoding=encoding)
+
+
+def parse_ds_objects(fh):
+    """
+    Yield parsed objects having a ds-rdata attribute.
+
+    This is a faster equivalent of filtering parse_rpsl_objects().
+    It works on raw bytes of a binary file and skips objects without
+    ds-rdata before decoding them. Uncompressed files are memory-mapped.
+    """
+    if _is_regular_file(fh):
+        offset = fh.tell()
+        if os.fstat(fh.fileno()).st_size <= offset:
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            for obj in _parse_ds_buffer(buf, offset, len(buf)):
+                if obj is None:
+                    return
+                yield obj
+        return
+
+    rest = b""
+    while True:
+        chunk = fh.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        buf = rest + chunk
+        last = buf.rfind(b"\n\n")
+        if last < 0:
+            rest = buf
+            continue
+        for obj in _parse_ds_buffer(buf, 0, last):
+            if obj is None:
+                return
+            yield obj
+        rest = buf[last + 2:]
+    for obj in _parse_ds_buffer(rest, 0, len(rest)):
+        if obj is None:
+            return
+        yield obj
+
+
+def _is_regular_file(fh):
+    if not isinstance(fh, (io.BufferedReader, io.FileIO)):
+        return False
+    try:
+        return stat.S_ISREG(os.fstat(fh.fileno()).st_mode) and fh.seekable()
+    except (OSError, ValueError):
+        return False
+
+
+def _parse_ds_buffer(buf, start, stop):
+    """
+    Yield objects with ds-rdata from buf[start:stop].
+    Yield None if an error in the dump was found.
+    """
+    while start < stop:
+        end = buf.find(b"\n\n", start, stop)
+        if end < 0:
+            end = stop
+        if _find_error(buf, start, end):
+            yield None
+            return
+        if buf.find(b"ds-rdata:", start, end) >= 0:
+            obj = _parse_block(buf[start:end].decode("latin1"))
+            if obj is not None and "ds-rdata" in obj:
+                yield obj
+        start = end + 2
+
+
+def _find_error(buf, start, end):
+    """Log and return True if there is an %ERROR line in the span"""
+    pos = buf.find(b"%ERROR", start, end)
+    while pos >= 0:
+        if pos == 0 or buf[pos - 1:pos] == b"\n":
+            line_end = buf.find(b"\n", pos, end)
+            if line_end < 0:
+                line_end = end
+            logger.error(buf[pos:line_end].decode("latin1").strip())
+            return True
+        pos = buf.find(b"%ERROR", pos + 1, end)
+    return False
+
+
+def _parse_block(text):
+    """Parse text of one object, joining continuation lines"""
+    lines = []
+    for line in text.split("\n"):
+        if not line or line.startswith(("#", "%")):
+            continue
+        if line.startswith(("+", "\t", " ")):
+            if lines:
+                lines[-1].append(line[1:].lstrip())
+        else:
+            lines.append([line])
+    if not lines:
+        return None
+    return parse_rpsl_object(["".join(parts) for parts in lines])
+
+
+class DomainObject(MutableMapping):
+    """
+    Compact domain object with the attributes used by the scan stored
+    in slots. Other kept attributes are stored as their output lines,
+    in two spans rendered before and after the DS attributes.
+    Supports the mapping operations used on dicts of domain objects,
+    attributes in the spans can be read but not modified.
+    """
+
+    __slots__ = (
+        "domain", "nserver", "old_ds_rdata", "ds_rdata", "last_modified",
+        "reason", "cds_inception", "head", "tail",
+    )
+
+    def __init__(self, domain):
+        self.domain = domain
+        self.nserver = None
+        self.old_ds_rdata = None
+        self.ds_rdata = None
+        self.last_modified = None
+        self.reason = None
+        self.cds_inception = None
+        self.head = ""
+        self.tail = ""
+
+    def __getitem__(self, key):
+        slot = SLOTS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            if value is None:
+                raise KeyError(key)
+            return value
+        values = [v for k, v in self._span_items() if k == key]
+        if not values:
+            raise KeyError(key)
+        return values[0] if key in SINGLE_VALUE_KEYS else values
+
+    def __setitem__(self, key, value):
+        slot = SLOTS.get(key)
+        if slot is None or value is None:
+            raise KeyError(key)
+        setattr(self, slot, value)
+
+    def __delitem__(self, key):
+        slot = SLOTS.get(key)
+        if slot is None or getattr(self, slot) is None or slot == "domain":
+            raise KeyError(key)
+        setattr(self, slot, None)
+
+    def __iter__(self):
+        keys = [
+            k for k, slot in SLOTS.items() if getattr(self, slot) is not None
+        ]
+        keys.extend(dict.fromkeys(k for k, _ in self._span_items()))
+        return iter(keys)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __eq__(self, other):
+        if isinstance(other, DomainObject):
+            return all(
+                getattr(self, slot) == getattr(other, slot)
+                for slot in self.__slots__
+            )
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"DomainObject({dict(self)!r})"
+
+    def copy(self):
+        """Return shallow copy, like dict.copy()"""
+        obj = DomainObject.__new__(DomainObject)
+        for slot in self.__slots__:
+            setattr(obj, slot, getattr(self, slot))
+        return obj
+
+    def _span_items(self):
+        for line in (self.head + self.tail).splitlines():
+            key, _, value = line.partition(":")
+            yield key, value.strip()
+
+
 def parse_rpsl_object(buffer):
     name, _, value = buffer[0].partition(':')
-    obj = {
-        "domain": value.strip(),
-    }
+    obj = DomainObject(value.strip())
+    head = []
+    tail = []
     for line in buffer:
         name, _, value = line.partition(':')
-        value = value.strip()
         if name in IGNORED_KEYS:
             continue
-        if name in SINGLE_VALUE_KEYS:
-            obj[name] = value
-        elif name in obj:
-            obj[name].append(value)
+        value = value.strip()
+        slot = SLOTS.get(name)
+        if slot is None:
+            span = head if name in HEAD_KEYS else tail
+            span.append("{:15} {}\n".format(name + ":", value))
+        elif name in SINGLE_VALUE_KEYS:
+            setattr(obj, slot, value)
         else:
-            obj[name] = [value, ]
+            values = getattr(obj, slot)
+            if values is None:
+                setattr(obj, slot, [value, ])
+            else:
+                values.append(value)
+    obj.head = "".join(head)
+    obj.tail = "".join(tail)
     return obj
 
 
 def write_rpsl_object(obj):
+    if isinstance(obj, DomainObject):
+        return _write_domain_object(obj)
     buf = []
     keys = [k for k in KEY_ORDER if k in obj]
-    keys.extend(set(obj) - set(keys))
+    keys.extend(set(obj) - set(keys) - INTERNAL_KEYS)
     for k in keys:
         if isinstance(obj[k], list):
             values = obj[k]
@@ -76,3 +311,47 @@ def write_rpsl_object(obj):
             buf.append("{:15} {}".format(k + ":", v))
     buf.append("")
     return "\n".join(buf)
+
+
+def _write_domain_object(obj):
+    """Render DomainObject in the order of KEY_ORDER"""
+    buf = ["{:15} {}\n".format("domain:", obj.domain), obj.head]
+    for key, values in [
+        ("nserver:", obj.nserver),
+        ("old-ds-rdata:", obj.old_ds_rdata),
+        ("ds-rdata:", obj.ds_rdata),
+    ]:
+        for v in values or ():
+            buf.append("{:15} {}\n".format(key, v))
+    buf.append(obj.tail)
+    for key, value in [
+        ("last-modified:", obj.last_modified),
+        ("reason:", obj.reason),
+    ]:
+        if value is not None:
+            buf.append("{:15} {}\n".format(key, value))
+    return "".join(buf)
+
+
+def write_json_object(obj):
+    """
+    Render modified object as one line of JSON describing the change
+    of its DS set, for tools updating the database.
+    """
+    new_ds = obj.get("ds-rdata", [])
+    return json.dumps({
+        "domain": obj["domain"],
+        "action": "update" if new_ds else "delete",
+        "old-ds-rdata": obj.get("old-ds-rdata", []),
+        "ds-rdata": new_ds,
+        "reason": obj.get("reason"),
+        "cds-inception": obj.get("cds-inception"),
+        "last-modified": obj.get("last-modified"),
+    })
+
+
+# Output formats of modified objects
+WRITERS = {
+    "rpsl": write_rpsl_object,
+    "ndjson": write_json_object,
+}
@@ -0,0 +1,198 @@
+"""
+Order in which a query tries the resolvers.
+
+Health of each resolver is tracked from all exchanges with it:
+a smoothed RTT of its answers and a smoothed share of failed exchanges.
+A resolver failing most of its recent exchanges is ejected for a while,
+it is only tried after all the others, if there are any. With more than one --ns, the
+healthy resolvers are ordered by the selection policy:
+
+random
+    uniformly at random
+fastest
+    by their smoothed RTT, resolvers not tried yet first and resolvers
+    that never answered last
+weighted
+    at random, each one first with chance proportional to its rate
+    of successful answers, (1 - error rate) / RTT
+"""
+import random
+import threading
+import time
+
+from .log import logger
+
+POLICIES = ("random", "fastest", "weighted")
+
+# Outcomes of exchanges counted as failures of the resolver,
+# see ratelimit.exchange_outcome()
+FAILED_OUTCOMES = {"timeout", "error", "servfail", "refused"}
+
+# Weight of a new sample in the smoothed RTT and error rate
+HEALTH_WEIGHT = 0.1
+
+# A resolver is ejected when its error rate exceeds this, once it has
+# seen enough exchanges for the rate to mean something
+EJECT_ERROR_RATE = 0.5
+EJECT_MIN_QUERIES = 20
+
+# Seconds an ejected resolver is tried last
+EJECT_INTERVAL = 30.0
+
+# Floors of the RTT and the success rate in weights of resolvers
+MIN_RTT = 0.001
+MIN_SUCCESS_RATE = 0.01
+
+# Selection policy, see setup_selection()
+_policy = "random"
+
+
+def setup_selection(policy):
+    """Order resolvers by `policy`, one of POLICIES"""
+    global _policy
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown selection policy {policy}")
+    _policy = policy
+
+
+class ResolverHealth:
+    """
+    Smoothed RTT and error rate of a resolver, and its ejections.
+    A resolver without `alternatives` is never ejected, there is
+    no other one to try first.
+    """
+
+    def __init__(self, name, alternatives=True):
+        self.name = name
+        self.alternatives = alternatives
+        self.queries = 0
+        self.failures = 0
+        self.rtt = None
+        self.error_rate = 0.0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, rtt=None, failed=False):
+        """Record an exchange, `rtt` is None if it got no answer"""
+        now = time.monotonic()
+        with self._lock:
+            self.queries += 1
+            self.failures += failed
+            self.error_rate += HEALTH_WEIGHT * (failed - self.error_rate)
+            if rtt is not None and not failed:
+                if self.rtt is None:
+                    self.rtt = rtt
+                else:
+                    self.rtt += HEALTH_WEIGHT * (rtt - self.rtt)
+            if (
+                failed and self.alternatives and
+                self.queries >= EJECT_MIN_QUERIES and
+                self.error_rate > EJECT_ERROR_RATE and
+                not self.is_ejected(now)
+            ):
+                self.ejected_until = now + EJECT_INTERVAL
+                self.ejections += 1
+                # Give it a chance when it is tried again
+                self.error_rate = EJECT_ERROR_RATE / 2
+                logger.warning(
+                    "Resolver %s ejected for %.0f seconds",
+                    self.name, EJECT_INTERVAL,
+                )
+
+    def is_ejected(self, now=None):
+        if now is None:
+            now = time.monotonic()
+        return now < self.ejected_until
+
+    def weight(self, untried_rtt, unanswered_rtt):
+        """
+        Return rate of successful answers. Resolvers without an RTT
+        count with `untried_rtt`, or `unanswered_rtt` if they failed.
+        """
+        rtt = self.rtt
+        if rtt is None:
+            rtt = unanswered_rtt if self.queries else untried_rtt
+        success_rate = max(1 - self.error_rate, MIN_SUCCESS_RATE)
+        return success_rate / max(rtt, MIN_RTT)
+
+
+def order_nameservers(nameservers, rotate=False):
+    """
+    Return list of the nameservers in the order a query should try them.
+    Without `rotate`, they keep their configured order, except for
+    ejected ones moved to the end.
+    """
+    nameservers = list(nameservers)
+    if len(nameservers) < 2:
+        return nameservers
+    if rotate:
+        nameservers = ORDERS[_policy](nameservers)
+    now = time.monotonic()
+    healthy = []
+    ejected = []
+    for ns in nameservers:
+        health = getattr(ns, "health", None)
+        if health is not None and health.is_ejected(now):
+            ejected.append(ns)
+        else:
+            healthy.append(ns)
+    return healthy + ejected
+
+
+def _order_random(nameservers):
+    random.shuffle(nameservers)
+    return nameservers
+
+
+def _order_fastest(nameservers):
+    def key(ns):
+        health = getattr(ns, "health", None)
+        if health is None or not health.queries:
+            # Resolvers not tried yet are tried first, to measure them
+            return (0, 0.0, random.random())
+        if health.rtt is None:
+            # Resolvers that only failed are tried last
+            return (2, 0.0, random.random())
+        return (1, health.rtt, random.random())
+    return sorted(nameservers, key=key)
+
+
+def _order_weighted(nameservers):
+    healths = [getattr(ns, "health", None) for ns in nameservers]
+    rtts = [h.rtt for h in healths if h is not None and h.rtt is not None]
+    # Resolvers not tried yet are as good as the best one, resolvers
+    # that only failed as bad as the worst one
+    untried_rtt = min(rtts, default=MIN_RTT)
+    unanswered_rtt = max(rtts, default=MIN_RTT)
+    keys = {}
+    for ns, health in zip(nameservers, healths):
+        weight = 1.0
+        if health is not None:
+            weight = health.weight(untried_rtt, unanswered_rtt)
+        # Weighted random sampling without replacement (Efraimidis and
+        # Spirakis), largest keys first
+        keys[id(ns)] = random.random() ** (1 / weight)
+    return sorted(nameservers, key=lambda ns: keys[id(ns)], reverse=True)
+
+
+ORDERS = {
+    "random": _order_random,
+    "fastest": _order_fastest,
+    "weighted": _order_weighted,
+}
+
+
+def report_health(resolver):
+    """Log health of the resolver's nameservers"""
+    for ns in resolver.nameservers:
+        health = getattr(ns, "health", None)
+        if health is None:
+            continue
+        rtt = f"{health.rtt * 1000:.1f} ms" if health.rtt else "unknown"
+        logger.info(
+            "Resolver %s: %d exchanges, %d failed, smoothed RTT %s, "
+            "error rate %.2f, ejected %d times", health.name,
+            health.queries, health.failures, rtt, health.error_rate,
+            health.ejections,
+        )
@@ -0,0 +1,262 @@
+"""
+Scanning sharded across worker processes.
+
+Domains are assigned to workers by a hash of their name. Each worker
+runs its own scanning engine and reports results of all objects,
+together with the events recorded while scanning them. The parent
+process puts the results back into input order, so the output and
+the stats do not depend on timing of the workers.
+"""
+import multiprocessing
+import threading
+import zlib
+from queue import Empty, Full, Queue
+
+from . import asyncscanner
+from . import config
+from . import metrics
+from . import pipeline
+from .asyncscanner import do_cds_scan as async_do_cds_scan
+from .dsscanner import do_cds_scan, get_domain_name
+from .log import logger
+from .stats import capture, record_all
+
+# Number of objects sent to a worker at once
+BATCH_SIZE = 64
+
+# Maximum number of batches waiting for each worker
+QUEUE_SIZE = 16
+
+# Sentinel telling a worker to finish, or reporting it has finished
+STOP = None
+
+
+class WorkerError(Exception):
+    pass
+
+
+def shard_of(obj, shards):
+    """Return index of the shard scanning the object"""
+    return zlib.crc32(get_domain_name(obj).encode("latin1")) % shards
+
+
+class ShardedScanner:
+    """
+    Pool of worker processes scanning disjoint sets of domains.
+
+    Workers should be started before the parent process starts any
+    threads, as they may be forked.
+    """
+
+    def __init__(self, processes, options, engine="threads", threads=1,
+                 concurrency=1, retries=None):
+        self.retries = retries
+        ctx = multiprocessing.get_context()
+        self.results = ctx.Queue()
+        self.inputs = [
+            ctx.Queue(maxsize=QUEUE_SIZE) for _ in range(processes)
+        ]
+        self.workers = [
+            ctx.Process(
+                target=_worker_main,
+                args=(
+                    inq, self.results, options, engine, threads, concurrency,
+                ),
+                name=f"scanner-{i}",
+                daemon=True,
+            ) for i, inq in enumerate(self.inputs)
+        ]
+
+    def start(self):
+        for w in self.workers:
+            w.start()
+
+    def scan_objects(self, objects, outq):
+        """
+        Scan all objects, putting modified objects into `outq`
+        in the order of input. Deferred retries are scanned at the end.
+        """
+        merger = _Merger(self.results, outq, self.workers, self.retries)
+        merger.start()
+        try:
+            seq = self._send_objects(objects, 0, merger)
+            if self.retries is not None:
+                merger.wait_merged(seq)
+                for deferred in self.retries.rounds():
+                    seq = self._send_objects(deferred, seq, merger)
+                    merger.wait_merged(seq)
+            for i in range(len(self.inputs)):
+                self._send(i, STOP, merger)
+        except BaseException:
+            for w in self.workers:
+                w.terminate()
+            raise
+        finally:
+            merger.join()
+            for w in self.workers:
+                w.join()
+        if merger.error is not None:
+            raise merger.error
+
+    def _send_objects(self, objects, seq, merger):
+        """Send objects numbered from `seq`, return the next number"""
+        shards = len(self.inputs)
+        batches = [[] for _ in range(shards)]
+        for obj in objects:
+            if self.retries is not None:
+                # Kept to be sent again if the scan is deferred
+                merger.objects[seq] = obj
+            i = shard_of(obj, shards)
+            batches[i].append((seq, obj))
+            if len(batches[i]) >= BATCH_SIZE:
+                self._send(i, batches[i], merger)
+                batches[i] = []
+            seq += 1
+        for i, batch in enumerate(batches):
+            if batch:
+                self._send(i, batch, merger)
+        return seq
+
+    def _send(self, i, batch, merger):
+        while True:
+            if merger.error is not None:
+                raise merger.error
+            try:
+                self.inputs[i].put(batch, timeout=1)
+                return
+            except Full:
+                continue
+
+
+class _Merger(threading.Thread):
+    """Thread putting results from the workers back into input order"""
+
+    def __init__(self, results, outq, workers, retries=None):
+        super().__init__(daemon=True)
+        self.results = results
+        self.outq = outq
+        self.workers = workers
+        self.retries = retries
+        # Objects in flight by number, kept when retries are enabled
+        self.objects = {}
+        self.merged = 0
+        self.error = None
+        self._cond = threading.Condition()
+
+    def wait_merged(self, count):
+        """Wait until results of the first `count` objects are merged"""
+        with self._cond:
+            while self.merged < count:
+                if self.error is not None:
+                    raise self.error
+                if not self.is_alive():
+                    raise WorkerError("Merging of results stopped")
+                self._cond.wait(timeout=1)
+
+    def run(self):
+        pending = {}
+        running = len(self.workers)
+        while running:
+            try:
+                batch = self.results.get(timeout=1)
+            except Empty:
+                if any(w.exitcode for w in self.workers):
+                    self.error = WorkerError("Scanning worker crashed")
+                    logger.error(str(self.error))
+                    return
+                continue
+            if batch is STOP:
+                running -= 1
+                continue
+            if isinstance(batch, dict):
+                metrics.merge(batch)
+                continue
+            for seq, o, events in batch:
+                pending[seq] = (o, events)
+            while self.merged in pending:
+                self._merge(*pending.pop(self.merged))
+        if pending:
+            self.error = WorkerError(f"{len(pending)} results out of order")
+
+    def _merge(self, o, events):
+        obj = self.objects.pop(self.merged, None)
+        if obj is None or not self.retries.defer(obj, events):
+            record_all(events)
+            if o:
+                self.outq.put(o)
+        with self._cond:
+            self.merged += 1
+            self._cond.notify_all()
+
+
+def _receive_objects(inq):
+    while True:
+        batch = inq.get()
+        if batch is STOP:
+            return
+        yield from batch
+
+
+def _send_results(localq, results):
+    """Forward results to the parent in batches"""
+    while True:
+        batch = [localq.get()]
+        while batch[-1] is not STOP and len(batch) < BATCH_SIZE:
+            try:
+                batch.append(localq.get_nowait())
+            except Empty:
+                break
+        if batch[-1] is STOP:
+            if len(batch) > 1:
+                results.put(batch[:-1])
+            return
+        results.put(batch)
+
+
+def _scan_item(item):
+    seq, obj = item
+    with capture() as events:
+        try:
+            o = do_cds_scan(obj)
+        except Exception:
+            logger.exception(
+                "Unexpected error while scanning %s", obj.get("domain"),
+            )
+            o = None
+    return seq, o, events
+
+
+async def _async_scan_item(item):
+    seq, obj = item
+    with capture() as events:
+        try:
+            o = await async_do_cds_scan(obj)
+        except Exception:
+            logger.exception(
+                "Unexpected error while scanning %s", obj.get("domain"),
+            )
+            o = None
+    return seq, o, events
+
+
+def _worker_main(inq, results, options, engine, threads, concurrency):
+    # Drop metrics inherited from the parent, they are reported there
+    metrics.snapshot(reset=True)
+    config.setup_scanning(
+        engine=engine, threads=threads, concurrency=concurrency, **options,
+    )
+    localq = Queue(maxsize=BATCH_SIZE * 4)
+    sender = threading.Thread(target=_send_results, args=(localq, results))
+    sender.start()
+    objects = _receive_objects(inq)
+    if engine == "async":
+        asyncscanner.scan_objects(
+            objects, concurrency, localq, _async_scan_item,
+        )
+    else:
+        pipeline.scan_objects(objects, threads, localq, _scan_item)
+    localq.put(STOP)
+    sender.join()
+    config.finish_scanning()
+    results.put(metrics.snapshot())
+    results.put(STOP)
@@ -0,0 +1,173 @@
+"""
+Persistent state of scanned domains.
+
+Most CDS and DNSKEY sets do not change between runs. For every domain
+that went through the expensive validation, the store keeps hashes of
+the inputs together with the verdict, so the validation can be skipped
+next time if nothing has changed.
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from .log import logger
+from .stats import Event
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    domain TEXT PRIMARY KEY,
+    cds_hash BLOB NOT NULL,
+    dnskey_hash BLOB NOT NULL,
+    rrsig_hash BLOB NOT NULL,
+    ds_hash BLOB NOT NULL,
+    last_modified TEXT NOT NULL,
+    expires INTEGER NOT NULL,
+    valid_from INTEGER NOT NULL,
+    verdict TEXT NOT NULL,
+    updated INTEGER NOT NULL
+)
+"""
+
+# Seconds a write waits for a write of another process to finish
+BUSY_TIMEOUT = 60
+
+_store = None
+
+
+class DomainState(namedtuple("DomainState", [
+    "cds_hash", "dnskey_hash", "rrsig_hash", "ds_hash",
+    "last_modified", "expires", "valid_from",
+])):
+    """Fingerprint of everything the validation of a domain depends on"""
+
+    @classmethod
+    def from_rrsets(
+        cls, ds_rdataset, last_modified,
+        cds, dnskeyset, cds_rrsigs, dnskey_rrsigs,
+    ):
+        rrsigs = [s for s in (cds_rrsigs, dnskey_rrsigs) if s is not None]
+        # Signatures are only valid until they expire
+        expires = min(
+            (sig.expiration for rrsig in rrsigs for sig in rrsig),
+            default=0,
+        )
+        # and from their latest inception
+        valid_from = max(
+            (sig.inception for rrsig in rrsigs for sig in rrsig),
+            default=0,
+        )
+        ds_hash = hashlib.sha256()
+        for rdata in sorted(ds_rdataset):
+            ds_hash.update(rdata.encode("latin1") + b"\n")
+        return cls(
+            rrset_hash(cds),
+            rrset_hash(dnskeyset),
+            rrset_hash(cds_rrsigs) + rrset_hash(dnskey_rrsigs),
+            ds_hash.digest(),
+            last_modified or "",
+            expires,
+            valid_from,
+        )
+
+
+def rrset_hash(rrset):
+    """Return hash of canonical wire format of the RRset"""
+    h = hashlib.sha256()
+    if rrset is not None:
+        h.update(rrset.name.canonicalize().to_wire())
+        h.update(rrset.rdtype.to_bytes(2, "big"))
+        h.update(rrset.covers.to_bytes(2, "big"))
+        for rdata in sorted(rd.to_digestable(rrset.name) for rd in rrset):
+            h.update(len(rdata).to_bytes(2, "big") + rdata)
+    return h.digest()
+
+
+class StateStore:
+    """
+    SQLite database of validation verdicts, safe to share by threads.
+    Worker processes open their own stores of the same database, so every
+    verdict is committed right away instead of holding the write lock.
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+        )
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # Commits do not wait for the disk, a crash loses only cache
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(SCHEMA)
+            self._db.commit()
+
+    def lookup(self, domain, state):
+        """
+        Return the Event of the last validation if it was done
+        with the same state and its signatures are still valid.
+        Otherwise, return None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT cds_hash, dnskey_hash, rrsig_hash, ds_hash, "
+                "last_modified, expires, valid_from, verdict "
+                "FROM domains WHERE domain = ?", (domain, ),
+            ).fetchone()
+        if row is None:
+            return None
+        stored = DomainState(*row[:7])
+        if stored != state or state.expires <= time.time():
+            return None
+        try:
+            return Event[row[7]]
+        except KeyError:
+            return None
+
+    def store(self, domain, state, verdict):
+        """
+        Remember the verdict of validation of the domain state.
+        Failures are only logged, the domain is validated again next time.
+
+        Verdicts on signatures not valid yet, from a signer with its clock
+        ahead, are not remembered: they may fail only until the signatures
+        become valid.
+        """
+        if state.valid_from > time.time():
+            logger.debug("Not storing state of %s, not valid yet", domain)
+            return
+        with self._lock:
+            try:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO domains VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (domain, *state, verdict.name, int(time.time())),
+                    )
+            except sqlite3.Error as e:
+                logger.warning("Cannot store state of %s: %s", domain, e)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def setup_state_store(path):
+    """Open the state store used by all scanners"""
+    global _store
+    _store = StateStore(path)
+    logger.debug("Using state database %s", path)
+    return _store
+
+
+def get_state_store():
+    """Return the state store, or None if not configured"""
+    return _store
+
+
+def close_state_store():
+    global _store
+    if _store is not None:
+        _store.close()
+        _store = None
@@ -1,13 +1,34 @@
+"""
+Recording of events happening to domains during the scan.
 
+Every thread records into its own shard, so recording takes no lock.
+Shards are summed up only when reporting. A thread scanning domains
+folds its shard into the shard of finished threads when it exits, see
+release_shard(), so that threads started for every batch do not leave
+a shard each behind. Domain names are stored only
+when needed, optionally in a compact encoding.
+"""
+import contextlib
+import contextvars
+import io
+import json
+import threading
 from enum import Enum, auto
-from collections import defaultdict
-try:
-    from queue import SimpleQueue
-except ImportError:  # Python 3.6 lacks SimpleQueue
-    from queue import Queue as SimpleQueue
 
-_RECORDS = defaultdict(list)
-_rq = SimpleQueue()
+from . import metrics
+
+# Storage of domain names of every event in new shards, see setup_stats()
+_storage = None
+
+# Shards of all threads, in the order of creation. The shard of finished
+# threads takes the place of the first one finished, see release_shard()
+_shards = []
+_finished = None
+_shards_lock = threading.Lock()
+_local = threading.local()
+
+# List collecting events instead of recording them, see capture()
+_captured = contextvars.ContextVar("captured", default=None)
 
 
 class Event(Enum):
@@ -15,6 +36,7 @@ class Event(Enum):
     DNS_BOGUS = auto()
     DNS_LAME = auto()
     DNS_TIMEOUT = auto()
+    DNS_INCONSISTENT = auto()
     HAVE_CDS = auto()
     NO_CDS = auto()
     OLD_SIG = auto()
@@ -23,30 +45,196 @@ class Event(Enum):
     CDS_CONTINUITY_ERR = auto()
     CDS_UPDATE_PENDING = auto()
     CDS_NOOP = auto()
+    STATE_UNCHANGED = auto()
+    RETRY_RECOVERED = auto()
+
+
+class DomainList(list):
+    """Domain names of an event, stored as they are"""
+
+    add = list.append
+    merge = list.extend
+
+
+class CompactDomainList:
+    """
+    Domain names of an event, stored as newline separated bytes.
+    This takes a fraction of the memory of a list of strings.
+    """
+
+    __slots__ = ("data", )
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def add(self, domain):
+        self.data += domain.encode("latin1")
+        self.data += b"\n"
+
+    def merge(self, domains):
+        if isinstance(domains, CompactDomainList):
+            self.data += domains.data
+        else:
+            for domain in domains:
+                self.add(domain)
+
+    def __iter__(self):
+        for line in io.BytesIO(self.data):
+            yield line[:-1].decode("latin1")
+
+
+# Storage classes by name, None keeps only counts
+STORAGES = {
+    "list": DomainList,
+    "compact": CompactDomainList,
+    "none": None,
+}
+
+
+class _Shard:
+    __slots__ = ("counts", "domains")
+
+    def __init__(self, storage):
+        self.counts = dict.fromkeys(Event, 0)
+        if storage is None:
+            self.domains = None
+        else:
+            self.domains = {event: storage() for event in Event}
+
+    def merge(self, shard):
+        """Add events recorded in another shard"""
+        for event, n in shard.counts.items():
+            self.counts[event] += n
+        if shard.domains is None:
+            return
+        if self.domains is None:
+            self.domains = shard.domains
+            return
+        for event, domains in shard.domains.items():
+            self.domains[event].merge(domains)
+
+
+def setup_stats(storage="list"):
+    """
+    Select storage of domain names of events recorded from now on:
+    "list", "compact" or "none" to keep only counts.
+    """
+    global _storage
+    _storage = STORAGES[storage]
+
+
+setup_stats()
+
+
+def _get_shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        pass
+    shard = _local.shard = _Shard(_storage)
+    with _shards_lock:
+        _shards.append(shard)
+    return shard
+
+
+def release_shard():
+    """
+    Fold the shard of the current thread into the shard of finished
+    threads. Call before a thread recording events exits.
+    """
+    global _finished
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        return
+    del _local.shard
+    with _shards_lock:
+        if _finished is None:
+            _finished = _Shard(None)
+            _shards.insert(_shards.index(shard), _finished)
+        _finished.merge(shard)
+        _shards.remove(shard)
 
 
 def record(domain: str, event: Event):
     """Record an event during processing a domain name"""
-    _rq.put((domain, event, ))
+    captured = _captured.get()
+    if captured is not None:
+        captured.append((domain, event, ))
+        return
+    shard = _get_shard()
+    shard.counts[event] += 1
+    if shard.domains is not None:
+        shard.domains[event].add(domain)
 
 
-def _process_queue():
-    while not _rq.empty():
-        domain, event = _rq.get_nowait()
-        _RECORDS[event].append(domain)
+def record_all(events):
+    """Record a list of (domain, event) tuples"""
+    for domain, event in events:
+        record(domain, event)
+
+
+@contextlib.contextmanager
+def capture():
+    """
+    Collect events recorded within the block, in the current thread
+    or asyncio task, into a list instead of recording them.
+    """
+    events = []
+    token = _captured.set(events)
+    try:
+        yield events
+    finally:
+        _captured.reset(token)
+
+
+def count(event):
+    """Return number of times the event was recorded"""
+    with _shards_lock:
+        # Summed under the lock, not to count a shard being folded twice
+        return sum(shard.counts[event] for shard in _shards)
+
+
+def iter_domains(event):
+    """Yield domain names recorded with the event"""
+    with _shards_lock:
+        shards = list(_shards)
+    for shard in shards:
+        if shard.domains is not None:
+            yield from shard.domains[event]
 
 
 def report_counts():
-    """Return simple report of recorded events"""
-    _process_queue()
+    """Return simple report of recorded events and timing metrics"""
     output = []
     for name, event in Event.__members__.items():
-        count = len(_RECORDS[event])
-        output.append(f"{name:<20} {count}")
+        output.append(f"{name:<20} {count(event)}")
+    timings = metrics.report()
+    if timings:
+        output.append(timings)
     return "\n".join(output)
 
 
 def report_domains():
     """Return dictionary with all recorded events."""
-    _process_queue()
-    return dict(_RECORDS)
+    return {event: list(iter_domains(event)) for event in Event}
+
+
+def dump_domains(fh):
+    """
+    Write domains of all events to a file as JSON, formatted like
+    json.dump() with indent=4. Domains are written one at a time,
+    without building the whole document in memory.
+    """
+    fh.write("{")
+    separator = "\n"
+    for name, event in Event.__members__.items():
+        fh.write(f"{separator}    {json.dumps(name)}: [")
+        item_separator = "\n"
+        for domain in iter_domains(event):
+            fh.write(f"{item_separator}        {json.dumps(domain)}")
+            item_separator = ",\n"
+        if item_separator != "\n":
+            fh.write("\n    ")
+        fh.write("]")
+        separator = ",\n"
+    fh.write("\n}")
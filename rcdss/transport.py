@@ -0,0 +1,234 @@
+"""
+Shared DNS transport reusing sockets between queries.
+
+UDP sockets are kept in a pool and TCP queries are pipelined over one
+persistent connection per nameserver (RFC 7766), so truncated answers
+do not cost a new TCP handshake every time.
+"""
+import socket
+import struct
+import threading
+
+import dns.entropy
+import dns.exception
+import dns.inet
+import dns.message
+import dns.nameserver
+import dns.query
+
+from .log import logger
+
+
+class PooledNameserver(dns.nameserver.Do53Nameserver):
+    """
+    Do53 nameserver reusing its sockets.
+
+    Only the synchronous query() is pooled, the asyncio engine keeps
+    using the native dnspython transport.
+    """
+
+    def __init__(self, address, port=53):
+        super().__init__(address, port)
+        self._af = dns.inet.af_for_address(address)
+        self._lock = threading.Lock()
+        self._udp_sockets = []
+        self._tcp = None
+
+    def query(
+        self, request, timeout, source, source_port, max_size,
+        one_rr_per_rrset=False, ignore_trailing=False,
+    ):
+        if source is not None or source_port != 0:
+            return super().query(
+                request, timeout, source, source_port, max_size,
+                one_rr_per_rrset, ignore_trailing,
+            )
+        if max_size:
+            return self._query_tcp(
+                request, timeout, one_rr_per_rrset, ignore_trailing,
+            )
+        return self._query_udp(
+            request, timeout, one_rr_per_rrset, ignore_trailing,
+        )
+
+    def _query_udp(self, request, timeout, one_rr_per_rrset, ignore_trailing):
+        with self._lock:
+            if self._udp_sockets:
+                sock = self._udp_sockets.pop()
+            else:
+                sock = socket.socket(self._af, socket.SOCK_DGRAM)
+                sock.setblocking(False)
+        try:
+            response = dns.query.udp(
+                request,
+                self.address,
+                timeout=timeout,
+                port=self.port,
+                sock=sock,
+                raise_on_truncation=True,
+                one_rr_per_rrset=one_rr_per_rrset,
+                ignore_trailing=ignore_trailing,
+                ignore_errors=True,
+                ignore_unexpected=True,
+            )
+        except (dns.exception.Timeout, OSError):
+            # Late answers could still arrive to this socket
+            sock.close()
+            raise
+        except BaseException:
+            self._release_udp_socket(sock)
+            raise
+        self._release_udp_socket(sock)
+        return response
+
+    def _release_udp_socket(self, sock):
+        with self._lock:
+            self._udp_sockets.append(sock)
+
+    def _query_tcp(self, request, timeout, one_rr_per_rrset, ignore_trailing):
+        conn, fresh = self._tcp_connection(timeout)
+        try:
+            wire = conn.query(request, timeout)
+        except (EOFError, ConnectionError):
+            if fresh:
+                raise
+            # The server may have closed an idle connection,
+            # give it one more try over a new one.
+            logger.debug("Reconnecting TCP to %s", self.address)
+            conn, _ = self._tcp_connection(timeout)
+            wire = conn.query(request, timeout)
+        response = dns.message.from_wire(
+            wire,
+            keyring=request.keyring,
+            request_mac=request.mac,
+            one_rr_per_rrset=one_rr_per_rrset,
+            ignore_trailing=ignore_trailing,
+        )
+        if not request.is_response(response):
+            raise dns.query.BadResponse
+        return response
+
+    def _tcp_connection(self, timeout):
+        """Return the persistent connection and whether it is a new one"""
+        with self._lock:
+            if self._tcp is not None and not self._tcp.closed:
+                return self._tcp, False
+            self._tcp = PipelinedConnection(
+                self._af, self.address, self.port, timeout,
+            )
+            return self._tcp, True
+
+
+class _Waiter:
+    __slots__ = ("event", "wire", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.wire = None
+        self.error = None
+
+
+class PipelinedConnection:
+    """
+    TCP connection carrying many outstanding queries at once.
+    Answers can arrive in any order and are matched by message ID.
+    """
+
+    def __init__(self, af, address, port, timeout):
+        self.sock = socket.socket(af, socket.SOCK_STREAM)
+        try:
+            self.sock.settimeout(timeout)
+            self.sock.connect(dns.inet.low_level_address_tuple(
+                (address, port), af,
+            ))
+            self.sock.settimeout(None)
+        except socket.timeout:
+            self.sock.close()
+            raise dns.exception.Timeout
+        except OSError:
+            self.sock.close()
+            raise
+        self.closed = False
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._pending = {}
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def query(self, request, timeout):
+        """Send request and wait for the wire format answer"""
+        waiter = _Waiter()
+        with self._lock:
+            if self.closed:
+                raise EOFError("connection closed")
+            # IDs have to be unique among queries in flight
+            while request.id in self._pending:
+                request.id = dns.entropy.random_16()
+            self._pending[request.id] = waiter
+        wire = request.to_wire()
+        try:
+            with self._send_lock:
+                self.sock.sendall(struct.pack("!H", len(wire)) + wire)
+        except OSError as e:
+            self._close(e)
+            raise
+        if not waiter.event.wait(timeout):
+            with self._lock:
+                self._pending.pop(request.id, None)
+            raise dns.exception.Timeout(timeout=timeout)
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.wire
+
+    def _recv_exactly(self, count):
+        buf = b""
+        while len(buf) < count:
+            chunk = self.sock.recv(count - len(buf))
+            if not chunk:
+                raise EOFError("connection closed by peer")
+            buf += chunk
+        return buf
+
+    def _read_loop(self):
+        try:
+            while True:
+                (length,) = struct.unpack("!H", self._recv_exactly(2))
+                wire = self._recv_exactly(length)
+                if length < 2:
+                    continue
+                (msg_id,) = struct.unpack("!H", wire[:2])
+                with self._lock:
+                    waiter = self._pending.pop(msg_id, None)
+                if waiter is not None:
+                    waiter.wire = wire
+                    waiter.event.set()
+        except (EOFError, OSError) as e:
+            self._close(e)
+
+    def _close(self, error):
+        if not isinstance(error, EOFError):
+            error = EOFError(str(error))
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for waiter in pending:
+            waiter.error = error
+            waiter.event.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def pool_nameservers(resolver):
+    """Replace resolver's nameservers with pooled ones"""
+    nameservers = []
+    for ns in resolver.nameservers:
+        if isinstance(ns, str) and dns.inet.is_address(ns):
+            port = resolver.nameserver_ports.get(ns, resolver.port)
+            ns = PooledNameserver(ns, port)
+        nameservers.append(ns)
+    resolver.nameservers = nameservers
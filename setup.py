@@ -15,8 +15,8 @@ setup(
     author_email="ondrej.caletka@ripe.net",
     packages=["rcdss"],
     setup_requires=["pytest-runner"],
-    python_requires=">=3.6",
-    install_requires=["dnspython>=2.3.0", "cryptography", "click"],
+    python_requires=">=3.8",
+    install_requires=["dnspython>=2.4.0", "cryptography", "click"],
     tests_require=["pytest"],
     entry_points={
         "console_scripts": [
@@ -28,7 +28,11 @@ setup(
         "Environment :: Console",
         "Intended Audience :: System Administrators",
         "Operating System :: POSIX :: Linux",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Programming Language :: Python :: 3.12",
         "Programming Language :: Python :: 3 :: Only",
         "Topic :: System :: Systems Administration",
     ],
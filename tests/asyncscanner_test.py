@@ -0,0 +1,69 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import dns.rdatatype
+import pytest
+from conftest import SCENARIO_EVENTS
+
+from rcdss import asyncscanner, dsscanner
+from rcdss.stats import Event, capture
+
+
+def test_do_cds_scan(fake_zones):
+    for scenario, zone in fake_zones.items():
+        obj = zone.object()
+        with capture() as events:
+            result = asyncio.run(asyncscanner.do_cds_scan(obj))
+        domain = zone.name.to_text()
+        assert events == [
+            (domain, event) for event in SCENARIO_EVENTS[scenario]
+        ], scenario
+        if scenario == "update":
+            assert result["old-ds-rdata"] == zone.ds_rdata
+            assert result["ds-rdata"] == [
+                zone.rrsets[dns.rdatatype.CDS][0][0].to_text(),
+            ]
+        elif scenario == "delete":
+            assert result["old-ds-rdata"] == zone.ds_rdata
+            assert "ds-rdata" not in result
+        else:
+            assert result is None, scenario
+
+
+class ListQueue(list):
+    put = list.append
+
+
+def test_scan_objects(fake_zones):
+    objects = [zone.object() for zone in fake_zones.values()]
+    outq = ListQueue()
+    with capture() as events:
+        asyncscanner.scan_objects(objects, 3, outq)
+    assert sorted(o["domain"] for o in outq) == [
+        "delete.example", "update.example",
+    ]
+    recorded = [event for _, event in events]
+    for event in Event:
+        assert recorded.count(event) == sum(
+            expected.count(event) for expected in SCENARIO_EVENTS.values()
+        ), event
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_parallel_queries(fake_zones, monkeypatch, parallel):
+    executor = ThreadPoolExecutor(2)
+    if parallel:
+        monkeypatch.setattr(dsscanner, "_dnskey_executor", executor)
+        monkeypatch.setattr(asyncscanner, "_parallel_queries", True)
+    with executor:
+        for scenario, zone in fake_zones.items():
+            with capture() as sync_events:
+                sync_result = dsscanner.do_cds_scan(zone.object())
+            with capture() as async_events:
+                async_result = asyncio.run(
+                    asyncscanner.do_cds_scan(zone.object()),
+                )
+            assert sync_result == async_result, scenario
+            assert sync_events == async_events, scenario
+            assert [event for _, event in sync_events] == \
+                SCENARIO_EVENTS[scenario], scenario
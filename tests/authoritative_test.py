@@ -0,0 +1,112 @@
+import threading
+import time
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rrset
+
+from rcdss import authoritative
+from rcdss.stats import Event
+
+
+def test_parse_nserver():
+    assert authoritative.parse_nserver("NS1.Example.net") == (
+        "ns1.example.net.", [],
+    )
+    assert authoritative.parse_nserver(
+        "ns1.2.0.192.in-addr.arpa. 192.0.2.1 2001:db8::1",
+    ) == ("ns1.2.0.192.in-addr.arpa.", ["192.0.2.1", "2001:db8::1"])
+
+
+class SlowResolver:
+    lookups = []
+
+    def __init__(self, *args):
+        pass
+
+    def resolve(self, host, rdtype, raise_on_no_answer=False):
+        self.lookups.append((host, rdtype))
+        time.sleep(0.05)
+        raise dns.exception.Timeout
+
+
+def test_ns_address_cache():
+    cache = authoritative.NSAddressCache(SlowResolver)
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(cache.lookup("ns.example.")),
+        ) for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [[]] * 5
+    # Concurrent lookups of the host wait for the first one
+    assert SlowResolver.lookups == [
+        ("ns.example.", "AAAA"), ("ns.example.", "A"),
+    ]
+    assert (cache.hits, cache.misses) == (4, 1)
+
+
+def make_response(domain, *cds):
+    query = dns.message.make_query(domain, "CDS", want_dnssec=True)
+    response = dns.message.make_response(query)
+    response.flags |= dns.flags.AA
+    if cds:
+        response.answer.append(dns.rrset.from_text_list(
+            domain, 3600, "IN", "CDS", cds,
+        ))
+    # Answers are looked up in an index built when parsing
+    return dns.message.from_wire(response.to_wire())
+
+
+def test_combine_answers():
+    resolver = authoritative.AuthoritativeResolver(1, None)
+    domain = "2.0.192.in-addr.arpa."
+    cds = "12345 13 2 " + "ab" * 32
+    answer, event = resolver._combine(domain, "CDS", [
+        ("192.0.2.1", make_response(domain, cds), None),
+        ("192.0.2.2", None, dns.exception.Timeout()),
+        ("192.0.2.3", make_response(domain, cds), None),
+    ])
+    assert event is None
+    assert answer.nameserver == "192.0.2.1"
+    assert answer.rrset[0].to_text() == cds
+
+    _, event = resolver._combine(domain, "CDS", [
+        ("192.0.2.1", make_response(domain, cds), None),
+        ("192.0.2.2", make_response(domain), None),
+    ])
+    assert event == Event.DNS_INCONSISTENT
+
+    _, event = resolver._combine(domain, "CDS", [
+        ("192.0.2.1", None, dns.exception.Timeout()),
+    ])
+    assert event == Event.DNS_TIMEOUT
+
+    lame = make_response(domain, cds)
+    lame.flags &= ~dns.flags.AA
+    _, event = resolver._combine(domain, "CDS", [
+        ("192.0.2.1", lame, None),
+        ("192.0.2.2", None, dns.exception.Timeout()),
+    ])
+    assert event == Event.DNS_LAME
+
+    # Authoritative NXDOMAIN is no lameness, it fails like in resolver mode
+    nxdomain = make_response(domain)
+    nxdomain.set_rcode(dns.rcode.NXDOMAIN)
+    answer, event = resolver._combine(domain, "CDS", [
+        ("192.0.2.1", nxdomain, None),
+        ("192.0.2.2", None, dns.exception.Timeout()),
+    ])
+    assert (answer, event) == (None, None)
+    _, event = resolver._combine(domain, "CDS", [
+        ("192.0.2.1", nxdomain, None),
+        ("192.0.2.2", make_response(domain, cds), None),
+    ])
+    assert event == Event.DNS_INCONSISTENT
+    resolver.executor.shutdown()
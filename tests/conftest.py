@@ -0,0 +1,163 @@
+import time
+
+import dns.asyncresolver
+import dns.dnssec
+import dns.message
+import dns.name
+import dns.rdata
+import dns.rdataclass
+import dns.rdatatype
+import dns.resolver
+import dns.rrset
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from rcdss import asyncscanner, dsscanner
+from rcdss.stats import Event
+
+# Events recorded by a scan of a domain of each scenario
+SCENARIO_EVENTS = {
+    "nocds": [Event.NO_CDS],
+    "noop": [Event.HAVE_CDS, Event.CDS_NOOP],
+    "update": [Event.HAVE_CDS, Event.CDS_UPDATE_PENDING],
+    "delete": [Event.HAVE_CDS, Event.CDS_DELETE],
+    "nxdomain": [Event.DNS_FAILURE],
+    "timeout": [Event.DNS_TIMEOUT, Event.DNS_FAILURE],
+    "dnskey-timeout": [Event.DNS_TIMEOUT, Event.DNS_FAILURE],
+    # The DNSKEY query must not count when the CDS query fails
+    "timeout-both": [Event.DNS_TIMEOUT, Event.DNS_FAILURE],
+    "nocds-dnskey-timeout": [Event.NO_CDS],
+}
+
+# Query types timing out in each scenario
+SCENARIO_TIMEOUTS = {
+    "timeout": {dns.rdatatype.CDS},
+    "dnskey-timeout": {dns.rdatatype.DNSKEY},
+    "timeout-both": {dns.rdatatype.CDS, dns.rdatatype.DNSKEY},
+    "nocds-dnskey-timeout": {dns.rdatatype.DNSKEY},
+}
+
+
+def generate_key():
+    private_key = ec.generate_private_key(ec.SECP256R1())
+    dnskey = dns.dnssec.make_dnskey(
+        private_key.public_key(), dns.dnssec.Algorithm.ECDSAP256SHA256,
+        flags=257,
+    )
+    return private_key, dnskey
+
+
+def sign(rrset, keys):
+    now = int(time.time())
+    rrsigs = dns.rrset.RRset(
+        rrset.name, dns.rdataclass.IN, dns.rdatatype.RRSIG, rrset.rdtype,
+    )
+    for private_key, dnskey in keys:
+        rrsigs.add(dns.dnssec.sign(
+            rrset, private_key, rrset.name, dnskey,
+            inception=now - 3600, expiration=now + 86400,
+        ), ttl=3600)
+    return rrsigs
+
+
+def make_cds(name, dnskey):
+    ds = dns.dnssec.make_ds(name, dnskey, "SHA256")
+    return dns.rdata.from_text(
+        dns.rdataclass.IN, dns.rdatatype.CDS, ds.to_text(),
+    )
+
+
+class FakeZone:
+    """
+    Signed zone answering CDS and DNSKEY queries of a fake resolver
+    according to its scenario, one of SCENARIO_EVENTS. Queries of types
+    in SCENARIO_TIMEOUTS of the scenario time out.
+    """
+
+    def __init__(self, name, scenario):
+        self.name = dns.name.from_text(name)
+        self.scenario = scenario
+        ksk = generate_key()
+        new_ksk = generate_key()
+        self.ds_rdata = [
+            dns.dnssec.make_ds(self.name, ksk[1], "SHA256").to_text(),
+        ]
+        keys = [ksk, new_ksk] if scenario == "update" else [ksk]
+        dnskeys = dns.rrset.RRset(
+            self.name, dns.rdataclass.IN, dns.rdatatype.DNSKEY,
+        )
+        for _, dnskey in keys:
+            dnskeys.add(dnskey, ttl=3600)
+        self.rrsets = {dns.rdatatype.DNSKEY: (dnskeys, sign(dnskeys, keys))}
+        if scenario.startswith("nocds"):
+            return
+        cds = dns.rrset.RRset(self.name, dns.rdataclass.IN, dns.rdatatype.CDS)
+        if scenario == "update":
+            cds.add(make_cds(self.name, new_ksk[1]), ttl=3600)
+        elif scenario == "delete":
+            cds.add(dns.rdata.from_text(
+                dns.rdataclass.IN, dns.rdatatype.CDS, "0 0 0 00",
+            ), ttl=3600)
+        else:
+            cds.add(make_cds(self.name, ksk[1]), ttl=3600)
+        self.rrsets[dns.rdatatype.CDS] = (cds, sign(cds, [ksk]))
+
+    def object(self):
+        return {
+            "domain": self.name.to_text(omit_final_dot=True),
+            "ds-rdata": list(self.ds_rdata),
+            "last-modified": "2020-01-01T00:00:00Z",
+        }
+
+    def resolve(self, rdtype):
+        rdtype = dns.rdatatype.RdataType.make(rdtype)
+        if self.scenario == "nxdomain":
+            raise dns.resolver.NXDOMAIN(qnames=[self.name])
+        if rdtype in SCENARIO_TIMEOUTS.get(self.scenario, ()):
+            raise dns.resolver.LifetimeTimeout(timeout=1.0, errors=[])
+        query = dns.message.make_query(self.name, rdtype, want_dnssec=True)
+        response = dns.message.make_response(query)
+        response.answer.extend(self.rrsets.get(rdtype, ()))
+        # Answers are looked up in an index built when parsing
+        response = dns.message.from_wire(response.to_wire())
+        return dns.resolver.Answer(
+            self.name, rdtype, dns.rdataclass.IN, response,
+        )
+
+
+class FakeResolver:
+    def __init__(self, zones):
+        self.zones = zones
+        self.nameservers = []
+        self.flags = 0
+        self.cache = None
+
+    def resolve(self, qname, rdtype, raise_on_no_answer=False):
+        return self.zones[dns.name.from_text(qname)].resolve(rdtype)
+
+
+class FakeAsyncResolver(FakeResolver):
+    async def resolve(self, qname, rdtype, raise_on_no_answer=False):
+        return super().resolve(qname, rdtype, raise_on_no_answer)
+
+
+@pytest.fixture
+def fake_zones(monkeypatch):
+    """
+    Return zones of all scenarios by scenario name. Queries of both
+    scanning engines are answered from them by fake resolvers.
+    """
+    zones = {
+        scenario: FakeZone(f"{scenario}.example.", scenario)
+        for scenario in SCENARIO_EVENTS
+    }
+    by_name = {zone.name: zone for zone in zones.values()}
+
+    def make_resolver(resolver_class=dns.resolver.Resolver):
+        if resolver_class is dns.asyncresolver.Resolver:
+            return FakeAsyncResolver(by_name)
+        return FakeResolver(by_name)
+
+    monkeypatch.setattr(dsscanner, "make_resolver", make_resolver)
+    monkeypatch.setattr(asyncscanner, "make_resolver", make_resolver)
+    return zones
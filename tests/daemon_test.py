@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+
+import dns.message
+import dns.resolver
+import dns.rrset
+import pytest
+
+from rcdss import daemon
+
+
+def make_answer(ttl, expiration, inception):
+    domain = "2.0.192.in-addr.arpa."
+    query = dns.message.make_query(domain, "CDS", want_dnssec=True)
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text(
+        domain, ttl, "IN", "CDS", "12345 13 2 " + "ab" * 32,
+    ))
+    response.answer.append(dns.rrset.from_text(
+        domain, ttl, "IN", "RRSIG",
+        f"CDS 13 5 {ttl} {expiration} {inception} 12345 {domain} "
+        "dGVzdA==",
+    ))
+    response = dns.message.from_wire(response.to_wire())
+    question = response.question[0]
+    return dns.resolver.Answer(
+        question.name, question.rdtype, question.rdclass, response,
+    )
+
+
+def test_next_check():
+    now = int(time.time())
+    # Answers expire first
+    answer = make_answer(3600, now + 86400, now - 86400)
+    assert abs(daemon.next_check([answer], now) - (now + 3600)) < 5
+    # Signature expires first
+    answer = make_answer(3600, now + 1000, now - 86400)
+    assert daemon.next_check([answer], now) == now + 1000
+    # Signature becomes valid
+    answer = make_answer(3600, now + 86400, now + 600)
+    assert daemon.next_check([answer], now) == now + 600
+    # Bounds
+    answer = make_answer(10, now + 86400, now - 86400)
+    assert daemon.next_check([answer], now) == now + daemon.MIN_INTERVAL
+    assert daemon.next_check([answer, None], now) == (
+        now + daemon.RETRY_INTERVAL
+    )
+
+
+def test_scheduler():
+    scheduler = daemon.Scheduler()
+    objects = [
+        {"domain": "a.example", "ds-rdata": ["1"]},
+        {"domain": "b.example", "ds-rdata": ["2"]},
+    ]
+    assert scheduler.update(objects, 100) == set()
+    assert scheduler.pop_due(99) == []
+    assert scheduler.pop_due(100) == objects
+    assert scheduler.next_due() is None
+    scheduler.reschedule("a.example.", 300)
+    scheduler.reschedule("b.example.", 200)
+    # A sooner check wins
+    scheduler.reschedule("a.example.", 150)
+    scheduler.reschedule("a.example.", 400)
+    assert scheduler.next_due() == 150
+    assert scheduler.pop_due(150) == objects[:1]
+
+    # Modified domain is due now, removed one is dropped
+    modified = {"domain": "a.example", "ds-rdata": ["3"]}
+    assert scheduler.update([modified], 160) == {"a.example."}
+    assert len(scheduler) == 1
+    assert scheduler.pop_due(1000) == [modified]
+    scheduler.reschedule("b.example.", 170)
+    assert scheduler.next_due() is None
+
+
+class ListQueue(list):
+    put = list.append
+
+
+def test_change_filter():
+    changes = daemon.ChangeFilter(ListQueue())
+    change = {"domain": "a.example", "ds-rdata": ["1"]}
+    changes.put(change)
+    changes.put(dict(change))
+    assert changes.queue == [change]
+    changes.forget(["a.example."])
+    changes.put(change)
+    assert len(changes.queue) == 2
+
+
+def test_rotating_output(tmp_path):
+    output = daemon.RotatingOutput(str(tmp_path), interval=0)
+    print("domain: a.example", file=output, flush=True)
+    print("domain: b.example", file=output, flush=True)
+    output.close()
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 2
+    assert all(f.endswith(".txt") for f in files)
+    assert (tmp_path / files[1]).read_text() == "domain: b.example\n"
+
+
+@pytest.mark.parametrize("engine", ["threads", "async"])
+def test_run_daemon(fake_zones, tmp_path, engine):
+    dump = tmp_path / "dump.db"
+    with open(dump, "w") as fh:
+        for zone in fake_zones.values():
+            obj = zone.object()
+            fh.write(f"domain: {obj['domain']}\n")
+            for rdata in obj["ds-rdata"]:
+                fh.write(f"ds-rdata: {rdata}\n")
+            fh.write(f"last-modified: {obj['last-modified']}\n\n")
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    stop = threading.Event()
+    threads = threading.active_count()
+    runner = threading.Thread(target=daemon.run_daemon, kwargs=dict(
+        paths=[str(dump)], output_dir=str(output_dir), engine=engine,
+        threads=4, concurrency=4, rotate_interval=0, stop=stop,
+    ))
+    runner.start()
+    deadline = time.monotonic() + 10
+    while len(os.listdir(output_dir)) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    stop.set()
+    runner.join(10)
+    assert not runner.is_alive()
+    # The scanners are gone with the daemon
+    assert threading.active_count() == threads
+    output = "".join(
+        (output_dir / name).read_text() for name in os.listdir(output_dir)
+    )
+    assert output.count("domain:") == 2
+    assert "update.example" in output and "delete.example" in output
@@ -93,3 +93,60 @@ def test_filter_dnskey_set():
     filtered = dsscanner.filter_dnskey_set(keyset, dsset)
     assert dskey_example_com_dnskey in filtered
     assert example_com_dnskey not in filtered
+    index = dsscanner.DNSKEYIndex(keyset)
+    assert index.by_key_tag[60485] == [dskey_example_com_dnskey]
+    assert filtered == dsscanner.filter_dnskey_set(keyset, dsset, index)
+    # Digests are memoized in the index
+    ds = index.make_ds(dskey_example_com_dnskey, 1)
+    assert ds == dskey_example_com_ds
+    assert index.make_ds(dskey_example_com_dnskey, 1) is ds
+
+
+def test_answer_from_wire():
+    query = dns.message.make_query("example.", "CDS")
+    response = dns.message.make_response(query)
+    response.answer.append(dns.rrset.from_text(
+        "example.", 3600, "IN", "CDS", "0 0 0 00",
+    ))
+    cds = dsscanner._answer_from_wire(response.to_wire())
+    assert cds.name == dns.name.from_text("example.")
+    assert dsscanner.is_delete_cds(cds)
+
+
+def test_answer_cache(monkeypatch):
+    monkeypatch.setattr(dsscanner, "_answer_cache", None)
+    assert dsscanner.make_resolver().cache is None
+    dsscanner.setup_answer_cache(10)
+    cache = dsscanner._answer_cache
+    assert dsscanner.make_resolver().cache is cache
+    key = (dns.name.from_text("example."), dns.rdatatype.CDS, 1)
+    assert cache.get(key) is None
+    before = dsscanner.CACHE_REQUESTS.snapshot()
+    dsscanner.close_answer_cache()
+    after = dsscanner.CACHE_REQUESTS.snapshot()
+    assert dsscanner.make_resolver().cache is None
+    miss = ("answer", "miss")
+    assert after[miss] == before.get(miss, 0) + 1
+
+
+def test_prepare_validation_formatting():
+    domain = "2.0.192.in-addr.arpa."
+    digest = "ab" * 32
+    cds = dns.rrset.from_text(
+        domain, 3600, "IN", "CDS", f"12345 13 2 {digest}",
+    )
+    # Digest split by a continuation line and extra spaces
+    obj = {"ds-rdata": [f"12345  13 2 {digest[:20].upper()} {digest[20:]}"]}
+    assert dsscanner.prepare_validation(obj, domain, cds, None) is None
+    obj = {"ds-rdata": [f"12345 13 2 {'cd' * 32}"]}
+    pending = dsscanner.prepare_validation(obj, domain, cds, None)
+    assert pending.cds_rdataset == {f"12345 13 2 {digest}"}
+    # The parsed DS set is passed on to the validation
+    assert {ds.to_text() for ds in pending.dsset} == {
+        f"12345 13 2 {'cd' * 32}",
+    }
+    # Unparseable ds-rdata is compared as text
+    obj = {"ds-rdata": ["12345 13 2 not-hex"]}
+    pending = dsscanner.prepare_validation(obj, domain, cds, None)
+    assert pending is not None
+    assert pending.dsset is None
@@ -0,0 +1,54 @@
+import io
+import json
+
+from rcdss import dsscanner, pipeline
+from rcdss.history import History
+
+
+def test_history_order():
+    stats = {
+        "DNS_TIMEOUT": ["slow.example."],
+        "DNS_LAME": [],
+        "HAVE_CDS": ["cds.example."],
+    }
+    history = History.load(io.StringIO(json.dumps(stats)))
+    objects = [
+        {"domain": "other.example"},
+        {"domain": "slow.example"},
+        {"domain": "cds.example"},
+    ]
+    order = [o["domain"] for o in history.order(objects)]
+    assert order == ["cds.example", "other.example", "slow.example"]
+    slow = []
+    order = [o["domain"] for o in history.order(objects, slow.append)]
+    assert order == ["cds.example", "other.example"]
+    assert slow == [{"domain": "slow.example"}]
+    # Only so many other objects are held back
+    objects = [{"domain": f"other{i}.example"} for i in range(3)]
+    objects.append({"domain": "cds.example"})
+    order = [o["domain"] for o in history.order(objects, hold_back=1)]
+    assert order == [
+        "other0.example", "other1.example", "cds.example", "other2.example",
+    ]
+
+
+def test_slow_lane(monkeypatch):
+    lifetimes = {}
+
+    def scan(obj):
+        lifetimes[obj["domain"]] = dsscanner.make_resolver().lifetime
+        return obj
+
+    monkeypatch.setattr(pipeline, "do_cds_scan", scan)
+    slow_lane = pipeline.SlowLane(2, 0.5)
+    history = History(slow=["slow.example."])
+    objects = [{"domain": "slow.example"}, {"domain": "fast.example"}]
+    output = io.StringIO()
+    with pipeline.Writer(output) as outq:
+        pipeline.run_engine(
+            history.order(objects, slow_lane.put), outq, threads=2,
+            slow_lane=slow_lane,
+        )
+    assert lifetimes["slow.example"] == 0.5
+    assert lifetimes["fast.example"] != 0.5
+    assert output.getvalue().count("domain:") == 2
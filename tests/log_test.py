@@ -0,0 +1,28 @@
+import json
+import logging
+
+from rcdss import log
+
+
+def test_json_log(tmp_path):
+    path = tmp_path / "rcdss.log"
+    log.setup_logger(str(path), 1, "json")
+    try:
+        log.logger.debug("Not written %s", object())
+        log.logger.info("Processing domain: %s", "a.example")
+        try:
+            raise ValueError("bad")
+        except ValueError:
+            log.logger.exception("Failed %d", 1)
+        log.close_logger()
+        records = [json.loads(line) for line in path.read_text().splitlines()]
+    finally:
+        for handler in list(log.logger.handlers):
+            log.logger.removeHandler(handler)
+            handler.close()
+        log.logger.setLevel(logging.NOTSET)
+    assert [(r["level"], r["message"]) for r in records] == [
+        ("INFO", "Processing domain: a.example"),
+        ("ERROR", "Failed 1"),
+    ]
+    assert "ValueError: bad" in records[1]["exception"]
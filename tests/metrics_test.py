@@ -0,0 +1,58 @@
+import io
+
+from rcdss import metrics
+
+
+def test_histogram(monkeypatch):
+    monkeypatch.setattr(metrics, "_METRICS", {})
+    h = metrics.Histogram(
+        "rcdss_test_seconds", "Test", ("kind",), buckets=(0.1, 1.0),
+    )
+    h.observe(0.05, "a")
+    h.observe(0.5, "a")
+    h.observe(5, "b")
+    with metrics.timed(h, "b"):
+        pass
+    snapshot = metrics.snapshot(reset=True)
+    assert snapshot["rcdss_test_seconds"][("a",)] == ([1, 1, 0], 0.55)
+    assert h.snapshot() == {}
+    metrics.merge(snapshot)
+    metrics.merge(snapshot)
+    counts, total = h.snapshot()[("b",)]
+    assert counts == [2, 0, 2]
+    assert h.quantile(counts, 0.5) == 0.1
+    assert h.quantile(counts, 0.99) == float("inf")
+
+    out = io.StringIO()
+    metrics.write_prometheus(out)
+    lines = out.getvalue().splitlines()
+    assert lines[:2] == [
+        "# HELP rcdss_test_seconds Test",
+        "# TYPE rcdss_test_seconds histogram",
+    ]
+    assert 'rcdss_test_seconds_bucket{kind="a",le="1.0"} 4' in lines
+    assert 'rcdss_test_seconds_bucket{kind="a",le="+Inf"} 4' in lines
+    assert 'rcdss_test_seconds_count{kind="b"} 4' in lines
+    assert "test_seconds a" in metrics.report()
+
+
+def test_counter(monkeypatch):
+    monkeypatch.setattr(metrics, "_METRICS", {})
+    c = metrics.Counter("rcdss_test_total", "Test", ("result",))
+    c.add(3, "hit")
+    c.add(1, "miss")
+    snapshot = metrics.snapshot(reset=True)
+    assert c.snapshot() == {}
+    metrics.merge(snapshot)
+    metrics.merge(snapshot)
+    assert c.snapshot() == {("hit",): 6, ("miss",): 2}
+
+    out = io.StringIO()
+    metrics.write_prometheus(out)
+    assert out.getvalue().splitlines() == [
+        "# HELP rcdss_test_total Test",
+        "# TYPE rcdss_test_total counter",
+        'rcdss_test_total{result="hit"} 6',
+        'rcdss_test_total{result="miss"} 2',
+    ]
+    assert "test_total hit" in metrics.report()
@@ -0,0 +1,70 @@
+import io
+import os
+import stat
+import threading
+from concurrent.futures import Future
+
+from rcdss import pipeline
+
+
+def fake_scan(obj):
+    if obj["domain"] == "broken":
+        raise RuntimeError("scanner failure")
+    if obj["domain"].startswith("changed"):
+        return obj
+    return None
+
+
+def test_scan_objects(monkeypatch):
+    monkeypatch.setattr(pipeline, "do_cds_scan", fake_scan)
+    objects = [{"domain": "changed1"}, {"domain": "broken"}] + [
+        {"domain": f"same{i}"} for i in range(100)
+    ] + [{"domain": "changed2"}]
+    output = io.StringIO()
+    with pipeline.Writer(output, maxsize=1) as outq:
+        pipeline.scan_objects(iter(objects), 3, outq)
+    written = output.getvalue()
+    assert written.count("domain:") == 2
+    assert "changed1" in written
+    assert "changed2" in written
+
+
+def test_scan_objects_futures(monkeypatch):
+    def deferred_scan(obj):
+        future = Future()
+        future.set_result(fake_scan(obj))
+        return future
+
+    monkeypatch.setattr(pipeline, "do_cds_scan", deferred_scan)
+    objects = [{"domain": "changed1"}, {"domain": "same"}]
+    output = io.StringIO()
+    with pipeline.Writer(output) as outq:
+        pipeline.scan_objects(iter(objects), 2, outq)
+    assert output.getvalue().count("domain:") == 1
+
+
+def test_atomic_output(tmp_path):
+    path = tmp_path / "out.txt"
+    path.write_text("previous\n")
+    try:
+        with pipeline.atomic_output(str(path)) as fh:
+            fh.write("partial\n")
+            raise RuntimeError("reader failed")
+    except RuntimeError:
+        pass
+    assert path.read_text() == "previous\n"
+    with pipeline.atomic_output(str(path)) as fh:
+        fh.write("complete\n")
+    assert path.read_text() == "complete\n"
+    assert [p.name for p in tmp_path.iterdir()] == ["out.txt"]
+    # A pipe is written directly, not replaced by a file
+    fifo = tmp_path / "fifo"
+    os.mkfifo(fifo)
+    read = []
+    reader = threading.Thread(target=lambda: read.append(fifo.read_text()))
+    reader.start()
+    with pipeline.atomic_output(str(fifo)) as fh:
+        fh.write("piped\n")
+    reader.join()
+    assert read == ["piped\n"]
+    assert stat.S_ISFIFO(os.stat(fifo).st_mode)
@@ -0,0 +1,135 @@
+import asyncio
+import threading
+
+import dns.exception
+import dns.flags
+import dns.message
+import dns.nameserver
+import dns.resolver
+import dns.rrset
+import pytest
+
+from rcdss import ratelimit
+
+
+def test_aimd_limiter(monkeypatch):
+    limiter = ratelimit.AIMDLimiter(maximum=20, initial=2)
+    assert limiter.try_acquire()
+    assert limiter.try_acquire()
+    assert not limiter.try_acquire()
+    limiter.release(rtt=0.01)
+    limiter.release(rtt=0.01)
+    assert limiter.limit == 4
+
+    # Occasional failures do not decrease the limit
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release(timeout=True)
+    assert limiter.limit == 4
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release(servfail=True)
+    assert limiter.limit == 2
+    assert limiter.timeouts == 3
+    assert limiter.servfails == 10
+
+    # Additive increase after the first decrease
+    limiter.error_rate = 0
+    for _ in range(2):
+        limiter.acquire()
+        limiter.release(rtt=0.01)
+    assert 2 < limiter.limit < 3
+
+
+def test_aimd_limiter_async():
+    limiter = ratelimit.AIMDLimiter(maximum=1, initial=1)
+    limiter.acquire()
+
+    async def waiting():
+        await limiter.acquire_async()
+        return limiter.inflight
+
+    async def run():
+        task = asyncio.ensure_future(waiting())
+        await asyncio.sleep(0.01)
+        assert not task.done()
+        threading.Thread(target=limiter.release, args=(0.01,)).start()
+        return await asyncio.wait_for(task, 1)
+
+    assert asyncio.run(run()) == 1
+    assert not asyncio.run(limiter.acquire_async(timeout=0.01))
+
+
+def test_token_bucket():
+    bucket = ratelimit.TokenBucket(100, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    delays = [bucket.reserve() for _ in range(3)]
+    assert 0 < delays[0] < delays[1] < delays[2] <= 0.03
+
+
+class Nameserver(dns.nameserver.Nameserver):
+    """Nameserver answering over TCP only, UDP answers are truncated"""
+
+    def __str__(self):
+        return "stub"
+
+    def kind(self):
+        return "Stub"
+
+    def is_always_max_size(self):
+        return False
+
+    def answer_nameserver(self):
+        return "192.0.2.1"
+
+    def answer_port(self):
+        return 53
+
+    def query(
+        self, request, timeout, source, source_port, max_size,
+        one_rr_per_rrset=False, ignore_trailing=False,
+    ):
+        response = dns.message.make_response(request)
+        if not max_size:
+            response.flags |= dns.flags.TC
+            raise dns.message.Truncated(message=response)
+        response.answer.append(dns.rrset.from_text(
+            request.question[0].name, 60, "IN", "A", "192.0.2.2",
+        ))
+        return dns.message.from_wire(response.to_wire())
+
+
+def test_saturated_limiter():
+    limiter = ratelimit.AIMDLimiter(maximum=1, initial=1)
+    ns = ratelimit.ThrottledNameserver(Nameserver(), limiter)
+    resolver = dns.resolver.Resolver(configure=False)
+    resolver.nameservers = [ns]
+    resolver.lifetime = resolver.timeout = 0.3
+
+    # Another query holds the only slot longer than the lifetime
+    limiter.acquire()
+    threading.Timer(0.5, limiter.release, (0.01, )).start()
+    with ratelimit.admission(resolver):
+        answer = resolver.resolve("example.", "A")
+    assert answer.rrset is not None
+    assert limiter.inflight == 0
+
+    # Waiting for a slot only times out the exchange, it is no failure
+    # of the resolver
+    limiter.acquire()
+    request = dns.message.make_query("example.", "A")
+    with pytest.raises(dns.exception.Timeout):
+        ns.query(request, 0.05, None, 0, True)
+    assert limiter.inflight == 1
+    assert limiter.timeouts == 0
+
+
+def test_throttle_nameservers():
+    resolver = dns.resolver.Resolver(configure=False)
+    resolver.nameservers = ["192.0.2.1"]
+    ratelimit.throttle_nameservers(resolver)
+    assert not resolver.nameservers[0].health.alternatives
+    resolver.nameservers = ["192.0.2.1", "192.0.2.2"]
+    ratelimit.throttle_nameservers(resolver)
+    assert all(ns.health.alternatives for ns in resolver.nameservers)
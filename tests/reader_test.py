@@ -0,0 +1,32 @@
+import gzip
+
+from rcdss import reader
+
+
+def make_dump(domains):
+    return "".join(
+        f"domain:         {d}\n"
+        "ds-rdata:       39498 13 2 9FA8FB7A\n"
+        "last-modified:  2020-11-10T21:03:20Z\n"
+        "\n"
+        f"domain:         unsigned.{d}\n"
+        "\n"
+        for d in domains
+    )
+
+
+def test_read_dumps(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"dump{i}.gz"
+        with gzip.open(path, "wt", encoding="latin1") as fh:
+            fh.write(make_dump(f"{j}.{i}.in-addr.arpa" for j in range(300)))
+        paths.append(str(path))
+
+    inline = list(reader.read_dumps(paths))
+    assert len(inline) == 900
+    for fast in (False, True):
+        objs = list(reader.read_dumps(paths, fast=fast, processes=True))
+        assert sorted(o["domain"] for o in objs) == sorted(
+            o["domain"] for o in inline
+        )
@@ -0,0 +1,35 @@
+import io
+
+from rcdss import pipeline, stats
+from rcdss.retry import RetryQueue
+from rcdss.stats import Event
+
+
+def test_retry_queue(monkeypatch):
+    attempts = {}
+
+    def flaky_scan(obj):
+        domain = obj["domain"]
+        attempts[domain] = attempts.get(domain, 0) + 1
+        if domain.startswith("dead") or attempts[domain] < 2:
+            stats.record(domain, Event.DNS_TIMEOUT)
+            return None
+        stats.record(domain, Event.NO_CDS)
+        return obj
+
+    monkeypatch.setattr(pipeline, "do_cds_scan", flaky_scan)
+    before = stats.report_domains()
+    recovered = len(before.get(Event.RETRY_RECOVERED, []))
+    timeouts = len(before.get(Event.DNS_TIMEOUT, []))
+    objects = [{"domain": "flaky.example."}, {"domain": "dead.example."}]
+    output = io.StringIO()
+    with pipeline.Writer(output) as outq:
+        pipeline.run_engine(
+            iter(objects), outq, threads=2, retries=RetryQueue(3, 0),
+        )
+    assert attempts == {"flaky.example.": 2, "dead.example.": 3}
+    assert output.getvalue().count("domain:") == 1
+    after = stats.report_domains()
+    assert after[Event.RETRY_RECOVERED][recovered:] == ["flaky.example."]
+    # Only the last attempt is recorded
+    assert after[Event.DNS_TIMEOUT][timeouts:] == ["dead.example."]
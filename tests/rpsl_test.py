@@ -1,3 +1,7 @@
+import io
+import json
+import pickle
+
 from rcdss import rpsl
 
 testobject = """\
@@ -62,3 +66,85 @@ created:        2020-11-10T19:57:33Z
 last-modified:  2020-11-10T21:03:20Z
 """
     )
+
+
+testdump = "\n".join(
+    testobject + [
+        "", "% comment", "domain: 1.in-addr.arpa", "descr: no DNSSEC", "", "",
+    ] + testobject + ["", "#"],
+) + "\n"
+
+
+def test_parse_rpsl_objects_file():
+    objs = list(rpsl.parse_rpsl_objects(io.StringIO(testdump)))
+    assert len(objs) == 3
+    assert objs[0]["ds-rdata"] == [
+        "39498 13 2 9FA8FB7A9D59BEE03550"
+        "2284202A544D8A6590180ACD6849019"
+        "0121AB6EE3F0C",
+    ]
+
+
+def test_parse_ds_objects(tmp_path, monkeypatch):
+    expected = [
+        o for o in rpsl.parse_rpsl_objects(io.StringIO(testdump))
+        if "ds-rdata" in o
+    ]
+    assert len(expected) == 2
+    raw = testdump.encode("latin1")
+    assert list(rpsl.parse_ds_objects(io.BytesIO(raw))) == expected
+    # Objects spanning several chunks
+    monkeypatch.setattr(rpsl, "CHUNK_SIZE", 7)
+    assert list(rpsl.parse_ds_objects(io.BytesIO(raw))) == expected
+    # Memory-mapped file
+    path = tmp_path / "dump"
+    path.write_bytes(raw)
+    with open(path, "rb") as fh:
+        assert list(rpsl.parse_ds_objects(fh)) == expected
+
+
+def test_parse_ds_objects_error():
+    raw = "\n".join(
+        testobject + ["", "%ERROR:101: no entries found"] + testobject,
+    ).encode("latin1")
+    assert len(list(rpsl.parse_ds_objects(io.BytesIO(raw)))) == 1
+
+
+def test_domain_object():
+    o = next(rpsl.parse_rpsl_objects(testobject))
+    assert o["descr"] == ["CDS test"]
+    assert o["created"] == "2020-11-10T19:57:33Z"
+    assert "remarks" not in o
+    assert pickle.loads(pickle.dumps(o)) == o
+    copy = o.copy()
+    copy["old-ds-rdata"] = copy.pop("ds-rdata")
+    copy["ds-rdata"] = ["1 13 2 ABCD"]
+    copy["reason"] = "Updated by CDS record"
+    assert copy != o and "old-ds-rdata" not in o
+    assert rpsl.write_rpsl_object(copy) == rpsl.write_rpsl_object(
+        dict(copy),
+    )
+    assert rpsl.write_rpsl_object(copy).splitlines()[4:6] == [
+        "old-ds-rdata:   " + o["ds-rdata"][0],
+        "ds-rdata:       1 13 2 ABCD",
+    ]
+
+
+def test_write_json_object():
+    o = next(rpsl.parse_rpsl_objects(testobject))
+    ds = o["ds-rdata"]
+    o["old-ds-rdata"] = o.pop("ds-rdata")
+    o["reason"] = "DNSSEC delegation deleted by CDS record"
+    o["cds-inception"] = "2020-11-11T00:00:00Z"
+    assert "cds-inception" not in rpsl.write_rpsl_object(o)
+    assert "cds-inception" not in rpsl.write_rpsl_object(dict(o))
+    record = json.loads(rpsl.write_json_object(o))
+    assert record == {
+        "domain": "83.204.91.in-addr.arpa",
+        "action": "delete",
+        "old-ds-rdata": ds,
+        "ds-rdata": [],
+        "reason": "DNSSEC delegation deleted by CDS record",
+        "cds-inception": "2020-11-11T00:00:00Z",
+        "last-modified": "2020-11-10T21:03:20Z",
+    }
@@ -0,0 +1,63 @@
+import random
+
+from rcdss import selection
+
+
+class FakeNameserver:
+    def __init__(self, name, rtt=None):
+        self.health = selection.ResolverHealth(name)
+        if rtt is not None:
+            self.health.observe(rtt)
+
+    def __repr__(self):
+        return self.health.name
+
+
+def test_ejection():
+    health = selection.ResolverHealth("192.0.2.1")
+    for _ in range(selection.EJECT_MIN_QUERIES):
+        health.observe(0.01)
+    assert abs(health.rtt - 0.01) < 1e-9
+    while not health.is_ejected():
+        health.observe(failed=True)
+    assert health.ejections == 1
+    assert health.failures < selection.EJECT_MIN_QUERIES
+    assert health.error_rate == selection.EJECT_ERROR_RATE / 2
+    assert not health.is_ejected(health.ejected_until)
+
+    # The only resolver is never ejected
+    health = selection.ResolverHealth("192.0.2.1", alternatives=False)
+    for _ in range(selection.EJECT_MIN_QUERIES * 2):
+        health.observe(failed=True)
+    assert not health.is_ejected()
+    assert health.ejections == 0
+
+
+def test_order_nameservers(monkeypatch):
+    fast = FakeNameserver("fast", 0.01)
+    slow = FakeNameserver("slow", 0.1)
+    new = FakeNameserver("new")
+    nameservers = [slow, fast, new]
+    # The configured order is kept without rotation
+    assert selection.order_nameservers(nameservers) == nameservers
+    monkeypatch.setattr(selection, "_policy", "fastest")
+    assert selection.order_nameservers(nameservers, True) == [
+        new, fast, slow,
+    ]
+    # A resolver that only failed is not taken for an unmeasured one
+    dead = FakeNameserver("dead")
+    dead.health.observe(failed=True)
+    assert selection.order_nameservers([dead, slow, new], True) == [
+        new, slow, dead,
+    ]
+    new.health.ejected_until = float("inf")
+    assert selection.order_nameservers(nameservers) == [slow, fast, new]
+
+    monkeypatch.setattr(selection, "_policy", "weighted")
+    random.seed(0)
+    firsts = [
+        selection.order_nameservers([slow, fast], True)[0]
+        for _ in range(1000)
+    ]
+    # Ten times faster resolver gets ten times more queries
+    assert 850 < firsts.count(fast) < 960
@@ -0,0 +1,35 @@
+from rcdss import shard, stats
+from rcdss.stats import Event
+
+
+def test_shard_of():
+    objs = [{"domain": f"{i}.10.in-addr.arpa"} for i in range(100)]
+    shards = [shard.shard_of(o, 4) for o in objs]
+    assert set(shards) == {0, 1, 2, 3}
+    assert shards == [shard.shard_of(o, 4) for o in objs]
+
+
+def test_scan_objects(monkeypatch):
+    def scan(obj):
+        stats.record(obj["domain"], Event.STATE_UNCHANGED)
+        return obj if int(obj["domain"].split(".")[0]) % 2 else None
+
+    monkeypatch.setattr(shard, "do_cds_scan", scan)
+    monkeypatch.setattr(shard.config, "setup_scanning", lambda **kw: None)
+    monkeypatch.setattr(shard.config, "finish_scanning", lambda: None)
+    objs = [{"domain": f"{i}.10.in-addr.arpa"} for i in range(300)]
+    scanner = shard.ShardedScanner(3, {}, threads=4)
+    scanner.start()
+    out = []
+    scanner.scan_objects(objs, _List(out))
+    assert out == objs[1::2]
+    recorded = stats.report_domains()[Event.STATE_UNCHANGED]
+    assert recorded[-300:] == [o["domain"] for o in objs]
+
+
+class _List:
+    def __init__(self, items):
+        self.items = items
+
+    def put(self, item):
+        self.items.append(item)
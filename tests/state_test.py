@@ -0,0 +1,82 @@
+import time
+
+import dns.rrset
+
+from rcdss import state
+from rcdss.stats import Event
+
+CDS = dns.rrset.from_text(
+    "example.", 3600, "IN", "CDS",
+    "60485 5 1 2BB183AF5F22588179A53B0A98631FAD1A292118",
+)
+DNSKEY = dns.rrset.from_text(
+    "example.", 3600, "IN", "DNSKEY",
+    "256 3 5 AQOeiiR0GOMYkDshWoSKz9XzfwJr1AYtsmx3TGkJaNXVbfi/"
+    "2pHm822aJ5iI9BMzNXxeYCmZDRD99WYwYqUSdjMmmAphXdvxegXd/M5+X7Or"
+    "zKBaMbCVdFLUUh6DhweJBjEVv5f2wwjM9XzcnOf+EPbtG9DMBmADjFDc2w/r"
+    "ljwvFw==",
+)
+
+
+def make_rrsig(expiration, inception):
+    return dns.rrset.from_text(
+        "example.", 3600, "IN", "RRSIG",
+        f"CDS 5 1 3600 {expiration} {inception} 60485 example. "
+        "AQOeiiR0GOMYkDshWoSKz9Xz",
+    )
+
+
+def make_state(
+    ds="60485 5 1 abcd", expiration="21000101000000",
+    inception="20000101000000",
+):
+    rrsig = make_rrsig(expiration, inception)
+    return state.DomainState.from_rrsets(
+        {ds}, "2020-01-01T00:00:00Z", CDS, DNSKEY, rrsig, rrsig,
+    )
+
+
+def test_rrset_hash():
+    same = dns.rrset.from_text(
+        "EXAMPLE.", 60, "IN", "CDS",
+        "60485 5 1 2bb183af5f22588179a53b0a 98631fad1a292118",
+    )
+    assert state.rrset_hash(CDS) == state.rrset_hash(same)
+    assert state.rrset_hash(CDS) != state.rrset_hash(DNSKEY)
+
+
+def test_state_store(tmp_path):
+    store = state.StateStore(str(tmp_path / "state.db"))
+    assert store.lookup("example.", make_state()) is None
+    store.store("example.", make_state(), Event.CDS_UPDATE_PENDING)
+    assert store.lookup("example.", make_state()) == Event.CDS_UPDATE_PENDING
+    assert store.lookup("example.", make_state(ds="1 5 1 abcd")) is None
+    store.close()
+
+    # The verdict survives reopening, but not expiration of signatures
+    store = state.StateStore(str(tmp_path / "state.db"))
+    assert store.lookup("example.", make_state()) == Event.CDS_UPDATE_PENDING
+    expired = time.strftime("%Y%m%d%H%M%S", time.gmtime(time.time() - 60))
+    store.store("example.", make_state(expiration=expired), Event.OLD_SIG)
+    assert store.lookup("example.", make_state(expiration=expired)) is None
+    # Nor is a verdict on signatures not valid yet stored
+    future = time.strftime("%Y%m%d%H%M%S", time.gmtime(time.time() + 600))
+    store.store(
+        "example.", make_state(inception=future), Event.NOT_SIGNED_BY_KSK,
+    )
+    assert store.lookup("example.", make_state(inception=future)) is None
+    store.close()
+
+
+def test_state_store_processes(tmp_path):
+    # Stores of worker processes do not lock each other out
+    path = str(tmp_path / "state.db")
+    first = state.StateStore(path)
+    second = state.StateStore(path)
+    first.store("a.example.", make_state(), Event.CDS_UPDATE_PENDING)
+    start = time.monotonic()
+    second.store("b.example.", make_state(), Event.CDS_DELETE)
+    assert time.monotonic() - start < 1
+    assert first.lookup("b.example.", make_state()) == Event.CDS_DELETE
+    first.close()
+    second.close()
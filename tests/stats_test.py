@@ -0,0 +1,62 @@
+import io
+import json
+import threading
+
+from rcdss import stats
+from rcdss.stats import Event
+
+
+def test_record_in_threads():
+    before = stats.count(Event.OLD_SIG)
+
+    def record(storage, i):
+        stats.setup_stats(storage)
+        for j in range(100):
+            stats.record(f"{j}.{i}.in-addr.arpa.", Event.OLD_SIG)
+
+    for i, storage in enumerate(["list", "compact", "none"]):
+        t = threading.Thread(target=record, args=(storage, i))
+        t.start()
+        t.join()
+    stats.setup_stats()
+    assert stats.count(Event.OLD_SIG) == before + 300
+    domains = list(stats.iter_domains(Event.OLD_SIG))
+    assert domains[-200:] == [
+        f"{j}.{i}.in-addr.arpa." for i in range(2) for j in range(100)
+    ]
+
+    with stats.capture() as events:
+        stats.record("captured.", Event.OLD_SIG)
+    assert events == [("captured.", Event.OLD_SIG)]
+    assert stats.count(Event.OLD_SIG) == before + 300
+
+    output = io.StringIO()
+    stats.dump_domains(output)
+    assert output.getvalue() == json.dumps(
+        {e.name: v for e, v in stats.report_domains().items()}, indent=4,
+    )
+
+
+def test_release_shard():
+    before = stats.count(Event.CDS_CONTINUITY_ERR)
+    shards = len(stats._shards)
+
+    def record(i):
+        stats.record(f"{i}.in-addr.arpa.", Event.CDS_CONTINUITY_ERR)
+        stats.release_shard()
+
+    for i in range(10):
+        t = threading.Thread(target=record, args=(i, ))
+        t.start()
+        t.join()
+    # Only the shard of finished threads is left
+    assert len(stats._shards) <= shards + 1
+    assert stats.count(Event.CDS_CONTINUITY_ERR) == before + 10
+    domains = list(stats.iter_domains(Event.CDS_CONTINUITY_ERR))
+    assert domains[-10:] == [f"{i}.in-addr.arpa." for i in range(10)]
+    # Events of threads started later still come after them
+    t = threading.Thread(target=record, args=(10, ))
+    t.start()
+    t.join()
+    domains = list(stats.iter_domains(Event.CDS_CONTINUITY_ERR))
+    assert domains[-1] == "10.in-addr.arpa."
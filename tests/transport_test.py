@@ -0,0 +1,59 @@
+import socket
+import struct
+import threading
+
+import dns.message
+import dns.rrset
+
+from rcdss import transport
+
+
+def reversing_server(sock, count):
+    """Answer `count` pipelined queries in the reverse order"""
+    conn, _ = sock.accept()
+    queries = []
+    for _ in range(count):
+        (length,) = struct.unpack("!H", conn.recv(2, socket.MSG_WAITALL))
+        queries.append(dns.message.from_wire(
+            conn.recv(length, socket.MSG_WAITALL),
+        ))
+    for q in reversed(queries):
+        r = dns.message.make_response(q)
+        r.answer.append(dns.rrset.from_text(
+            q.question[0].name, 300, "IN", "TXT", f'"{q.id}"',
+        ))
+        wire = r.to_wire()
+        conn.sendall(struct.pack("!H", len(wire)) + wire)
+    conn.close()
+
+
+def test_pipelined_queries():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.listen()
+    port = sock.getsockname()[1]
+    count = 5
+    threading.Thread(
+        target=reversing_server, args=(sock, count), daemon=True,
+    ).start()
+
+    ns = transport.PooledNameserver("127.0.0.1", port)
+    results = {}
+
+    def query(i):
+        q = dns.message.make_query(f"q{i}.example.", "TXT")
+        results[i] = (q, ns.query(q, 5, None, 0, True))
+
+    threads = [
+        threading.Thread(target=query, args=(i,)) for i in range(count)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    sock.close()
+
+    assert len(results) == count
+    for q, r in results.values():
+        assert q.is_response(r)
+        assert r.answer[0].name == q.question[0].name